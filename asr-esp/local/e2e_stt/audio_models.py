@@ -59,14 +59,19 @@ class AudioModel(object):
     
     def get_f0(self, speech):
         #frame_length=800, win_length=400, hop_length=160, center=False, 
-        f0_org_list, voiced_flag, voiced_probs = librosa.pyin(speech, sr=self.sample_rate,
-                                             frame_length=800, hop_length=160, center=True, 
-                                             fmin=librosa.note_to_hz('C2'),
-                                             fmax=librosa.note_to_hz('C7'))
+        if speech.shape[0] == 0 or np.max(np.abs(speech)) == 0:
+            # empty or digital silence: every frame is unvoiced
+            num_frames = 1 + speech.shape[0] // 160
+            f0_org_list, voiced_probs = np.zeros(num_frames), np.zeros(num_frames)
+        else:
+            f0_org_list, voiced_flag, voiced_probs = librosa.pyin(speech, sr=self.sample_rate,
+                                                 frame_length=800, hop_length=160, center=True, 
+                                                 fmin=librosa.note_to_hz('C2'),
+                                                 fmax=librosa.note_to_hz('C7'))
         f0_list = np.nan_to_num(f0_org_list)
         f0_stats = get_stats(f0_list, prefix="f0_")
         f0_stats["f0_list"] = f0_list.tolist()
-        f0_stats["f0_voiced_probs"] = voiced_probs.tolist()
+        f0_stats["f0_voiced_probs"] = np.nan_to_num(voiced_probs).tolist()
         # removed unvoiced frames
         f0_nz_list = f0_list[np.nonzero(f0_list)]
         f0_nz_stats = get_stats(f0_nz_list, prefix="f0_nz_")
@@ -91,8 +96,11 @@ class AudioModel(object):
         return [f0_list, f0_stats]
     
     def get_energy(self, speech):
-        rms = librosa.feature.rms(y=speech, frame_length=800, hop_length=160, center=True)
-        rms_list = rms.reshape(rms.shape[1],)
+        if speech.shape[0] == 0:
+            rms_list = np.zeros(1)
+        else:
+            rms = librosa.feature.rms(y=speech, frame_length=800, hop_length=160, center=True)
+            rms_list = rms.reshape(rms.shape[1],)
         rms_stats = get_stats(rms_list, prefix="energy_")
         rms_stats["energy_rms_list"] = rms_list.tolist()
         
@@ -105,7 +113,7 @@ class AudioModel(object):
         rms_mmn_stats = get_stats(rms_list, prefix="rms_mmn_")
         
         # log norm
-        rms_lgn_list = np.log(rms_list)
+        rms_lgn_list = np.log(np.maximum(rms_list, 1.0e-10))
         rms_lgn_stats = get_stats(rms_lgn_list, prefix="rms_lgn_")
         
         rms_stats = merge_dict(rms_stats, rms_mvn_stats)
@@ -116,6 +124,9 @@ class AudioModel(object):
 
     # mean-var
     def __mvn(self, np_list):
+        if len(np_list) == 0:
+            return np_list
+        
         mean = np.mean(np_list)
         var = np.var(np_list)
         std = np.maximum(np.sqrt(var), 1.0e-20)
@@ -125,9 +136,12 @@ class AudioModel(object):
     
     # mean-max
     def __mmn(self, np_list):
+        if len(np_list) == 0:
+            return np_list
+        
         max_v = np.max(np_list)
         min_v = np.min(np_list)
-        np_list = (np_list - min_v) / (max_v - min_v)
+        np_list = (np_list - min_v) / np.maximum(max_v - min_v, 1.0e-20)
         
         return np_list
     
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+from tqdm import tqdm
+from nlp_models import NlpModel, nlp_profiles
+from lazy_utils import load_times
+import numpy as np
+import argparse
+from runtime_config import add_runtime_args, configure_runtime_from_args
+
+'''
+Per-utterance NLP latency of every stanza profile (nlp_models.nlp_profiles).
+The transcripts are taken from --text_path (e.g., data_dir/model_name/text), the
+result cache is disabled, and the results are written to output_dir/nlp_profiles.json.
+'''
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("--data_dir",
+                    default="/share/nas165/teinhonglo/AcousticModel/2020AESRC/s5/data/cv_56",
+                    type=str)
+
+# "": data_dir/text
+parser.add_argument("--text_path",
+                    default="",
+                    type=str)
+
+parser.add_argument("--output_dir",
+                    default="",
+                    type=str)
+
+parser.add_argument("--profiles",
+                    default="pos,vocab,full",
+                    type=str)
+
+parser.add_argument("--max_utts",
+                    default=200,
+                    type=int)
+
+add_runtime_args(parser)
+args = parser.parse_args()
+configure_runtime_from_args(args)
+
+data_dir = args.data_dir
+text_path = args.text_path
+output_dir = args.output_dir
+
+if text_path == "":
+    text_path = os.path.join(data_dir, "text")
+
+if output_dir == "":
+    output_dir = os.path.join(data_dir, "bench_cpu")
+
+if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+
+texts = []
+
+with open(text_path, "r") as fn:
+    for line in fn.readlines():
+        info = line.split()
+        if len(info) > 1:
+            texts.append(" ".join(info[1:]))
+
+if args.max_utts > 0:
+    texts = texts[:args.max_utts]
+
+bench_info = {"num_utts": len(texts), "profiles": {}}
+
+print("{:<8} {:>10} {:>10} {:>10} {:>10}  {}".format("profile", "load(s)", "mean(ms)", "p50(ms)", "p90(ms)", "processors"))
+for profile in args.profiles.split(","):
+    nlp_model = NlpModel(cache_size=0, profile=profile)
+    # load stanza and the wordlist before timing
+    nlp_model.vocab_profile_feats("warm up")
+    load_time = load_times.pop("stanza pipeline", 0.) + load_times.pop("CEFR wordlist", 0.)
+
+    latencies = []
+    for text in tqdm(texts):
+        start_time = time.time()
+        nlp_model.vocab_profile_feats(text)
+        latencies.append(time.time() - start_time)
+
+    latencies = np.array(latencies) * 1000
+    bench_info["profiles"][profile] = { "processors": nlp_profiles[profile],
+                                        "load_time": load_time,
+                                        "latency_mean_ms": np.mean(latencies),
+                                        "latency_p50_ms": np.percentile(latencies, 50),
+                                        "latency_p90_ms": np.percentile(latencies, 90) }
+    print("{:<8} {:>10.2f} {:>10.1f} {:>10.1f} {:>10.1f}  {}".format(profile, load_time, np.mean(latencies),
+                                                                   np.percentile(latencies, 50), np.percentile(latencies, 90),
+                                                                   nlp_profiles[profile]))
+    del nlp_model
+
+with open(os.path.join(output_dir, "nlp_profiles.json"), "w") as fn:
+    json.dump(bench_info, fn, indent=4)
+
+print(output_dir)
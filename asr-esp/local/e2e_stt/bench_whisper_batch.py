@@ -0,0 +1,137 @@
+import os
+import json
+import time
+from tqdm import tqdm
+from vad_model import VadModel
+import whisper
+from whisper.tokenizer import get_tokenizer
+import argparse
+from runtime_config import add_runtime_args, configure_runtime_from_args
+from lazy_utils import get_suppress_tokens
+from whisper_batch import decode_segments, get_decode_options
+
+'''
+Throughput of the batched whisper decoding (prepare_feats_whisper.py --batch_size) on CPU.
+The VAD segments of the first --max_utts utterances are decoded with every batch size in
+--batch_sizes, and segments/s and RTF are written to output_dir/whisper_batch.json.
+'''
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("--data_dir",
+                    default="/share/nas165/teinhonglo/AcousticModel/2020AESRC/s5/data/cv_56",
+                    type=str)
+
+parser.add_argument("--output_dir",
+                    default="",
+                    type=str)
+
+parser.add_argument("--model_tag",
+                    default="base.en",
+                    type=str)
+
+parser.add_argument("--device",
+                    default="cpu",
+                    type=str)
+
+parser.add_argument("--language",
+                    default="en",
+                    type=str)
+
+parser.add_argument("--batch_sizes",
+                    default="1,2,4,8,16",
+                    type=str)
+
+parser.add_argument("--max_utts",
+                    default=50,
+                    type=int)
+
+parser.add_argument("--sample_rate",
+                    default=16000,
+                    type=int)
+
+parser.add_argument("--vad_mode",
+                    default=1,
+                    type=int)
+
+parser.add_argument("--max_segment_length",
+                    default=15,
+                    type=int)
+
+parser.add_argument("--suppress_numeric_tokens", action="store_true")
+
+parser.add_argument("--suppress_punc_tokens", action="store_true")
+
+add_runtime_args(parser)
+args = parser.parse_args()
+configure_runtime_from_args(args)
+
+data_dir = args.data_dir
+output_dir = args.output_dir
+sample_rate = args.sample_rate
+
+if output_dir == "":
+    output_dir = os.path.join(data_dir, "bench_cpu")
+
+if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+
+wavscp_dict = {}
+utt_list = []
+
+with open(data_dir + "/wav.scp", "r") as fn:
+    for i, line in enumerate(fn.readlines()):
+        info = line.split()
+        wavscp_dict[info[0]] = info[1]
+        utt_list.append(info[0])
+
+if args.max_utts > 0:
+    utt_list = utt_list[:args.max_utts]
+
+suppress_tokens = [-1]
+numeric_tokens, punc_tokens = get_suppress_tokens(get_tokenizer(multilingual=False), numeric_chars="0123456789", punc_chars="!?-,.")
+
+if args.suppress_numeric_tokens:
+    suppress_tokens += numeric_tokens
+
+if args.suppress_punc_tokens:
+    suppress_tokens += punc_tokens
+
+vad_model = VadModel(mode=args.vad_mode, sample_rate=sample_rate, max_segment_length=args.max_segment_length)
+segments = []
+
+for uttid in tqdm(utt_list):
+    audio, rate = vad_model.read_wave(wavscp_dict[uttid])
+    segments += vad_model.get_speech_segments(audio, rate)
+
+audio_duration = sum([len(segment) for segment in segments]) / sample_rate
+
+speech_model = whisper.load_model(args.model_tag, device=args.device)
+options = get_decode_options(None if args.language == "none" else args.language, suppress_tokens, args.device)
+
+# warm-up
+decode_segments(speech_model, segments[:1], options)
+
+bench_info = { "model_tag": args.model_tag,
+               "device": args.device,
+               "num_utts": len(utt_list),
+               "num_segments": len(segments),
+               "audio_duration": audio_duration,
+               "batch_sizes": {} }
+
+print("{:>6} {:>10} {:>12} {:>8}".format("batch", "time(s)", "segments/s", "RTF"))
+for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+    start_time = time.time()
+    for i in range(0, len(segments), batch_size):
+        decode_segments(speech_model, segments[i:i + batch_size], options)
+    proc_time = time.time() - start_time
+
+    bench_info["batch_sizes"][batch_size] = { "proc_time": proc_time,
+                                              "segments_per_second": len(segments) / proc_time,
+                                              "rtf": proc_time / audio_duration }
+    print("{:>6} {:>10.1f} {:>12.2f} {:>8.3f}".format(batch_size, proc_time, len(segments) / proc_time, proc_time / audio_duration))
+
+with open(os.path.join(output_dir, "whisper_batch.json"), "w") as fn:
+    json.dump(bench_info, fn, indent=4)
+
+print(output_dir)
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+from tqdm import tqdm
+import numpy as np
+import soundfile
+import argparse
+from runtime_config import add_runtime_args, configure_runtime_from_args
+
+'''
+RTF benchmark of the whisperx CPU profile against the ESPnet backend on the same wavs.
+
+The backends usually live in different conda envs, so each run only benchmarks the
+backends given in --backends, writes rtf_<backend>.json to --output_dir and then
+prints a table of every rtf_*.json found there, e.g.,
+    (whisperx env) python local/e2e_stt/bench_whisperx_cpu.py --backends whisperx
+    (espnet env)   python local/e2e_stt/bench_whisperx_cpu.py --backends espnet
+'''
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("--data_dir",
+                    default="/share/nas165/teinhonglo/AcousticModel/2020AESRC/s5/data/cv_56",
+                    type=str)
+
+parser.add_argument("--output_dir",
+                    default="",
+                    type=str)
+
+parser.add_argument("--backends",
+                    default="whisperx,espnet",
+                    type=str)
+
+parser.add_argument("--max_utts",
+                    default=50,
+                    type=int)
+
+parser.add_argument("--sample_rate",
+                    default=16000,
+                    type=int)
+
+# whisperx
+parser.add_argument("--whisperx_tag",
+                    default="large-v2",
+                    type=str)
+
+parser.add_argument("--language",
+                    default="en",
+                    type=str)
+
+parser.add_argument("--compute_type",
+                    default=None,
+                    type=str)
+
+parser.add_argument("--batch_size",
+                    default=None,
+                    type=int)
+
+parser.add_argument("--cpu_threads",
+                    default=None,
+                    type=int)
+
+# espnet
+parser.add_argument("--espnet_tag",
+                    default="Shinji Watanabe/gigaspeech_asr_train_asr_raw_en_bpe5000_valid.acc.ave",
+                    type=str)
+
+parser.add_argument("--vad_mode",
+                    default=1,
+                    type=int)
+
+parser.add_argument("--max_segment_length",
+                    default=15,
+                    type=int)
+
+add_runtime_args(parser)
+args = parser.parse_args()
+configure_runtime_from_args(args)
+
+data_dir = args.data_dir
+output_dir = args.output_dir
+sample_rate = args.sample_rate
+
+if output_dir == "":
+    output_dir = os.path.join(data_dir, "bench_cpu")
+
+if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+
+wavscp_dict = {}
+utt_list = []
+
+with open(data_dir + "/wav.scp", "r") as fn:
+    for i, line in enumerate(fn.readlines()):
+        info = line.split()
+        wavscp_dict[info[0]] = info[1]
+        utt_list.append(info[0])
+
+if args.max_utts > 0:
+    utt_list = utt_list[:args.max_utts]
+
+total_duration = 0.
+for uttid in utt_list:
+    total_duration += soundfile.info(wavscp_dict[uttid]).duration
+
+
+def bench_whisperx():
+    from whisperx_models import SpeechModel
+
+    start_time = time.time()
+    speech_model = SpeechModel(tag=args.whisperx_tag, device="cpu", language=args.language,
+                               compute_type=args.compute_type, batch_size=args.batch_size,
+                               cpu_threads=args.cpu_threads)
+    load_time = time.time() - start_time
+
+    # warm-up (first call allocates the CTranslate2/torch buffers)
+    speech_model.recog(wavscp_dict[utt_list[0]])
+
+    start_time = time.time()
+    for uttid in tqdm(utt_list):
+        try:
+            speech_model.recog(wavscp_dict[uttid])
+        except Exception as e:
+            print(uttid, e)
+    proc_time = time.time() - start_time
+
+    settings = { "compute_type": speech_model.compute_type,
+                 "batch_size": speech_model.batch_size,
+                 "cpu_threads": speech_model.cpu_threads }
+
+    return load_time, proc_time, settings
+
+
+def bench_espnet():
+    from espnet_models import SpeechModel
+    from vad_model import VadModel
+
+    start_time = time.time()
+    speech_model = SpeechModel(args.espnet_tag)
+    vad_model = VadModel(mode=args.vad_mode, sample_rate=sample_rate, max_segment_length=args.max_segment_length)
+    load_time = time.time() - start_time
+
+    start_time = time.time()
+    for uttid in tqdm(utt_list):
+        # same steps as recog() of whisperx: VAD, decoding and word alignment
+        audio, rate = vad_model.read_wave(wavscp_dict[uttid])
+        speech = np.frombuffer(audio, dtype='int16').astype(np.float32) / 32768.0
+        text = []
+        for speech_seg in vad_model.get_speech_segments(audio, rate):
+            text.append(speech_model.recog(speech_seg))
+        text = " ".join(" ".join(text).split())
+        if text != "":
+            speech_model.get_ctm(speech, text)
+    proc_time = time.time() - start_time
+
+    import torch
+    settings = { "cpu_threads": torch.get_num_threads() }
+
+    return load_time, proc_time, settings
+
+
+bench_funcs = {"whisperx": bench_whisperx, "espnet": bench_espnet}
+
+for backend in args.backends.split(","):
+    print("Benchmarking", backend)
+    load_time, proc_time, settings = bench_funcs[backend]()
+    bench_info = { "backend": backend,
+                   "num_utts": len(utt_list),
+                   "audio_duration": total_duration,
+                   "load_time": load_time,
+                   "proc_time": proc_time,
+                   "rtf": proc_time / total_duration,
+                   "settings": settings }
+
+    with open(os.path.join(output_dir, "rtf_" + backend + ".json"), "w") as fn:
+        json.dump(bench_info, fn, indent=4)
+
+# compare every backend benchmarked on this data dir
+print("{:<10} {:>6} {:>10} {:>10} {:>8}  {}".format("backend", "utts", "audio(s)", "load(s)", "RTF", "settings"))
+for backend in bench_funcs.keys():
+    bench_path = os.path.join(output_dir, "rtf_" + backend + ".json")
+    if not os.path.exists(bench_path):
+        continue
+    with open(bench_path, "r") as fn:
+        bench_info = json.load(fn)
+    print("{:<10} {:>6} {:>10.1f} {:>10.1f} {:>8.3f}  {}".format(backend, bench_info["num_utts"], bench_info["audio_duration"],
+                                                               bench_info["load_time"], bench_info["rtf"], bench_info["settings"]))
@@ -4,11 +4,14 @@ from espnet2.bin.asr_align import CTCSegmentation
 
 import os
 import numpy as np
+import torch
 import json
 import soundfile
 from collections import defaultdict
 from tqdm import tqdm
 from g2p_en import G2p
+from lazy_utils import lazy_component, timed
+from runtime_config import get_num_threads
 
 
 '''
@@ -55,29 +58,46 @@ def get_stats(numeric_list, prefix=""):
     
     
 class SpeechModel(object):
-    def __init__(self, tag, is_download=True, cache_dir="./downloads"):
+    def __init__(self, tag, is_download=True, cache_dir="./downloads", 
+                beam_size=20, ctc_weight=0.3, lm_weight=0.3, use_lm=True):
+        # torch uses a process-wide pool, apply the budget of the worker (runtime_config)
+        if get_num_threads() is not None:
+            torch.set_num_threads(get_num_threads())
         # STT
         if is_download:
             d=ModelDownloader(cachedir=cache_dir)
             asr_model = d.download_and_unpack(tag)
-            self.speech2text = Speech2Text.from_pretrained(
-                **asr_model,
-                device="cpu",
-                maxlenratio=0.0,
-                minlenratio=0.0,
-                beam_size=20,
-                ctc_weight=0.3,
-                lm_weight=0.3,
-                penalty=0.0,
-                nbest=1
-            )
-            self.aligner = CTCSegmentation(**asr_model, fs=16000, ngpu=0, kaldi_style_text=False, time_stamps="auto")
+            s2t_model = dict(asr_model)
+            
+            if not use_lm:
+                # decode without the external language model
+                s2t_model.pop("lm_train_config", None)
+                s2t_model.pop("lm_file", None)
+                lm_weight = 0.0
+            
+            with timed("espnet speech2text"):
+                self.speech2text = Speech2Text.from_pretrained(
+                    **s2t_model,
+                    device="cpu",
+                    maxlenratio=0.0,
+                    minlenratio=0.0,
+                    beam_size=beam_size,
+                    ctc_weight=ctc_weight,
+                    lm_weight=lm_weight,
+                    penalty=0.0,
+                    nbest=1
+                )
+            with timed("espnet aligner"):
+                self.aligner = CTCSegmentation(**asr_model, fs=16000, ngpu=0, kaldi_style_text=False, time_stamps="auto")
         # Fluency
         self.sil_seconds = 0.145
         self.long_sil_seconds = 0.495
         self.disflunecy_words = ["AH", "UM", "UH", "EM", "OH"]
         self.special_words = ["<UNK>"]
-        self.g2p = G2p()
+    
+    @lazy_component("g2p")
+    def g2p(self):
+        return G2p()
     
     # STT features
     def recog(self, speech):
@@ -122,6 +142,48 @@ class SpeechModel(object):
         
         return ctm_info
     
+    def get_ctm_windowed(self, speech, segment_times, segment_texts, overlap=0.25, sample_rate=16000):
+        """
+        Windowed alignment for long recordings (the trellis of get_ctm grows with frames x tokens).
+        Every VAD segment (start, end in seconds) is aligned with its own hypothesis, widened by
+        overlap seconds on both sides, and the word timings are shifted back to the whole recording.
+        If a window cannot be aligned, its words are spread uniformly over the segment with conf 0.
+        Returns the ctm of the whole recording, [word, start, dur, conf].
+        """
+        ctm_info = []
+        total_duration = speech.shape[0] / sample_rate
+        
+        for (seg_start, seg_end), seg_text in zip(segment_times, segment_texts):
+            words = seg_text.split()
+            if len(words) == 0:
+                continue
+            
+            win_start = max(0., seg_start - overlap)
+            win_end = min(total_duration, seg_end + overlap)
+            speech_win = speech[int(win_start * sample_rate): int(win_end * sample_rate)]
+            
+            try:
+                seg_ctm_info = self.get_ctm(speech_win, seg_text)
+            except Exception as e:
+                # e.g., more tokens than frames
+                print("windowed alignment failed ({:.2f}-{:.2f}): {}".format(seg_start, seg_end, e))
+                word_duration = (seg_end - seg_start) / len(words)
+                seg_ctm_info = [ [word, seg_start - win_start + j * word_duration, word_duration, 0.]
+                                 for j, word in enumerate(words) ]
+            
+            for word, start_time, duration, conf in seg_ctm_info:
+                start_time = start_time + win_start
+                end_time = start_time + duration
+                
+                # windows overlap, keep the words in time order
+                if len(ctm_info) > 0:
+                    start_time = max(start_time, ctm_info[-1][1] + ctm_info[-1][2])
+                    end_time = max(end_time, start_time)
+                
+                ctm_info.append([word, round(start_time, 4), round(end_time - start_time, 4), conf])
+        
+        return ctm_info
+    
     def get_phone_ctm(self, ctm_info):
         # use g2p model
         phone_ctm_info = []
@@ -182,14 +244,14 @@ class SpeechModel(object):
         num_long_sils = len(long_sil_list)
         num_words = len(ctm_info)
         
-        sil_stats["sil_rate1"] = num_sils / response_duration
+        sil_stats["sil_rate1"] = num_sils / response_duration if response_duration > 0 else 0
         
         if num_words > 0:
             sil_stats["sil_rate2"] = num_sils / num_words
         else:
             sil_stats["sil_rate2"] = 0
         
-        long_sil_stats["long_sil_rate1"] = num_long_sils / response_duration 
+        long_sil_stats["long_sil_rate1"] = num_long_sils / response_duration if response_duration > 0 else 0
         
         if num_words > 0:
             long_sil_stats["long_sil_rate2"] = num_long_sils / num_words
@@ -239,7 +301,7 @@ class SpeechModel(object):
         # word in articlulation time
         word_count = sum(list(word_count_dict.values()))
         word_distinct = len(list(word_count_dict.keys()))
-        word_freq = word_count / response_duration
+        word_freq = word_count / response_duration if response_duration > 0 else 0
         word_duration_stats = get_stats(word_duration_list, prefix = "word_duration_")
         word_conf_stats = get_stats(word_conf_list, prefix="word_conf_")
         
@@ -277,7 +339,7 @@ class SpeechModel(object):
         # strat_time and duration of last phone
         # word in articlulation time
         phone_count = sum(list(phone_count_dict.values()))
-        phone_freq = phone_count / response_duration
+        phone_freq = phone_count / response_duration if response_duration > 0 else 0
         phone_duration_stats = get_stats(phone_duration_list, prefix = "phone_duration_")
         phone_conf_stats = get_stats(phone_conf_list, prefix="phone_conf_")
         
@@ -4,11 +4,14 @@ from espnet2.bin.asr_align import CTCSegmentation
 
 import os
 import numpy as np
+import torch
 import json
 import soundfile
 from collections import defaultdict
 from tqdm import tqdm
 from g2p_en import G2p
+from lazy_utils import lazy_component, timed
+from runtime_config import get_num_threads
 
 
 '''
@@ -56,28 +59,39 @@ def get_stats(numeric_list, prefix=""):
     
 class SpeechModel(object):
     def __init__(self, tag, is_download=True, cache_dir="./downloads"):
+        # torch uses a process-wide pool, apply the budget of the worker (runtime_config)
+        if get_num_threads() is not None:
+            torch.set_num_threads(get_num_threads())
         # STT
         if is_download:
             d=ModelDownloader(cachedir=cache_dir)
             asr_model = d.download_and_unpack(tag)
-            self.speech2text = Speech2Text(
-                **asr_model,
-                device="cpu",
-                maxlenratio=0.0,
-                minlenratio=0.0,
-                beam_size=20,
-                ctc_weight=0.3,
-                lm_weight=0.3,
-                penalty=0.0,
-                nbest=1
-            )
-            self.aligner = CTCSegmentation(**asr_model, fs=16000, ngpu=0, kaldi_style_text=False, time_stamps="auto")
+            with timed("espnet speech2text"):
+                self.speech2text = Speech2Text(
+                    **asr_model,
+                    device="cpu",
+                    maxlenratio=0.0,
+                    minlenratio=0.0,
+                    beam_size=20,
+                    ctc_weight=0.3,
+                    lm_weight=0.3,
+                    penalty=0.0,
+                    nbest=1
+                )
+            with timed("espnet aligner"):
+                self.aligner = CTCSegmentation(**asr_model, fs=16000, ngpu=0, kaldi_style_text=False, time_stamps="auto")
         # Fluency
         self.sil_seconds = 0.145
         self.long_sil_seconds = 0.495
         self.disflunecy_words = ["AH", "UM", "UH", "EM", "OH"]
         self.special_words = ["<UNK>"]
-        self.g2p = G2p()
+        # streaming
+        self.partial_text = ""
+        self.min_final_samples = 400
+    
+    @lazy_component("g2p")
+    def g2p(self):
+        return G2p()
     
     # STT features
     def recog(self, speech):
@@ -86,6 +100,37 @@ class SpeechModel(object):
         #text = self.asr_text_post_processing(text)
         return text
     
+    # Incremental STT: start() -> accept(chunk) * N -> finish(last_chunk)
+    def start(self):
+        # drop the frontend/encoder/beam-search states of the previous stream
+        self.speech2text.reset()
+        self.partial_text = ""
+    
+    def accept(self, chunk):
+        # returns the best partial hypothesis so far (may be unchanged)
+        nbests = self.speech2text(speech=chunk, is_final=False)
+        
+        if nbests is not None and len(nbests) > 0:
+            text, *_ = nbests[0]
+            self.partial_text = text
+        
+        return self.partial_text
+    
+    def finish(self, chunk=None):
+        # flush the buffered audio and return the final hypothesis
+        if chunk is None or len(chunk) == 0:
+            chunk = np.zeros(self.min_final_samples, dtype=np.float32)
+        
+        nbests = self.speech2text(speech=chunk, is_final=True)
+        
+        if nbests is not None and len(nbests) > 0:
+            text, *_ = nbests[0]
+        else:
+            text = self.partial_text
+        
+        self.partial_text = ""
+        return text
+    
     def asr_text_post_processing(self, text):
         # 1. convert to uppercase
         text = text.upper()
@@ -182,14 +227,14 @@ class SpeechModel(object):
         num_long_sils = len(long_sil_list)
         num_words = len(ctm_info)
         
-        sil_stats["sil_rate1"] = num_sils / response_duration
+        sil_stats["sil_rate1"] = num_sils / response_duration if response_duration > 0 else 0
         
         if num_words > 0:
             sil_stats["sil_rate2"] = num_sils / num_words
         else:
             sil_stats["sil_rate2"] = 0
         
-        long_sil_stats["long_sil_rate1"] = num_long_sils / response_duration 
+        long_sil_stats["long_sil_rate1"] = num_long_sils / response_duration if response_duration > 0 else 0
         
         if num_words > 0:
             long_sil_stats["long_sil_rate2"] = num_long_sils / num_words
@@ -239,7 +284,7 @@ class SpeechModel(object):
         # word in articlulation time
         word_count = sum(list(word_count_dict.values()))
         word_distinct = len(list(word_count_dict.keys()))
-        word_freq = word_count / response_duration
+        word_freq = word_count / response_duration if response_duration > 0 else 0
         word_duration_stats = get_stats(word_duration_list, prefix = "word_duration_")
         word_conf_stats = get_stats(word_conf_list, prefix="word_conf_")
         
@@ -277,7 +322,7 @@ class SpeechModel(object):
         # strat_time and duration of last phone
         # word in articlulation time
         phone_count = sum(list(phone_count_dict.values()))
-        phone_freq = phone_count / response_duration
+        phone_freq = phone_count / response_duration if response_duration > 0 else 0
         phone_duration_stats = get_stats(phone_duration_list, prefix = "phone_duration_")
         phone_conf_stats = get_stats(phone_conf_list, prefix="phone_conf_")
         
@@ -7,11 +7,14 @@ data_sets="l2_arctic"
 model_name="gigaspeech"
 model_tag="Shinji Watanabe/gigaspeech_asr_train_asr_raw_en_bpe5000_valid.acc.ave"
 use_streaming=false
+streaming_options="" # e.g., "--chunk_seconds 0.5 --latency_benchmark"
 stage=0
 gpuid=0
 # vad parameters
 vad_mode=0
 max_segment_length=15
+# recordings longer than this (seconds) are aligned per VAD segment, 0: always align the whole recording
+align_window_threshold=60
 
 . ./path.sh
 . ./cmd.sh
@@ -27,7 +30,11 @@ if [ $stage -le 0 ]; then
         if [ "$use_streaming" == "false" ]; then
             CUDA_VISIBLE_DEVICES=$gpuid \
                 python local/e2e_stt/prepare_feats.py --data_dir $data_root/$data_set --model_name $model_name \
-                                                  --model_tag "$model_tag"
+                                                  --model_tag "$model_tag" --align_window_threshold $align_window_threshold
+        else
+            CUDA_VISIBLE_DEVICES=$gpuid \
+                python local/e2e_stt/prepare_feats_streaming.py --data_dir $data_root/$data_set --model_name $model_name \
+                                                  --model_tag "$model_tag" $streaming_options
         fi
     done
 fi
@@ -7,6 +7,7 @@ data_sets="l2_arctic"
 model_name="gigaspeech"
 model_tag="Shinji Watanabe/gigaspeech_asr_train_asr_raw_en_bpe5000_valid.acc.ave"
 use_streaming=false
+num_decoders=1   # streaming only: utterances decoded concurrently
 stage=0
 # vad parameters
 vad_mode=0
@@ -28,7 +29,8 @@ if [ $stage -le 0 ]; then
                                                   --model_tag "$model_tag" --vad_mode $vad_mode --max_segment_length $max_segment_length
         else
             python local/e2e_stt/prepare_feats_wenet_streaming.py --data_dir $data_root/$data_set --model_name $model_name \
-                                              --model_tag "$model_tag" --vad_mode $vad_mode --max_segment_length $max_segment_length
+                                              --model_tag "$model_tag" --vad_mode $vad_mode --max_segment_length $max_segment_length \
+                                              --num_decoders $num_decoders
         fi
     done
 fi
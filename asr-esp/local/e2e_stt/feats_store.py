@@ -0,0 +1,99 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+'''
+Columnar feature store, a replacement of the all.json -> xlsx round trip.
+<name>.npz holds
+    feats:      float32 matrix, one column per scalar feature (lists such as f0_list are not stored)
+    feat_keys:  names of the columns
+    fname, spkID, part, qID, prompt, stt: metadata columns (same as prep/json2xlsx.py)
+and <name>.schema.json describes it.
+
+Also imported by the grader (grader/local/feats_loader.py adds this directory to sys.path).
+'''
+
+meta_keys = ["fname", "spkID", "part", "qID", "prompt", "stt"]
+store_version = 1
+
+
+def get_schema_path(store_path):
+    return os.path.splitext(store_path)[0] + ".schema.json"
+
+
+def get_meta(uttid, utt_info):
+    # the same fields as prep/json2xlsx.py
+    fname = utt_info["wav_path"].split("/")[-1].split(".")[0]
+    return { "fname": fname,
+             "spkID": uttid.split("-")[0],
+             "part": uttid.split("-")[1],
+             "qID": "-".join(uttid.split("-")[1:3]),
+             "prompt": utt_info["prompt"],
+             "stt": utt_info["stt"] }
+
+
+def all_info_to_table(all_info):
+    """
+    all_info: {uttid: {"wav_path", "prompt", "stt", "feats": {...}}} (all.json)
+    Returns (meta, feat_keys, feats)
+    """
+    uttids = [ uttid for uttid in all_info if "feats" in all_info[uttid] ]
+    meta = {mk: [] for mk in meta_keys}
+    feat_keys = []
+
+    if len(uttids) > 0:
+        # scalar features, in the order of the first utterance (same columns as all.xlsx)
+        first_feats = all_info[uttids[0]]["feats"]
+        feat_keys = [ k for k, v in first_feats.items() if isinstance(v, (int, float, bool, np.integer, np.floating)) ]
+
+    feats = np.zeros((len(uttids), len(feat_keys)), dtype=np.float32)
+
+    for i, uttid in enumerate(uttids):
+        for mk, mv in get_meta(uttid, all_info[uttid]).items():
+            meta[mk].append(mv)
+        utt_feats = all_info[uttid]["feats"]
+        feats[i] = [ float(utt_feats.get(fk, np.nan)) for fk in feat_keys ]
+
+    return meta, feat_keys, feats
+
+
+def write_feats_store(store_path, meta, feat_keys, feats, extra_schema={}):
+    columns = { mk: np.array(meta[mk], dtype=str) for mk in meta_keys }
+    np.savez(store_path, feats=np.asarray(feats, dtype=np.float32), feat_keys=np.array(feat_keys, dtype=str), **columns)
+
+    schema = { "version": store_version,
+               "num_utts": int(feats.shape[0]),
+               "dtype": "float32",
+               "meta_keys": meta_keys,
+               "feat_keys": list(feat_keys),
+               **extra_schema }
+
+    with open(get_schema_path(store_path), "w") as fn:
+        json.dump(schema, fn, indent=4)
+
+
+def read_feats_schema(store_path):
+    with open(get_schema_path(store_path), "r") as fn:
+        return json.load(fn)
+
+
+def read_feats_store(store_path):
+    with np.load(store_path) as store:
+        meta = { mk: store[mk] for mk in meta_keys }
+        return meta, store["feat_keys"], store["feats"]
+
+
+def read_feats_table(feats_path):
+    """
+    DataFrame with the metadata columns followed by the feature columns.
+    .npz stores give float32 features, xlsx files are read as before (all columns as str).
+    """
+    if feats_path.endswith(".npz"):
+        meta, feat_keys, feats = read_feats_store(feats_path)
+        feats_df = pd.DataFrame(feats, columns=feat_keys)
+        for i, mk in enumerate(meta_keys):
+            feats_df.insert(i, mk, meta[mk])
+        return feats_df
+
+    return pd.read_excel(feats_path, dtype=str)
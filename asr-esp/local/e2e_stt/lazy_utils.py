@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import pickle
+import functools
+from collections import OrderedDict
+
+'''
+Helpers for a fast start-up of the feature extraction jobs:
+    timed / lazy_component: construct heavy components on first use and record how long it took
+    get_cache_dir: where derived artifacts (token lists, lexicons, ...) are persisted
+'''
+
+# seconds spent on constructing each component, in load order
+load_times = OrderedDict()
+
+
+class timed(object):
+    """Context manager that adds the elapsed time of its block to load_times[name]."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        load_times[self.name] = load_times.get(self.name, 0.) + time.time() - self.start_time
+        return False
+
+
+def lazy_component(name):
+    """
+    Turns a loader method into a read-only property that is evaluated on first access.
+    The result is kept in self._<method name> and the load time is recorded under name.
+    """
+    def decorator(load_fn):
+        attr = "_" + load_fn.__name__
+
+        @property
+        @functools.wraps(load_fn)
+        def wrapper(self):
+            if getattr(self, attr, None) is None:
+                with timed(name):
+                    setattr(self, attr, load_fn(self))
+            return getattr(self, attr)
+
+        return wrapper
+    return decorator
+
+
+def report_load_times():
+    print("Start-up time per component (seconds)")
+    for name, seconds in load_times.items():
+        print("    {:<30} {:.2f}".format(name, seconds))
+
+
+def get_cache_dir():
+    cache_dir = os.environ.get("DHE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "dhe_spoken_test"))
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    return cache_dir
+
+
+def dump_json_atomic(obj, path):
+    # several workers may build the same cache file at the same time
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as fn:
+        json.dump(obj, fn)
+    os.replace(tmp_path, path)
+
+
+def dump_pickle_atomic(obj, path):
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as fn:
+        pickle.dump(obj, fn, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def get_suppress_tokens(tokenizer, numeric_chars="0123456789", punc_chars="!?-,."):
+    """
+    Token ids whose text consists only of numeric_chars (numeric_tokens) or punc_chars (punc_tokens).
+    Decoding every id up to tokenizer.eot takes a while, so the lists are persisted in get_cache_dir().
+    """
+    encoding_name = getattr(getattr(tokenizer, "encoding", None), "name", "gpt2")
+    cache_key = "{}_{}_{}_{}".format(encoding_name, tokenizer.eot, numeric_chars, punc_chars)
+    cache_path = os.path.join(get_cache_dir(), "whisper_suppress_tokens.json")
+    token_cache = {}
+
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as fn:
+            token_cache = json.load(fn)
+
+        if cache_key in token_cache:
+            return token_cache[cache_key]["numeric_tokens"], token_cache[cache_key]["punc_tokens"]
+
+    numeric_tokens = []
+    punc_tokens = []
+
+    for i in range(tokenizer.eot):
+        token_text = tokenizer.decode([i]).removeprefix(" ")
+        if all(c in numeric_chars for c in token_text):
+            numeric_tokens.append(i)
+        if all(c in punc_chars for c in token_text):
+            punc_tokens.append(i)
+
+    token_cache[cache_key] = {"numeric_tokens": numeric_tokens, "punc_tokens": punc_tokens}
+    dump_json_atomic(token_cache, cache_path)
+
+    return numeric_tokens, punc_tokens
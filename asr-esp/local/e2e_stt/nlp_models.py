@@ -1,13 +1,18 @@
 import os
 import numpy as np
+import torch
 import json
 import soundfile
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from tqdm import tqdm
 from g2p_en import G2p
 import re
+import pickle
+import hashlib
 import stanza
 import pandas as pd
+from lazy_utils import lazy_component, get_cache_dir, dump_pickle_atomic, dump_json_atomic
+from runtime_config import get_num_threads
 
 
 '''
@@ -15,6 +20,14 @@ import argparse
 parser = argparse.ArgumentParser()
 args = parser.parse_args()
 '''
+# stanza processors of each profile, a run only pays for the features it uses
+#   pos:   pos_*, mor_list (vp_* are all zero, there are no lemmas)
+#   vocab: + lemma for the CEFR vocabulary profile (vp_*)
+#   full:  + depparse (dep_list)
+nlp_profiles = { "pos": "tokenize,mwt,pos",
+                 "vocab": "tokenize,mwt,pos,lemma",
+                 "full": "tokenize,mwt,pos,lemma,depparse" }
+
 def merge_dict(first_dict, second_dict):
     third_dict = {**first_dict, **second_dict}
     return third_dict
@@ -55,39 +68,170 @@ def get_stats(numeric_list, prefix=""):
     
 class NlpModel(object):
     def __init__(self, tokenize_pretokenized=False, 
-                cefr_dict_path="/share/nas167/teinhonglo/AcousticModel/spoken_test/corpus/speaking/CEFR-J_Wordlist_Ver1.6.xlsx"):
-                #cefr_dict_path="/share/nas167/teinhonglo/AcousticModel/spoken_test/corpus/speaking/CEFR-J_Wordlist_Ver1.6_with_C1C2.xlsx"):
+                cefr_dict_path="/share/nas167/teinhonglo/AcousticModel/spoken_test/corpus/speaking/CEFR-J_Wordlist_Ver1.6.xlsx",
+                #cefr_dict_path="/share/nas167/teinhonglo/AcousticModel/spoken_test/corpus/speaking/CEFR-J_Wordlist_Ver1.6_with_C1C2.xlsx",
+                cache_size=10000, cache_dir=None, profile="full"):
+        
+        # torch uses a process-wide pool, apply the budget of the worker (runtime_config)
+        if get_num_threads() is not None:
+            torch.set_num_threads(get_num_threads())
+        # stanza and the CEFR wordlist are loaded on first use
+        self.tokenize_pretokenized = tokenize_pretokenized
+        self.cefr_dict_path = cefr_dict_path
+        self.profile = profile
+        self.processors = nlp_profiles[profile]
+        # results of repeated transcripts: in-process LRU (cache_size entries) and
+        # an optional on-disk tier shared by several runs/workers (cache_dir)
+        self.feats_cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_dir = cache_dir
+        self.cache_queries = 0
+        self.cache_hits = 0
         
-        self.nlp_tokenize = stanza.Pipeline(lang='en', processors='tokenize,mwt,pos,lemma,depparse', use_gpu='False', tokenize_pretokenized=tokenize_pretokenized)
-        self.cefr_dict = self.__build_cefr_dict(cefr_dict_path)
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
         self.cefr_levels = ["a1", "a2", "b1", "b2"]
         self.pos_tags = ["ADJ", "ADP", "ADV", "AUX", 
                         "CCONJ", "DET", "INTJ", "NOUN", 
                         "NUM", "PART", "PRON", "PROPN", 
                         "PUNCT", "SCONJ", "SYM", "VERB", "X"]
     
+    @lazy_component("stanza pipeline")
+    def nlp_tokenize(self):
+        return stanza.Pipeline(lang='en', processors=self.processors, use_gpu='False', tokenize_pretokenized=self.tokenize_pretokenized)
+    
+    @lazy_component("CEFR wordlist")
+    def cefr_dict(self):
+        """
+        {lemma: {upos: cefr level}}
+        Reading the xlsx is slow, so the compiled lexicon is pickled in get_cache_dir()
+        and rebuilt only when the xlsx is modified.
+        """
+        cefr_dict_path = os.path.abspath(self.cefr_dict_path)
+        path_hash = hashlib.md5(cefr_dict_path.encode("utf-8")).hexdigest()[:8]
+        cache_path = os.path.join(get_cache_dir(), "cefr_{}_{}.pkl".format(os.path.basename(cefr_dict_path), path_hash))
+        mtime = os.path.getmtime(cefr_dict_path)
+        
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as fn:
+                cefr_cache = pickle.load(fn)
+            if cefr_cache["mtime"] == mtime:
+                return cefr_cache["cefr_dict"]
+        
+        cefr_dict = self.__build_cefr_dict(cefr_dict_path)
+        dump_pickle_atomic({"mtime": mtime, "cefr_dict": cefr_dict}, cache_path)
+        
+        return cefr_dict
+    
     def __build_cefr_dict(self, cefr_dict_path):
         cefr_dict = defaultdict(dict)
-        pos_conv_dict = {}
         
         cefr_vocab_df = pd.read_excel(cefr_dict_path, sheet_name="ALL", usecols=["headword", "pos", "CEFR"])
         pos_conv_df = pd.read_excel(cefr_dict_path, sheet_name="POS", usecols=["upos", "pos"])
+        pos_conv_dict = dict(zip(pos_conv_df["pos"], pos_conv_df["upos"]))
         
-        for i in range(len(pos_conv_df["pos"])):
-            pos_conv_dict[pos_conv_df["pos"][i]] = pos_conv_df["upos"][i]
-        
-        for i in range(len(cefr_vocab_df["headword"])):
-            words = cefr_vocab_df["headword"][i]
-            pos = cefr_vocab_df["pos"][i]
-            cefr = cefr_vocab_df["CEFR"][i]
-            
+        for words, pos, cefr in zip(cefr_vocab_df["headword"].values, cefr_vocab_df["pos"].values, cefr_vocab_df["CEFR"].str.lower().values):
             for upos in pos_conv_dict[pos].split("/"):
                 for word in words.split("/"):
-                    cefr_dict[word][upos] = cefr.lower()
-            
-        return cefr_dict
+                    cefr_dict[word][upos] = cefr
+        
+        # plain dict: lookups of unknown lemmas must not add entries
+        return dict(cefr_dict)
      
     def vocab_profile_feats(self, text):
+        return self.vocab_profile_feats_batch([text])[0]
+    
+    def vocab_profile_feats_batch(self, texts):
+        """
+        Same as vocab_profile_feats, for a list of texts.
+        Texts are looked up in the result cache first, the remaining ones go through
+        stanza in one bulk call (a list of Documents), so the neural processors see large batches.
+        """
+        # lowercased, whitespace-normalised; empty responses (no speech) get all-zero counts without running stanza
+        norm_texts = [ " ".join(text.lower().split()) for text in texts ]
+        feats_list = [ None ] * len(texts)
+        keys = [ None ] * len(texts)
+        # identical texts of the batch are processed once
+        miss_texts = OrderedDict()
+        miss_feats = {}
+        
+        for i, norm_text in enumerate(norm_texts):
+            if norm_text == "":
+                feats_list[i] = self.__sentences_feats([])
+                continue
+            
+            keys[i] = self.__cache_key(norm_text)
+            
+            if keys[i] in miss_texts:
+                # duplicate of a text processed in this batch
+                self.cache_queries += 1
+                self.cache_hits += 1
+                continue
+            
+            feats_list[i] = self.__cache_get(keys[i])
+            
+            if feats_list[i] is None:
+                miss_texts[keys[i]] = norm_text
+        
+        if len(miss_texts) > 0:
+            docs = self.nlp_tokenize([ stanza.Document([], text=norm_text) for norm_text in miss_texts.values() ])
+            for key, doc in zip(miss_texts.keys(), docs):
+                miss_feats[key] = self.__sentences_feats(doc.sentences)
+                self.__cache_put(key, miss_feats[key])
+        
+        for i in range(len(texts)):
+            if feats_list[i] is None:
+                feats_list[i] = dict(miss_feats[keys[i]])
+        
+        return feats_list
+    
+    def report_cache(self):
+        hit_rate = self.cache_hits / self.cache_queries if self.cache_queries > 0 else 0.
+        print("NLP cache: {} hits / {} queries (hit rate {:.2%})".format(self.cache_hits, self.cache_queries, hit_rate))
+    
+    @lazy_component("NLP cache version")
+    def cache_version(self):
+        # content of the wordlist and the stanza version, so that cached vp_* counts are
+        # not served after the xlsx is edited or stanza is upgraded
+        with open(self.cefr_dict_path, "rb") as fn:
+            cefr_hash = hashlib.md5(fn.read()).hexdigest()
+        return "|".join([stanza.__version__, os.path.basename(self.cefr_dict_path), cefr_hash])
+    
+    def __cache_key(self, norm_text):
+        # the features depend on the processors and the wordlist as well
+        key = "|".join([self.processors, str(self.tokenize_pretokenized), self.cache_version, norm_text])
+        return hashlib.md5(key.encode("utf-8")).hexdigest()
+    
+    def __cache_get(self, key):
+        self.cache_queries += 1
+        
+        if key in self.feats_cache:
+            self.feats_cache.move_to_end(key)
+            self.cache_hits += 1
+            return dict(self.feats_cache[key])
+        
+        if self.cache_dir is not None:
+            cache_path = os.path.join(self.cache_dir, key + ".json")
+            if os.path.exists(cache_path):
+                with open(cache_path, "r") as fn:
+                    feats = json.load(fn)
+                self.__cache_put(key, feats, write_disk=False)
+                self.cache_hits += 1
+                return dict(feats)
+        
+        return None
+    
+    def __cache_put(self, key, feats, write_disk=True):
+        self.feats_cache[key] = feats
+        self.feats_cache.move_to_end(key)
+        
+        while len(self.feats_cache) > self.cache_size:
+            self.feats_cache.popitem(last=False)
+        
+        if write_disk and self.cache_dir is not None:
+            dump_json_atomic(feats, os.path.join(self.cache_dir, key + ".json"))
+    
+    def __sentences_feats(self, sentences):
         vocab_profile = {cl:0 for cl in self.cefr_levels}
         pos_info = {pt: 0 for pt in self.pos_tags}
         vp_list = []
@@ -95,10 +239,9 @@ class NlpModel(object):
         mor_list = []
         dep_list = []
         
-        doc = self.nlp_tokenize(text.lower())
         hit_dict = defaultdict(dict)
         
-        for si, sent in enumerate(doc.sentences):
+        for si, sent in enumerate(sentences):
             for wi, word in enumerate(sent.words):
                 lemma_word = word.lemma
                 upos = word.pos
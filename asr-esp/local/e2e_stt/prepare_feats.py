@@ -5,9 +5,12 @@ from tqdm import tqdm
 from espnet_models import SpeechModel
 from audio_models import AudioModel
 from vad_model import VadModel
-from nlp_models import NlpModel
+from feats_store import all_info_to_table, write_feats_store
+from lazy_utils import report_load_times
+from nlp_models import NlpModel, nlp_profiles
 import numpy as np
 import argparse
+from runtime_config import add_runtime_args, configure_runtime_from_args
 
 class NpEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -45,7 +48,43 @@ parser.add_argument("--max_segment_length",
                     default=15,
                     type=int)                    
 
+# recordings longer than this (seconds) are aligned per VAD segment (get_ctm_windowed), 0: always align the whole recording
+parser.add_argument("--align_window_threshold",
+                    default=60,
+                    type=float)
+
+parser.add_argument("--align_overlap",
+                    default=0.25,
+                    type=float)
+
+# number of responses sent to stanza together (vocab_profile_feats_batch)
+parser.add_argument("--nlp_batch_size",
+                    default=64,
+                    type=int)
+
+# stanza processors (nlp_models.nlp_profiles): pos, vocab or full
+parser.add_argument("--nlp_profile",
+                    default="full",
+                    choices=list(nlp_profiles),
+                    type=str)
+
+# on-disk tier of the NLP result cache, shared by runs/workers ("": in-process LRU only)
+parser.add_argument("--nlp_cache_dir",
+                    default="",
+                    type=str)
+
+# pre-screen: responses with a lower voiced ratio (VAD) or peak frame energy (dBFS) are marked as no_speech and skip ASR
+parser.add_argument("--min_speech_ratio",
+                    default=0.02,
+                    type=float)
+
+parser.add_argument("--min_energy_db",
+                    default=-50.,
+                    type=float)
+
+add_runtime_args(parser)
 args = parser.parse_args()
+configure_runtime_from_args(args)
 
 data_dir = args.data_dir
 model_name = args.model_name
@@ -69,7 +108,7 @@ all_info = {}
 speech_model = SpeechModel(tag)
 audio_model = AudioModel(sample_rate)
 vad_model = VadModel(mode=vad_mode, sample_rate=sample_rate, max_segment_length=max_segment_length)
-nlp_model = NlpModel()
+nlp_model = NlpModel(cache_dir=args.nlp_cache_dir if args.nlp_cache_dir != "" else None, profile=args.nlp_profile)
 
 with open(data_dir + "/wav.scp", "r") as fn:
     for i, line in enumerate(fn.readlines()):
@@ -82,8 +121,21 @@ with open(data_dir + "/text", "r") as fn:
         info = line.split()
         text_dict[info[0]] = " ".join(info[1:])
 
+def add_nlp_feats(block_utts):
+    # vocabulary profile of a block of responses, one bulk stanza call
+    vp_feats_list = nlp_model.vocab_profile_feats_batch([all_info[uttid]["stt"] for uttid in block_utts])
+    
+    for uttid, vp_feats_info in zip(block_utts, vp_feats_list):
+        feats = all_info[uttid]["feats"]
+        total_duration = feats.pop("total_duration")
+        response_duration = feats.pop("response_duration")
+        all_info[uttid]["feats"] = { **feats, **vp_feats_info,
+                                     "total_duration": total_duration,
+                                     "response_duration": response_duration}
+
 import pprint
 pp = pprint.PrettyPrinter(indent=4)
+nlp_block_utts = []
 for i, uttid in tqdm(enumerate(utt_list)):
     wav_path = wavscp_dict[uttid]
     text_prompt = text_dict[uttid]
@@ -98,42 +150,68 @@ for i, uttid in tqdm(enumerate(utt_list)):
     _, f0_info = audio_model.get_f0(speech)
     _, energy_info = audio_model.get_energy(speech)
     # fluency feature and confidence feature
-    speechs = vad_model.get_speech_segments(audio, rate)
+    # the segment times of the pre-screen VAD pass are kept for the recognition and the windowed alignment
+    no_speech, _, _, segment_times = vad_model.is_silent(speech, rate, args.min_speech_ratio, args.min_energy_db, audio=audio)
     text = []
-    for speech_seg in speechs:
-        text_seg = speech_model.recog(speech_seg)
-        text.append(text_seg)
+    if no_speech:
+        segment_times = []
+    else:
+        # same as vad_model.get_speech_segments
+        speechs = [ speech[int(start * rate): int(end * rate)] for start, end in segment_times ]
+        for speech_seg in speechs:
+            text_seg = speech_model.recog(speech_seg)
+            text.append(text_seg)
     
+    segment_texts = text
     text = " ".join(" ".join(text).split())
-    # alignment (stt)
-    word_ctm_info = speech_model.get_ctm(speech, text)
-    phn_ctm_info, phone_text = speech_model.get_phone_ctm(word_ctm_info)
+    # alignment (stt), empty responses get the zero-speech features (empty ctm)
+    if text != "":
+        if args.align_window_threshold > 0 and total_duration > args.align_window_threshold:
+            word_ctm_info = speech_model.get_ctm_windowed(speech, segment_times, segment_texts, args.align_overlap, rate)
+        else:
+            word_ctm_info = speech_model.get_ctm(speech, text)
+        phn_ctm_info, phone_text = speech_model.get_phone_ctm(word_ctm_info)
+    else:
+        no_speech = True
+        word_ctm_info, phn_ctm_info = [], []
     
     sil_feats_info, response_duration = speech_model.sil_feats(word_ctm_info, total_duration)
     word_feats_info, response_duration = speech_model.word_feats(word_ctm_info, total_duration)
     phone_feats_info, response_duration = speech_model.phone_feats(phn_ctm_info, total_duration)
-    vp_feats_info = nlp_model.vocab_profile_feats(text)
     
     all_info[uttid] = { "stt": text, "prompt": text_prompt,
-                        "wav_path": wav_path, 
+                        "wav_path": wav_path, "no_speech": no_speech,
                         "word_ctm": word_ctm_info, "ctm": phn_ctm_info, 
                         "feats": {  **f0_info, **energy_info, 
                                     **sil_feats_info, **word_feats_info,
-                                    **phone_feats_info, **vp_feats_info,
+                                    **phone_feats_info,
                                     "total_duration": total_duration,
                                     "response_duration": response_duration}}
     
+    nlp_block_utts.append(uttid)
+    if len(nlp_block_utts) >= args.nlp_batch_size:
+        add_nlp_feats(nlp_block_utts)
+        nlp_block_utts = []
+    
     if i % 1000 == 0:
         print(all_info[uttid])
 
+if len(nlp_block_utts) > 0:
+    add_nlp_feats(nlp_block_utts)
+
 
 print(output_dir)
 with open(output_dir + "/all.json", "w") as fn:
     json.dump(all_info, fn, indent=4, ensure_ascii=False, cls=NpEncoder)
 
+# columnar feature store (float32 scalar features + metadata), read by the grader
+write_feats_store(output_dir + "/all.npz", *all_info_to_table(all_info))
+
 # write STT Result to file
 with open(output_dir + "/text", "w") as fn:
     for uttid in utt_list:
         if uttid in all_info:
             fn.write(uttid + " " + all_info[uttid]["stt"] + "\n")
 
+report_load_times()
+nlp_model.report_cache()
@@ -5,8 +5,12 @@ from tqdm import tqdm
 from espnet_models_streaming import SpeechModel
 from audio_models import AudioModel
 from vad_model import VadModel
+from feats_store import all_info_to_table, write_feats_store
+from lazy_utils import report_load_times
 import numpy as np
+import time
 import argparse
+from runtime_config import add_runtime_args, configure_runtime_from_args
 
 parser = argparse.ArgumentParser()
 
@@ -30,13 +34,33 @@ parser.add_argument("--vad_mode",
                     default=1,
                     type=int)                    
 
+parser.add_argument("--chunk_seconds",
+                    default=0.5,
+                    type=float)
+
+# replay every wav at real time and report streaming latency
+parser.add_argument("--latency_benchmark", action="store_true")
+
+# pre-screen: responses with a lower voiced ratio (VAD) or peak frame energy (dBFS) are marked as no_speech and skip ASR
+parser.add_argument("--min_speech_ratio",
+                    default=0.02,
+                    type=float)
+
+parser.add_argument("--min_energy_db",
+                    default=-50.,
+                    type=float)
+
+add_runtime_args(parser)
 args = parser.parse_args()
+configure_runtime_from_args(args)
 
 data_dir = args.data_dir
 model_name = args.model_name
 model_tag = args.model_tag
 sample_rate = args.sample_rate
 vad_mode = args.vad_mode
+chunk_seconds = args.chunk_seconds
+latency_benchmark = args.latency_benchmark
 
 output_dir = os.path.join(data_dir, model_name)
 
@@ -49,6 +73,8 @@ text_dict = {}
 utt_list = []
 # stt and ctm
 all_info = {}
+# streaming latency (seconds)
+latency_info = {}
 
 speech_model = SpeechModel(tag)
 audio_model = AudioModel(sample_rate)
@@ -65,6 +91,45 @@ with open(data_dir + "/text", "r") as fn:
         info = line.split()
         text_dict[info[0]] = " ".join(info[1:])
 
+def stream_recog(speech, rate, realtime=False):
+    """
+    Feeds speech to the streaming model chunk by chunk.
+    If realtime is True, the chunks are delivered at the pace of a live
+    speaker and the wall-clock time of each event is recorded.
+    Returns (text, time of the first partial, time of the final result),
+    both measured from the start of the stream.
+    """
+    chunk_size = int(chunk_seconds * rate)
+    num_chunks = max(1, int(np.ceil(speech.shape[0] / chunk_size)))
+    first_partial_time = None
+    
+    speech_model.start()
+    start_time = time.time()
+    
+    for c in range(num_chunks - 1):
+        chunk = speech[c * chunk_size: (c + 1) * chunk_size]
+        
+        if realtime:
+            # wait until the chunk has been "spoken"
+            wait_time = start_time + (c + 1) * chunk_seconds - time.time()
+            if wait_time > 0:
+                time.sleep(wait_time)
+        
+        partial_text = speech_model.accept(chunk)
+        
+        if first_partial_time is None and partial_text.strip() != "":
+            first_partial_time = time.time() - start_time
+    
+    if realtime:
+        wait_time = start_time + speech.shape[0] / rate - time.time()
+        if wait_time > 0:
+            time.sleep(wait_time)
+    
+    text = speech_model.finish(speech[(num_chunks - 1) * chunk_size:])
+    final_time = time.time() - start_time
+    
+    return text, first_partial_time, final_time
+
 for i, uttid in tqdm(enumerate(utt_list)):
     wav_path = wavscp_dict[uttid]
     text_prompt = text_dict[uttid]
@@ -79,23 +144,33 @@ for i, uttid in tqdm(enumerate(utt_list)):
     _, f0_info = audio_model.get_f0(speech)
     _, energy_info = audio_model.get_energy(speech)
     # fluency feature and confidence feature
-    speechs = vad_model.get_speech_segments(audio, rate)
-    text = []
-    for speech_seg in speechs:
-        text_seg = speech_model.recog(speech_seg)
-        text.append(text_seg)
+    no_speech, _, _, segments = vad_model.is_silent(speech, rate, args.min_speech_ratio, args.min_energy_db, audio=audio)
+    text = ""
+    if not no_speech:
+        text, first_partial_time, final_time = stream_recog(speech, rate, realtime=latency_benchmark)
+        text = " ".join(text.split())
     
-    text = " ".join(" ".join(text).split())
-    # alignment (stt)
-    ctm_info = speech_model.get_ctm(speech, text)
-    phone_ctm_info, phone_text = speech_model.get_phone_ctm(ctm_info)
+    if latency_benchmark and not no_speech:
+        # end of speech = end of the last voiced segment (VAD of the pre-screen), or end of audio
+        speech_end_time = segments[-1][1] if len(segments) > 0 else total_duration
+        latency_info[uttid] = { "total_duration": total_duration,
+                                "first_partial": first_partial_time,
+                                "eos_to_final": final_time - speech_end_time,
+                                "eoa_to_final": final_time - total_duration }
+    # alignment (stt), empty responses get the zero-speech features (empty ctm)
+    if text != "":
+        ctm_info = speech_model.get_ctm(speech, text)
+        phone_ctm_info, phone_text = speech_model.get_phone_ctm(ctm_info)
+    else:
+        no_speech = True
+        ctm_info, phone_ctm_info, phone_text = [], [], ""
     
     sil_feats_info, response_duration = speech_model.sil_feats(ctm_info, total_duration)
     word_feats_info, response_duration = speech_model.word_feats(ctm_info, total_duration)
     phone_feats_info, response_duration = speech_model.phone_feats(phone_ctm_info, total_duration)
     
     all_info[uttid] = { "stt": text, "stt(g2p)": phone_text, "prompt": text_prompt,
-                        "wav_path": wav_path, "ctm": ctm_info, 
+                        "wav_path": wav_path, "ctm": ctm_info, "no_speech": no_speech,
                         "feats": {  **f0_info, **energy_info, 
                                     **sil_feats_info, **word_feats_info,
                                     **phone_feats_info,
@@ -106,6 +181,9 @@ print(output_dir)
 with open(output_dir + "/all.json", "w") as fn:
     json.dump(all_info, fn, indent=4, ensure_ascii=False)
 
+# columnar feature store (float32 scalar features + metadata), read by the grader
+write_feats_store(output_dir + "/all.npz", *all_info_to_table(all_info))
+
 # write STT Result to file
 with open(output_dir + "/text", "w") as fn:
     for uttid in utt_list:
@@ -121,3 +199,19 @@ with open(output_dir + "/ctm", "w") as fn:
             # uttid channel start_time duration text conf
             ctm_info = " ".join([uttid, "1", str(start_time), str(duration), text_info, str(conf)])
             fn.write(ctm_info + "\n")
+
+if latency_benchmark:
+    with open(output_dir + "/latency.json", "w") as fn:
+        json.dump(latency_info, fn, indent=4)
+    
+    print("Streaming latency (seconds), chunk_seconds={}".format(chunk_seconds))
+    for key in ["first_partial", "eos_to_final", "eoa_to_final"]:
+        values = np.array([info[key] for info in latency_info.values() if info[key] is not None])
+        if len(values) == 0:
+            print(key, "no results")
+            continue
+        print("{}: mean {:.3f}, p50 {:.3f}, p90 {:.3f}, max {:.3f} ({} utts)".format(
+                key, np.mean(values), np.percentile(values, 50),
+                np.percentile(values, 90), np.max(values), len(values)))
+
+report_load_times()
@@ -10,6 +10,7 @@ import wave
 import wenetruntime as wenet
 
 import argparse
+from runtime_config import add_runtime_args, configure_runtime_from_args
 
 parser = argparse.ArgumentParser()
 
@@ -37,7 +38,9 @@ parser.add_argument("--max_segment_length",
                     default=15,
                     type=int)                    
 
+add_runtime_args(parser)
 args = parser.parse_args()
+configure_runtime_from_args(args)
 
 data_dir = args.data_dir
 model_name = args.model_name
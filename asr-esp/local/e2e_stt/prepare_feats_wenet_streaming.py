@@ -7,9 +7,13 @@ from vad_model import VadModel
 import numpy as np
 import sys
 import wave
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import wenetruntime as wenet
 
 import argparse
+from runtime_config import add_runtime_args, configure_runtime_from_args
 
 parser = argparse.ArgumentParser()
 
@@ -37,13 +41,33 @@ parser.add_argument("--max_segment_length",
                     default=15,
                     type=int)                    
 
+parser.add_argument("--chunk_seconds",
+                    default=0.5,
+                    type=float)
+
+# number of wenet decoders, i.e., utterances streamed concurrently (the runtime releases the GIL)
+parser.add_argument("--num_decoders",
+                    default=1,
+                    type=int)
+
+# > 0: benchmark, deliver the chunks of every stream at replay_speed x real time
+# and report the aggregate RTF and the latency of the final result
+parser.add_argument("--replay_speed",
+                    default=0,
+                    type=float)
+
+add_runtime_args(parser)
 args = parser.parse_args()
+configure_runtime_from_args(args)
 
 data_dir = args.data_dir
 model_name = args.model_name
 model_tag = args.model_tag
 sample_rate = args.sample_rate
 vad_mode = args.vad_mode
+chunk_seconds = args.chunk_seconds
+num_decoders = args.num_decoders
+replay_speed = args.replay_speed
 
 output_dir = os.path.join(data_dir, model_name)
 
@@ -57,11 +81,14 @@ utt_list = []
 # stt and ctm
 all_info = {}
 
-decoder = wenet.Decoder(model_tag,
-                        lang='en',
-                        nbest=5,
-                        context=[],
-                        enable_timestamp=True)
+# a decoder holds the state of one stream, so every concurrent stream takes its own from the pool
+decoder_pool = queue.Queue()
+for _ in range(num_decoders):
+    decoder_pool.put(wenet.Decoder(model_tag,
+                                   lang='en',
+                                   nbest=5,
+                                   context=[],
+                                   enable_timestamp=True))
 
 audio_model = AudioModel(sample_rate)
 vad_model = VadModel(vad_mode, sample_rate)
@@ -77,28 +104,67 @@ with open(data_dir + "/text", "r") as fn:
         info = line.split()
         text_dict[info[0]] = " ".join(info[1:])
 
-for i, uttid in tqdm(enumerate(utt_list)):
-    wav_path = wavscp_dict[uttid]
-    text_prompt = text_dict[uttid]
+def stream_decode(uttid):
+    """
+    Streams one utterance through a decoder of the pool.
+    Returns (text, total_duration, final_latency), where final_latency is the time
+    from sending the last chunk to receiving the final result.
+    """
     # Confirm the sampling rate is equal to that of the training corpus.
     # If not, you need to resample the audio data before inputting to speech2text
-    with wave.open(wav_path, 'rb') as fin:
+    with wave.open(wavscp_dict[uttid], 'rb') as fin:
         assert fin.getnchannels() == 1
         audio = fin.readframes(fin.getnframes())
-   
-    # We suppose the wav is 16k, 16bits, and decode every 0.5 seconds
-    interval = int(0.5 * 16000) * 2
-    for i in range(0, len(audio), interval):
-        last = False if i + interval < len(audio) else True
-        chunk_wav = audio[i: min(i + interval, len(audio))]
-        recog = decoder.decode(chunk_wav, last)
-        if len(recog) == 0:
-            continue
-        recog = json.loads(recog)
+    
+    total_duration = len(audio) / 2 / sample_rate
+    text = ""
+    last_chunk_time = final_time = None
+    
+    decoder = decoder_pool.get()
+    try:
+        # We suppose the wav is 16k, 16bits, and decode every chunk_seconds
+        interval = int(chunk_seconds * sample_rate) * 2
+        start_time = time.time()
         
-        if recog["type"] == "final_result":
-            text = recog["nbest"][0]["sentence"].upper()
+        for c, offset in enumerate(range(0, len(audio), interval)):
+            if replay_speed > 0:
+                # wait until the chunk has been "spoken"
+                wait_time = start_time + (c + 1) * chunk_seconds / replay_speed - time.time()
+                if wait_time > 0:
+                    time.sleep(wait_time)
+            
+            last = False if offset + interval < len(audio) else True
+            chunk_wav = audio[offset: min(offset + interval, len(audio))]
+            if last:
+                last_chunk_time = time.time()
+            recog = decoder.decode(chunk_wav, last)
+            if len(recog) == 0:
+                continue
+            recog = json.loads(recog)
+            
+            if recog["type"] == "final_result":
+                text = recog["nbest"][0]["sentence"].upper()
+                final_time = time.time()
+    finally:
+        decoder_pool.put(decoder)
     
+    final_latency = final_time - last_chunk_time if final_time is not None and last_chunk_time is not None else None
+    
+    return text, total_duration, final_latency
+
+# stream num_decoders utterances at the same time
+latency_info = {}
+start_time = time.time()
+
+with ThreadPoolExecutor(max_workers=num_decoders) as executor:
+    stream_results = list(tqdm(executor.map(stream_decode, utt_list), total=len(utt_list)))
+
+proc_time = time.time() - start_time
+
+for uttid, (text, total_duration, final_latency) in zip(utt_list, stream_results):
+    wav_path = wavscp_dict[uttid]
+    text_prompt = text_dict[uttid]
+    latency_info[uttid] = { "total_duration": total_duration, "final_latency": final_latency }
     
     all_info[uttid] = { "stt": text, "prompt": text_prompt,
                         "wav_path": wav_path}
@@ -116,3 +182,17 @@ with open(output_dir + "/text", "w") as fn:
     for uttid in utt_list:
         fn.write(uttid + " " + all_info[uttid]["stt"] + "\n")
 
+total_audio_duration = sum([info["total_duration"] for info in latency_info.values()])
+print("{} utts, {:.1f} seconds of audio, {} decoders, replay_speed {}".format(len(utt_list), total_audio_duration, num_decoders, replay_speed))
+print("aggregate RTF: {:.3f}".format(proc_time / total_audio_duration))
+
+if replay_speed > 0:
+    with open(output_dir + "/latency.json", "w") as fn:
+        json.dump({"num_decoders": num_decoders, "replay_speed": replay_speed,
+                   "proc_time": proc_time, "audio_duration": total_audio_duration,
+                   "rtf": proc_time / total_audio_duration, "utts": latency_info}, fn, indent=4)
+    
+    values = np.array([info["final_latency"] for info in latency_info.values() if info["final_latency"] is not None])
+    if len(values) > 0:
+        print("final_latency (seconds): mean {:.3f}, p50 {:.3f}, p90 {:.3f}, max {:.3f} ({} utts)".format(
+                np.mean(values), np.percentile(values, 50), np.percentile(values, 90), np.max(values), len(values)))
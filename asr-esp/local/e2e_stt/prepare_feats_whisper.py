@@ -14,6 +14,9 @@ import string
 import jiwer
 import torch
 import argparse
+from runtime_config import add_runtime_args, configure_runtime_from_args
+from lazy_utils import timed, report_load_times, get_suppress_tokens
+from whisper_batch import SegmentBatcher, get_decode_options
 
 parser = argparse.ArgumentParser()
 
@@ -51,7 +54,16 @@ parser.add_argument("--suppress_numeric_tokens", action="store_true")
 
 parser.add_argument("--suppress_punc_tokens", action="store_true")
 
+# > 0: decode the VAD segments of consecutive utterances in batches of batch_size (one whisper.decode call per batch,
+# plus one per fallback temperature for the segments that fail the checks of whisper.transcribe)
+# 0: transcribe every recording on its own
+parser.add_argument("--batch_size",
+                    default=0,
+                    type=int)
+
+add_runtime_args(parser)
 args = parser.parse_args()
+configure_runtime_from_args(args)
 
 data_dir = args.data_dir
 model_name = args.model_name
@@ -64,19 +76,9 @@ max_segment_length = args.max_segment_length
 language = args.language
 
 #encourage model to transcribe words literally
-tokenizer = get_tokenizer(multilingual=False)  # use multilingual=True if using multilingual model
-
-numeric_tokens = [
-    i 
-    for i in range(tokenizer.eot)
-    if all(c in list("0123456789") for c in tokenizer.decode([i]).removeprefix(" "))
-]
-
-punc_tokens = [
-    i 
-    for i in range(tokenizer.eot)
-    if all(c in list("!?-,.")  for c in tokenizer.decode([i]).removeprefix(" "))
-]
+with timed("whisper suppress tokens"):
+    tokenizer = get_tokenizer(multilingual=False)  # use multilingual=True if using multilingual model
+    numeric_tokens, punc_tokens = get_suppress_tokens(tokenizer, numeric_chars="0123456789", punc_chars="!?-,.")
 # discussions/589
 #punc_tokens = [0, 11, 13, 30]
 
@@ -110,7 +112,8 @@ utt_list = []
 # stt and ctm
 all_info = {}
 
-speech_model = whisper.load_model(model_tag)
+with timed("whisper model"):
+    speech_model = whisper.load_model(model_tag)
 audio_model = AudioModel(sample_rate)
 normalizer = EnglishTextNormalizer()
 
@@ -125,6 +128,22 @@ with open(data_dir + "/text", "r") as fn:
         info = line.split()
         text_dict[info[0]] = " ".join(info[1:])
 
+if args.batch_size > 0:
+    if condition_on_previous_text:
+        print("condition_on_previous_text is ignored in the batched mode (segments are decoded independently)")
+
+    vad_model = VadModel(mode=vad_mode, sample_rate=sample_rate, max_segment_length=max_segment_length)
+    batcher = SegmentBatcher(speech_model,
+                             get_decode_options(None if language == "none" else language,
+                                                suppress_tokens, speech_model.device.type),
+                             batch_size=args.batch_size)
+
+    for uttid in tqdm(utt_list):
+        audio, rate = vad_model.read_wave(wavscp_dict[uttid])
+        assert rate == sample_rate
+        batcher.add(uttid, vad_model.get_speech_segments(audio, rate))
+    batcher.flush()
+
 import pprint
 pp = pprint.PrettyPrinter(indent=4)
 for i, uttid in tqdm(enumerate(utt_list)):
@@ -151,10 +170,13 @@ for i, uttid in tqdm(enumerate(utt_list)):
     else:
         decode_options["language"] = language
     
-    result = speech_model.transcribe(audio=wav_path, condition_on_previous_text = args.condition_on_previous_text, **decode_options)
-    #pp.pprint(result)
+    if args.batch_size > 0:
+        text_org = batcher.get_text(uttid)
+    else:
+        result = speech_model.transcribe(audio=wav_path, condition_on_previous_text = args.condition_on_previous_text, **decode_options)
+        #pp.pprint(result)
+        text_org = result["text"]
     
-    text_org = result["text"]
     text = normalizer(text_org)
     
     all_info[uttid] = { "stt": text,
@@ -176,3 +198,5 @@ with open(output_dir + "/text", "w") as fn:
 with open(output_dir + "/text.org", "w") as fn:
     for uttid in utt_list:
         fn.write(uttid + " " + all_info[uttid]["stt(punc)"] + "\n") 
+
+report_load_times()
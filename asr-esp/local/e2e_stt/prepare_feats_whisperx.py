@@ -4,7 +4,8 @@ import soundfile
 from tqdm import tqdm
 from whisperx_models import SpeechModel
 from audio_models import AudioModel
-from nlp_models import NlpModel
+from vad_model import VadModel
+from nlp_models import NlpModel, nlp_profiles
 import numpy as np
 import sys
 import wave
@@ -13,8 +14,11 @@ from whisper.normalizers import EnglishTextNormalizer
 import string
 import jiwer
 import torch
+from feats_store import all_info_to_table, write_feats_store
+from lazy_utils import report_load_times
 
 import argparse
+from runtime_config import add_runtime_args, configure_runtime_from_args
 
 class NpEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -48,6 +52,24 @@ parser.add_argument("--device",
                     default="cuda",
                     type=str)
 
+# None: use the inference profile of the device (whisperx_models.inference_profiles)
+parser.add_argument("--compute_type",
+                    default=None,
+                    type=str)
+
+parser.add_argument("--batch_size",
+                    default=None,
+                    type=int)
+
+parser.add_argument("--cpu_threads",
+                    default=None,
+                    type=int)
+
+# number of utterances transcribed together by recog_many (1: one recog call per utterance)
+parser.add_argument("--recog_block_size",
+                    default=32,
+                    type=int)
+
 parser.add_argument("--language",
                     default="none",
                     type=str) 
@@ -61,7 +83,29 @@ parser.add_argument("--suppress_punc_tokens", action="store_true")
 
 parser.add_argument("--stt_only", action="store_true")
 
+# stanza processors (nlp_models.nlp_profiles): pos, vocab or full
+parser.add_argument("--nlp_profile",
+                    default="full",
+                    choices=list(nlp_profiles),
+                    type=str)
+
+# on-disk tier of the NLP result cache, shared by runs/workers ("": in-process LRU only)
+parser.add_argument("--nlp_cache_dir",
+                    default="",
+                    type=str)
+
+# pre-screen: responses with a lower voiced ratio (VAD) or peak frame energy (dBFS) are marked as no_speech and skip ASR
+parser.add_argument("--min_speech_ratio",
+                    default=0.02,
+                    type=float)
+
+parser.add_argument("--min_energy_db",
+                    default=-50.,
+                    type=float)
+
+add_runtime_args(parser)
 args = parser.parse_args()
+configure_runtime_from_args(args)
 
 data_dir = args.data_dir
 model_name = args.model_name
@@ -71,6 +115,7 @@ language = args.language
 condition_on_previous_text = args.condition_on_previous_text
 device = args.device
 stt_only = args.stt_only
+recog_block_size = args.recog_block_size
 
 print(model_tag, language)
 if condition_on_previous_text:
@@ -90,11 +135,15 @@ utt_list = []
 # stt and ctm
 all_info = {}
 
-speech_model = SpeechModel(tag=model_tag, device=device, language=language, condition_on_previous_text=condition_on_previous_text)
+speech_model = SpeechModel(tag=model_tag, device=device, language=language, condition_on_previous_text=condition_on_previous_text,
+                           compute_type=args.compute_type, batch_size=args.batch_size, cpu_threads=args.cpu_threads)
 audio_model = AudioModel(sample_rate)
+vad_model = VadModel(sample_rate=sample_rate)
 
 normalizer = EnglishTextNormalizer()
-nlp_model = NlpModel()
+# stanza and the CEFR wordlist are loaded on first use (never in --stt_only runs)
+nlp_model = NlpModel(cache_dir=args.nlp_cache_dir if args.nlp_cache_dir != "" else None, profile=args.nlp_profile)
+report_load_times()
 
 with open(data_dir + "/wav.scp", "r") as fn:
     for i, line in enumerate(fn.readlines()):
@@ -109,65 +158,115 @@ with open(data_dir + "/text", "r") as fn:
 
 import pprint
 pp = pprint.PrettyPrinter(indent=4)
-for i, uttid in tqdm(enumerate(utt_list)):
-    wav_path = wavscp_dict[uttid]
-    text_prompt = text_dict[uttid]
-    # Confirm the sampling rate is equal to that of the training corpus.
-    # If not, you need to resample the audio data before inputting to speech2text
-    speech, rate = soundfile.read(wav_path)
-    assert rate == sample_rate
-    total_duration = speech.shape[0] / rate
-    # audio feature
+
+def recog_block(block_audios):
+    # {uttid: (text_result, ctm_results)} or {uttid: None} if no audio is detected
+    if len(block_audios) == 0:
+        return {}
     
-    if not stt_only:
+    if recog_block_size > 1:
         try:
-            _, f0_info = audio_model.get_f0(speech)
-            _, energy_info = audio_model.get_energy(speech)
+            return speech_model.recog_many(block_audios, align=not stt_only)
         except Exception as e:
-            print(e)
-            continue
-    # fluency feature and confidence feature
-    # alignment (stt)
+            # one bad utterance should not abort the run, redo the block one by one
+            print("recog_many failed, per-utterance fallback:", e)
     
-    try:
-        text_result, ctm_results = speech_model.recog(wav_path)
-    except:
-        print(f"No audio are detected: {uttid} {wav_path}")
-        continue
+    recog_results = {}
+    for uttid, audio in block_audios.items():
+        try:
+            recog_results[uttid] = speech_model.recog(audio, align=not stt_only)
+        except:
+            recog_results[uttid] = None
+    return recog_results
+
+for block_start in tqdm(range(0, len(utt_list), recog_block_size)):
+    block_utts = utt_list[block_start: block_start + recog_block_size]
+    block_speech = {}
+    block_audios = {}
     
-    text, text_norm = text_result
-    word_ctm_info, phn_ctm_info = ctm_results
+    for uttid in block_utts:
+        # Confirm the sampling rate is equal to that of the training corpus.
+        # If not, you need to resample the audio data before inputting to speech2text
+        speech, rate = soundfile.read(wavscp_dict[uttid])
+        assert rate == sample_rate
+        block_speech[uttid] = speech
+        # silent or noise-only responses skip recognition and alignment
+        if not vad_model.is_silent(speech, rate, args.min_speech_ratio, args.min_energy_db)[0]:
+            block_audios[uttid] = speech.astype(np.float32)
     
-    if not stt_only:
-        sil_feats_info, response_duration = speech_model.sil_feats(word_ctm_info, total_duration)
-        word_feats_info, response_duration = speech_model.word_feats(word_ctm_info, total_duration)
-        phone_feats_info, response_duration = speech_model.phone_feats(phn_ctm_info, total_duration)
-        vp_feats_info = nlp_model.vocab_profile_feats(text_norm)
+    # fluency feature and confidence feature
+    # alignment (stt)
+    recog_results = recog_block(block_audios)
     
-        all_info[uttid] = { "stt": text, "prompt": text_prompt,
-                            "wav_path": wav_path, 
-                            "word_ctm": word_ctm_info, "ctm": phn_ctm_info, 
-                            "feats": {  **f0_info, **energy_info, 
-                                    **sil_feats_info, **word_feats_info,
-                                    **phone_feats_info, **vp_feats_info,
-                                    "total_duration": total_duration,
-                                    "response_duration": response_duration}}
-    else:
-        all_info[uttid] = { "stt": text, "prompt": text_prompt,
-                            "wav_path": wav_path, 
-                          }
+    if not stt_only:
+        # vocabulary profile of the whole block, one bulk stanza call
+        block_text_norms = [ recog_results[uttid][0][1] if recog_results.get(uttid) is not None else "" for uttid in block_utts ]
+        block_vp_feats = dict(zip(block_utts, nlp_model.vocab_profile_feats_batch(block_text_norms)))
     
-    if i % 1000 == 0:
-        print(all_info[uttid])
-
+    for i, uttid in enumerate(block_utts, start=block_start):
+        wav_path = wavscp_dict[uttid]
+        text_prompt = text_dict[uttid]
+        speech = block_speech[uttid]
+        total_duration = speech.shape[0] / sample_rate
+        # audio feature
+        
+        if not stt_only:
+            try:
+                _, f0_info = audio_model.get_f0(speech)
+                _, energy_info = audio_model.get_energy(speech)
+            except Exception as e:
+                print(e)
+                continue
+        
+        # empty transcripts are no speech as well (same as the streaming path)
+        no_speech = recog_results.get(uttid) is None or recog_results[uttid][0][1].strip() == ""
+        
+        if no_speech:
+            # zero-speech features (empty ctm, no words)
+            print(f"No audio are detected: {uttid} {wav_path}")
+            text, text_norm = "", ""
+            word_ctm_info, phn_ctm_info = [], []
+        else:
+            text_result, ctm_results = recog_results[uttid]
+            text, text_norm = text_result
+            word_ctm_info, phn_ctm_info = ctm_results
+        
+        if not stt_only:
+            sil_feats_info, response_duration = speech_model.sil_feats(word_ctm_info, total_duration)
+            word_feats_info, response_duration = speech_model.word_feats(word_ctm_info, total_duration)
+            phone_feats_info, response_duration = speech_model.phone_feats(phn_ctm_info, total_duration)
+            vp_feats_info = block_vp_feats[uttid]
+        
+            all_info[uttid] = { "stt": text, "prompt": text_prompt,
+                                "wav_path": wav_path, "no_speech": no_speech,
+                                "word_ctm": word_ctm_info, "ctm": phn_ctm_info, 
+                                "feats": {  **f0_info, **energy_info, 
+                                        **sil_feats_info, **word_feats_info,
+                                        **phone_feats_info, **vp_feats_info,
+                                        "total_duration": total_duration,
+                                        "response_duration": response_duration}}
+        else:
+            all_info[uttid] = { "stt": text, "prompt": text_prompt,
+                                "wav_path": wav_path, "no_speech": no_speech,
+                              }
+        
+        if i % 1000 == 0:
+            print(all_info[uttid])
 
 print(output_dir)
 with open(output_dir + "/all.json", "w") as fn:
     json.dump(all_info, fn, indent=4, ensure_ascii=False, cls=NpEncoder)
 
+# columnar feature store (float32 scalar features + metadata), read by the grader
+if not stt_only:
+    write_feats_store(output_dir + "/all.npz", *all_info_to_table(all_info))
+
 # write STT Result to file
 with open(output_dir + "/text", "w") as fn:
     for uttid in utt_list:
         if uttid in all_info:
             fn.write(uttid + " " + all_info[uttid]["stt"] + "\n")
 
+report_load_times()
+if not stt_only:
+    nlp_model.report_cache()
@@ -0,0 +1,104 @@
+import os
+import sys
+
+'''
+CPU budget of one feature extraction worker.
+When several prepare_feats* jobs run in parallel, torch (ESPnet, stanza, whisperx align),
+OpenBLAS/MKL (numpy, librosa) and numba (pyin) would each start a thread pool over all cores.
+configure_runtime() limits all of them to the same number of threads and can pin the worker to cores, e.g.,
+    python local/e2e_stt/prepare_feats.py ... --num_threads 4 --cpu_ids 0-3
+'''
+
+# read by the BLAS/OpenMP/numba runtimes when they are loaded (also by child processes)
+thread_env_vars = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                   "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS", "NUMBA_NUM_THREADS"]
+
+# the configured budget (None: library defaults)
+runtime_info = {"num_threads": None, "cpu_ids": None}
+
+
+def add_runtime_args(parser):
+    # 0: library defaults (or the number of --cpu_ids)
+    parser.add_argument("--num_threads",
+                        default=0,
+                        type=int)
+
+    # pin the worker to these cores, e.g., "0-3" or "0,2,4,6" ("": no pinning)
+    parser.add_argument("--cpu_ids",
+                        default="",
+                        type=str)
+
+    parser.add_argument("--interop_threads",
+                        default=1,
+                        type=int)
+
+    return parser
+
+
+def parse_cpu_ids(cpu_ids):
+    ids = []
+    for part in cpu_ids.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            ids += list(range(int(start), int(end) + 1))
+        elif part.strip() != "":
+            ids.append(int(part))
+    return ids
+
+
+def configure_runtime(num_threads=0, cpu_ids="", interop_threads=1):
+    """
+    Applies the CPU budget to every library of this process.
+    The environment variables only take effect for libraries loaded afterwards,
+    the ones already loaded are limited through their own APIs.
+    """
+    if cpu_ids != "":
+        ids = parse_cpu_ids(cpu_ids)
+        os.sched_setaffinity(0, ids)
+        runtime_info["cpu_ids"] = ids
+        if num_threads <= 0:
+            num_threads = len(ids)
+
+    if num_threads <= 0:
+        return runtime_info
+
+    for env_var in thread_env_vars:
+        os.environ[env_var] = str(num_threads)
+
+    # OpenBLAS/MKL/OpenMP pools of numpy, scipy and librosa
+    try:
+        from threadpoolctl import threadpool_limits
+        runtime_info["threadpool_limits"] = threadpool_limits(limits=num_threads)
+    except ImportError:
+        # the env vars above only reach the BLAS pools that are not loaded yet
+        print("runtime: threadpoolctl is not installed, the BLAS/OpenMP pools of the modules already imported ({}) are not limited"
+              .format(", ".join(m for m in ["numpy", "scipy", "torch"] if m in sys.modules) or "none"))
+
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+        torch.set_num_interop_threads(interop_threads)
+    except ImportError:
+        # e.g., the wenet runtime env
+        pass
+    except RuntimeError:
+        # inter-op threads can only be set once, before any inter-op parallel work
+        pass
+
+    # numba reads NUMBA_NUM_THREADS on import
+    if "numba" in sys.modules:
+        import numba
+        numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
+
+    runtime_info["num_threads"] = num_threads
+    print("runtime: {} threads, cpu_ids {}".format(num_threads, runtime_info["cpu_ids"]))
+
+    return runtime_info
+
+
+def configure_runtime_from_args(args):
+    return configure_runtime(args.num_threads, args.cpu_ids, args.interop_threads)
+
+
+def get_num_threads():
+    return runtime_info["num_threads"]
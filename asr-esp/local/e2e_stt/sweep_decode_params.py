@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import itertools
+from tqdm import tqdm
+from espnet_models import SpeechModel
+from vad_model import VadModel
+import numpy as np
+import pandas as pd
+import jiwer
+import argparse
+from runtime_config import add_runtime_args, configure_runtime_from_args
+
+'''
+Decoding-speed vs. accuracy sweep over the ESPnet search parameters.
+
+For every (beam_size, ctc_weight, lm) setting, a sample of the data dir is decoded
+in the same way as prepare_feats.py (VAD segments -> recog -> get_ctm), and we record
+    RTF of the recognition, WER against data_dir/text,
+    the downstream fluency features (word_conf_mean, sil_*, ...),
+    and how far these features move away from the reference setting.
+The results are written as a Pareto table (RTF vs. WER).
+'''
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("--data_dir",
+                    default="/share/nas165/teinhonglo/AcousticModel/2020AESRC/s5/data/cv_56",
+                    type=str)
+
+parser.add_argument("--model_tag",
+                    default="Shinji Watanabe/gigaspeech_asr_train_asr_raw_en_bpe5000_valid.acc.ave",
+                    type=str)
+
+parser.add_argument("--output_dir",
+                    default="",
+                    type=str)
+
+parser.add_argument("--sample_rate",
+                    default=16000,
+                    type=int)
+
+parser.add_argument("--vad_mode",
+                    default=1,
+                    type=int)
+
+parser.add_argument("--max_segment_length",
+                    default=15,
+                    type=int)
+
+parser.add_argument("--max_utts",
+                    default=200,
+                    type=int)
+
+parser.add_argument("--beam_sizes",
+                    default="1,5,10,20",
+                    type=str)
+
+parser.add_argument("--ctc_weights",
+                    default="0.0,0.3,0.5",
+                    type=str)
+
+parser.add_argument("--lm_weight",
+                    default=0.3,
+                    type=float)
+
+parser.add_argument("--lm_options",
+                    default="on,off",
+                    type=str)
+
+# the setting used in production (SpeechModel defaults)
+parser.add_argument("--ref_setting",
+                    default="20,0.3,on",
+                    type=str)
+
+add_runtime_args(parser)
+args = parser.parse_args()
+configure_runtime_from_args(args)
+
+data_dir = args.data_dir
+model_tag = args.model_tag
+sample_rate = args.sample_rate
+output_dir = args.output_dir
+
+if output_dir == "":
+    output_dir = os.path.join(data_dir, "decode_sweep")
+
+if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+
+beam_sizes = [int(b) for b in args.beam_sizes.split(",")]
+ctc_weights = [float(c) for c in args.ctc_weights.split(",")]
+lm_options = args.lm_options.split(",")
+ref_beam, ref_ctc, ref_lm = args.ref_setting.split(",")
+ref_setting = (int(ref_beam), float(ref_ctc), ref_lm)
+
+downstream_keys = ["word_conf_mean", "word_count", "word_freq",
+                   "sil_mean", "sil_number", "sil_rate1", "sil_rate2",
+                   "long_sil_mean", "long_sil_number", "long_sil_rate1", "long_sil_rate2"]
+
+vad_model = VadModel(mode=args.vad_mode, sample_rate=sample_rate, max_segment_length=args.max_segment_length)
+
+wavscp_dict = {}
+text_dict = {}
+utt_list = []
+
+with open(data_dir + "/wav.scp", "r") as fn:
+    for i, line in enumerate(fn.readlines()):
+        info = line.split()
+        wavscp_dict[info[0]] = info[1]
+        utt_list.append(info[0])
+
+with open(data_dir + "/text", "r") as fn:
+    for line in fn.readlines():
+        info = line.split()
+        text_dict[info[0]] = " ".join(info[1:])
+
+if args.max_utts > 0:
+    utt_list = utt_list[:args.max_utts]
+
+# load audio and VAD segments once, they are shared by all settings
+utt_data = {}
+total_audio_duration = 0.
+
+for uttid in tqdm(utt_list):
+    audio, rate = vad_model.read_wave(wavscp_dict[uttid])
+    speech = np.frombuffer(audio, dtype='int16').astype(np.float32) / 32768.0
+    speechs = vad_model.get_speech_segments(audio, rate)
+    total_duration = speech.shape[0] / rate
+    utt_data[uttid] = {"speech": speech, "speechs": speechs, "total_duration": total_duration}
+    total_audio_duration += total_duration
+
+
+def decode_setting(speech_model):
+    hyps = {}
+    feats = {}
+    recog_time = 0.
+    align_time = 0.
+
+    for uttid in tqdm(utt_list):
+        data = utt_data[uttid]
+
+        start_time = time.time()
+        text = []
+        for speech_seg in data["speechs"]:
+            text.append(speech_model.recog(speech_seg))
+        text = " ".join(" ".join(text).split())
+        recog_time += time.time() - start_time
+
+        start_time = time.time()
+        word_ctm_info = speech_model.get_ctm(data["speech"], text) if text != "" else []
+        align_time += time.time() - start_time
+
+        sil_feats_info, _ = speech_model.sil_feats(word_ctm_info, data["total_duration"])
+        word_feats_info, _ = speech_model.word_feats(word_ctm_info, data["total_duration"])
+        utt_feats = {**sil_feats_info, **word_feats_info}
+
+        hyps[uttid] = text
+        feats[uttid] = {k: float(utt_feats[k]) for k in downstream_keys}
+
+    return hyps, feats, recog_time, align_time
+
+
+def compute_wer(hyps):
+    refs, hyps_ = [], []
+    for uttid in utt_list:
+        if uttid not in text_dict or text_dict[uttid].strip() == "":
+            continue
+        refs.append(text_dict[uttid].upper())
+        hyps_.append(hyps[uttid].upper())
+    return jiwer.wer(refs, hyps_)
+
+
+settings = list(itertools.product(beam_sizes, ctc_weights, lm_options))
+if ref_setting not in settings:
+    settings = [ref_setting] + settings
+
+sweep_results = {}
+
+for beam_size, ctc_weight, lm in settings:
+    print("beam_size={}, ctc_weight={}, lm={}".format(beam_size, ctc_weight, lm))
+    speech_model = SpeechModel(model_tag, beam_size=beam_size, ctc_weight=ctc_weight,
+                               lm_weight=args.lm_weight, use_lm=(lm == "on"))
+    hyps, feats, recog_time, align_time = decode_setting(speech_model)
+    sweep_results[(beam_size, ctc_weight, lm)] = { "hyps": hyps, "feats": feats,
+                                                   "recog_time": recog_time,
+                                                   "align_time": align_time }
+    del speech_model
+
+# Pareto table
+ref_feats = sweep_results[ref_setting]["feats"]
+rows = []
+
+for (beam_size, ctc_weight, lm), result in sweep_results.items():
+    row = { "beam_size": beam_size, "ctc_weight": ctc_weight, "lm": lm,
+            "rtf": result["recog_time"] / total_audio_duration,
+            "align_rtf": result["align_time"] / total_audio_duration,
+            "wer": compute_wer(result["hyps"]) * 100 }
+
+    for k in downstream_keys:
+        values = np.array([result["feats"][uttid][k] for uttid in utt_list])
+        ref_values = np.array([ref_feats[uttid][k] for uttid in utt_list])
+        row[k] = np.mean(values)
+        # mean absolute per-utterance change w.r.t. the reference setting
+        row[k + "_mad_vs_ref"] = np.mean(np.abs(values - ref_values))
+
+    rows.append(row)
+
+sweep_df = pd.DataFrame(rows).sort_values(by=["rtf", "wer"]).reset_index(drop=True)
+
+# a setting is Pareto-optimal if no other setting is both faster and more accurate
+rtfs = sweep_df["rtf"].values
+wers = sweep_df["wer"].values
+dominated = [ bool(np.any((rtfs <= rtfs[i]) & (wers <= wers[i]) & ((rtfs < rtfs[i]) | (wers < wers[i]))))
+              for i in range(len(sweep_df)) ]
+sweep_df.insert(0, "pareto", [not d for d in dominated])
+sweep_df["is_ref"] = [ (b, c, l) == ref_setting for b, c, l in zip(sweep_df["beam_size"], sweep_df["ctc_weight"], sweep_df["lm"]) ]
+
+print("{} utts, {:.1f} seconds of audio".format(len(utt_list), total_audio_duration))
+print(sweep_df[["pareto", "is_ref", "beam_size", "ctc_weight", "lm", "rtf", "align_rtf", "wer",
+                "word_conf_mean", "word_conf_mean_mad_vs_ref", "sil_rate1_mad_vs_ref"]].to_string(index=False))
+
+sweep_df.to_excel(os.path.join(output_dir, "sweep.xlsx"), index=False)
+
+with open(os.path.join(output_dir, "sweep_hyps.json"), "w") as fn:
+    json.dump({ "{}_{}_{}".format(*k): v["hyps"] for k, v in sweep_results.items() }, fn, indent=4, ensure_ascii=False)
+
+print(output_dir)
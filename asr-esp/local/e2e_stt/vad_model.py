@@ -138,15 +138,56 @@ class VadModel(object):
             segments.append((start_time, end_time))
         return segments
         
-    def get_speech_segments(self, audio, sample_rate=16000):
+    def get_segment_times(self, audio, sample_rate=16000):
         """
-        Compute and print the segments for the given uttid. It is in the format:
-        <segment-id> <utt-id> <start-time> <end-time>
+        Returns the voiced segments of PCM audio data as a list of
+        (start_time, end_time) tuples in seconds.
         """
         frame_duration_ms = self.frame_duration_ms
         frames = self.frame_generator(frame_duration_ms, audio, sample_rate)
         frames = list(frames)
         segments = self.vad_segments(sample_rate, frame_duration_ms, 300, frames)
+        return segments
+        
+    def is_silent(self, speech, sample_rate=16000, min_speech_ratio=0.02, min_energy_db=-50., audio=None):
+        """
+        Fast pre-screen for empty or noise-only responses, so that they can skip ASR and alignment.
+        speech: float waveform in [-1, 1]
+        audio: PCM bytes of speech if the caller has them (read_wave), otherwise speech is re-encoded
+        A response is silent if the loudest frame is below min_energy_db (dBFS) or
+        less than min_speech_ratio of the recording is voiced (VAD).
+        Returns (is_silent, speech_ratio, energy_db, segment_times), segment_times are the
+        get_segment_times of the VAD pass (None if the energy check already failed), so that
+        the caller can segment the response without running the VAD again.
+        """
+        speech = np.asarray(speech, dtype=np.float32)
+        frame_length = int(sample_rate * self.frame_duration_ms / 1000)
+        num_frames = speech.shape[0] // frame_length
+        
+        if num_frames == 0:
+            return True, 0., -np.inf, None
+        
+        frames = speech[:num_frames * frame_length].reshape(num_frames, frame_length)
+        frame_rms = np.sqrt(np.mean(frames ** 2, axis=1))
+        energy_db = 20 * np.log10(np.maximum(np.max(frame_rms), 1.0e-10))
+        
+        if energy_db < min_energy_db:
+            return True, 0., energy_db, None
+        
+        if audio is None:
+            audio = (np.clip(speech, -1., 1.) * 32767).astype(np.int16).tobytes()
+        segment_times = self.get_segment_times(audio, sample_rate)
+        voiced_duration = sum([end - start for start, end in segment_times])
+        speech_ratio = voiced_duration / (speech.shape[0] / sample_rate)
+        
+        return speech_ratio < min_speech_ratio, speech_ratio, energy_db, segment_times
+    
+    def get_speech_segments(self, audio, sample_rate=16000):
+        """
+        Compute and print the segments for the given uttid. It is in the format:
+        <segment-id> <utt-id> <start-time> <end-time>
+        """
+        segments = self.get_segment_times(audio, sample_rate)
         speech = np.frombuffer(audio, dtype='int16').astype(np.float32) / 32768.0
         voiced_speechs = []
         
@@ -0,0 +1,105 @@
+import dataclasses
+import numpy as np
+import torch
+import whisper
+
+'''
+Batched decoding for openai-whisper.
+VAD segments (<= 30 s) of one or more utterances are padded to 30 s, stacked into a
+single log-mel batch and decoded by one whisper.decode call.
+Like whisper.transcribe, the segments that fail the compression-ratio/avg-logprob
+checks are decoded again at the next temperature (only those, still batched).
+'''
+
+# whisper.transcribe defaults
+temperatures = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+compression_ratio_threshold = 2.4
+logprob_threshold = -1.0
+no_speech_threshold = 0.6
+
+def get_decode_options(language=None, suppress_tokens=[-1], device="cpu"):
+    # no timestamps and no previous-text prompt: every segment is decoded on its own
+    return whisper.DecodingOptions(task="transcribe",
+                                   language=language,
+                                   suppress_tokens=suppress_tokens,
+                                   without_timestamps=True,
+                                   fp16=(device == "cuda"))
+
+
+def decode_segments(model, segments, options):
+    """
+    segments: list of float32 waveforms at 16 kHz
+    Returns the decoded text of each segment.
+    """
+    mels = []
+    for segment in segments:
+        audio = whisper.pad_or_trim(torch.from_numpy(np.asarray(segment, dtype=np.float32)))
+        mels.append(whisper.log_mel_spectrogram(audio, n_mels=model.dims.n_mels))
+
+    mel = torch.stack(mels).to(model.device)
+    results = [None] * len(segments)
+    todo = list(range(len(segments)))
+
+    for temperature in temperatures:
+        todo_results = whisper.decode(model, mel[todo], dataclasses.replace(options, temperature=temperature))
+        retry = []
+
+        for idx, result in zip(todo, todo_results):
+            results[idx] = result
+            needs_fallback = result.compression_ratio > compression_ratio_threshold or result.avg_logprob < logprob_threshold
+            # silence, a higher temperature won't help
+            if result.no_speech_prob > no_speech_threshold and result.avg_logprob < logprob_threshold:
+                needs_fallback = False
+            if needs_fallback:
+                retry.append(idx)
+
+        todo = retry
+        if len(todo) == 0:
+            break
+
+    texts = []
+    for result in results:
+        # whisper.transcribe drops the segments it takes for silence
+        if result.no_speech_prob > no_speech_threshold and result.avg_logprob < logprob_threshold:
+            texts.append("")
+        else:
+            texts.append(result.text)
+
+    return texts
+
+
+class SegmentBatcher(object):
+    """
+    Queues the VAD segments of consecutive utterances and decodes them in batches of batch_size.
+    Call add() for every utterance, flush() at the end, then read the texts from self.texts.
+    """
+    def __init__(self, model, options, batch_size=8):
+        self.model = model
+        self.options = options
+        self.batch_size = batch_size
+        self.queue = []
+        # uttid -> list of segment texts (in order)
+        self.texts = {}
+
+    def add(self, uttid, segments):
+        self.texts[uttid] = [""] * len(segments)
+
+        for seg_idx, segment in enumerate(segments):
+            self.queue.append((uttid, seg_idx, segment))
+
+            if len(self.queue) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if len(self.queue) == 0:
+            return
+
+        texts = decode_segments(self.model, [segment for _, _, segment in self.queue], self.options)
+
+        for (uttid, seg_idx, _), text in zip(self.queue, texts):
+            self.texts[uttid][seg_idx] = text
+
+        self.queue = []
+
+    def get_text(self, uttid):
+        return " ".join(" ".join(self.texts[uttid]).split())
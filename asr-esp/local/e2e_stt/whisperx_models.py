@@ -7,9 +7,16 @@ from tqdm import tqdm
 from g2p_en import G2p
 from whisper.normalizers import EnglishTextNormalizer
 import whisperx
+from whisperx.alignment import get_trellis, backtrack, merge_repeats
+from whisperx.vad import merge_chunks
+from whisperx.asr import find_numeral_symbol_tokens
+from whisperx.audio import SAMPLE_RATE
 from whisper.tokenizer import get_tokenizer
 import string
 import re
+import torch
+from lazy_utils import lazy_component, timed, get_suppress_tokens
+from runtime_config import get_num_threads
 
 
 '''
@@ -55,8 +62,16 @@ def get_stats(numeric_list, prefix=""):
     return stats_dict
     
     
+# default inference settings per device
+# cpu: int8 CTranslate2 weights, a small batch (CPU decoding gains little from large batches)
+inference_profiles = {
+    "cuda": {"compute_type": "float16", "batch_size": 4, "cpu_threads": None},
+    "cpu": {"compute_type": "int8", "batch_size": 2, "cpu_threads": 4},
+}
+
 class SpeechModel(object):
-    def __init__(self, tag="large-v2", device="cuda", language="en", condition_on_previous_text=False):
+    def __init__(self, tag="large-v2", device="cuda", language="en", condition_on_previous_text=False,
+                compute_type=None, batch_size=None, cpu_threads=None):
         # Fluency
         self.sil_seconds = 0.145
         self.long_sil_seconds = 0.495
@@ -65,51 +80,86 @@ class SpeechModel(object):
                                  "Ah", "Um", "Uh", "Em", "Oh", "Hm", "Hmm", 
                                  "ah", "um", "uh", "em", "oh", "hm", "hmm"]
         self.special_words = ["<UNK>"]
-        self.g2p = G2p()
         # STT
         #encourage model to transcribe words literally
-        tokenizer = get_tokenizer(multilingual=False)  # use multilingual=True if using multilingual model
-        
-        number_tokens = [
-            i
-            for i in range(tokenizer.eot)
-            if all(c in "0123456789" for c in tokenizer.decode([i]).removeprefix(" "))
-        ]
-        
-        punc_tokens = [
-            i 
-            for i in range(tokenizer.eot)
-            if all(c in list("!?-,.。，")  for c in tokenizer.decode([i]).removeprefix(" "))
-        ]
+        with timed("whisper suppress tokens"):
+            tokenizer = get_tokenizer(multilingual=False)  # use multilingual=True if using multilingual model
+            number_tokens, punc_tokens = get_suppress_tokens(tokenizer, numeric_chars="0123456789", punc_chars="!?-,.。，")
         
         suppress_tokens = [-1] + number_tokens #+ punc_tokens
         
-        self.compute_type = "float16" # change to "int8" if low on GPU mem (may reduce accuracy)
-        self.batch_size = 4
+        profile = inference_profiles["cpu" if device == "cpu" else "cuda"]
+        # float16 on GPU, change to "int8" if low on GPU mem (may reduce accuracy)
+        self.compute_type = compute_type if compute_type is not None else profile["compute_type"]
+        self.batch_size = batch_size if batch_size is not None else profile["batch_size"]
+        # explicit cpu_threads > the budget of the worker (runtime_config) > the inference profile
+        if cpu_threads is None:
+            cpu_threads = get_num_threads()
+        self.cpu_threads = cpu_threads if cpu_threads is not None else profile["cpu_threads"]
         self.language = language
         self.decode_options = {"suppress_tokens": suppress_tokens}
         self.decode_options["condition_on_previous_text"] = condition_on_previous_text
         self.decode_options["suppress_numerals"] = True
         self.device = device
+        
+        load_options = {}
+        if self.device == "cpu":
+            # threads used by CTranslate2 for this model instance
+            load_options["threads"] = self.cpu_threads
+            self.set_num_threads()
+        
         # stt model
-        self.model = whisperx.load_model(tag, self.device, compute_type=self.compute_type, language=self.language, asr_options=self.decode_options)
-        # alignment model
-        self.model_a, self.metadata = whisperx.load_align_model(language_code=self.language, device=self.device)
+        with timed("whisperx model"):
+            self.model = whisperx.load_model(tag, self.device, compute_type=self.compute_type, language=self.language, asr_options=self.decode_options, **load_options)
         # english std
         self.eng_std = EnglishTextNormalizer()
+    
+    # alignment model and g2p are only loaded when the ctm is needed
+    @lazy_component("whisperx align model")
+    def align_model(self):
+        model_a, metadata = whisperx.load_align_model(language_code=self.language, device=self.device)
+        model_a.eval()
+        return model_a, metadata
+    
+    @property
+    def model_a(self):
+        return self.align_model[0]
+    
+    @property
+    def metadata(self):
+        return self.align_model[1]
+    
+    @lazy_component("g2p")
+    def g2p(self):
+        return G2p()
 
     
+    def set_num_threads(self):
+        # torch uses a process-wide pool, re-apply the budget of this instance
+        if self.device == "cpu" and self.cpu_threads is not None:
+            if torch.get_num_threads() != self.cpu_threads:
+                torch.set_num_threads(self.cpu_threads)
+    
     # STT features
-    def recog(self, audio):
+    def recog(self, audio, align=True):
+        self.set_num_threads()
         result = self.model.transcribe(audio, batch_size=self.batch_size)
         # merged results
         segments = [ result['segments'][i]['text'] for i in range(len(result['segments'])) ]
         timestamp = [ [result['segments'][i]['start'], result['segments'][i]['end']] for i in range(len(result['segments'])) ]
         text = " ".join(segments)
         text_norm = re.sub(r'[^\w\s]', '', text)
+        
+        if not align:
+            # STT only, skip the alignment model and g2p
+            if len(segments) == 0:
+                raise IndexError("No speech segments")
+            return [text, text_norm], [[], []]
+        
         results = {"segments": [{"text": text_norm, "start": timestamp[0][0], "end": timestamp[-1][-1]}], "language": self.language }
         
-        result = whisperx.align(results["segments"], self.model_a, self.metadata, audio, self.device, return_char_alignments=False)
+        with torch.inference_mode():
+            result = whisperx.align(results["segments"], self.model_a, self.metadata, audio, self.device, return_char_alignments=False)
         '''
         [{'start': 0.929, 'end': 4.753, 'text': ' I think Chinese class is the most interesting.', 'words': [{'word': 'I', 'start': 0.929, 'end': 1.029, 'score': 0.996}, {'word': 'think', 'start': 1.109, 'end': 1.389, 'score': 0.816}, {'word': 'Chinese', 'start': 1.489, 'end': 2.01, 'score': 0.677}, {'word': 'class', 'start': 2.11, 'end': 2.551, 'score': 0.924}, {'word': 'is', 'start': 2.691, 'end': 2.811, 'score': 0.816}, {'word': 'the', 'start': 2.891, 'end': 3.031, 'score': 0.771}, {'word': 'most', 'start': 3.111, 'end': 3.632, 'score': 0.816}, {'word': 'interesting.', 'start': 4.032, 'end': 4.753, 'score': 0.569}]}]
         '''
@@ -129,6 +179,185 @@ class SpeechModel(object):
         
         return [text, text_norm], [word_ctm, phone_ctm]
     
+    def recog_many(self, wav_paths, align=True, chunk_size=30):
+        """
+        Corpus-level version of recog().
+        wav_paths: {uttid: wav_path (or audio array)}
+        The VAD chunks of all utterances are decoded in full batches of self.batch_size.
+        The alignment model is run per utterance (see align_many, skipped if align is False).
+        Returns {uttid: ([text, text_norm], [word_ctm, phone_ctm])}, or {uttid: None}
+        if no speech was detected.
+        """
+        self.set_num_threads()
+        model = self.model
+        
+        if model.tokenizer is None:
+            # the language is detected per utterance inside transcribe()
+            results = {}
+            for uttid, wav_path in wav_paths.items():
+                try:
+                    results[uttid] = self.recog(wav_path, align=align)
+                except IndexError:
+                    results[uttid] = None
+            return results
+        
+        audios = {}
+        chunk_info = []
+        
+        # 1. VAD on every utterance, gather the chunks
+        for uttid, wav_path in wav_paths.items():
+            audio = whisperx.load_audio(wav_path) if isinstance(wav_path, str) else wav_path
+            audios[uttid] = audio
+            vad_segments = model.vad_model({"waveform": torch.from_numpy(audio).unsqueeze(0), "sample_rate": SAMPLE_RATE})
+            vad_segments = merge_chunks(vad_segments, chunk_size, onset=model._vad_params["vad_onset"], offset=model._vad_params["vad_offset"])
+            
+            for seg in vad_segments:
+                chunk_info.append([uttid, round(seg['start'], 3), round(seg['end'], 3)])
+        
+        def data(chunk_info):
+            for uttid, start, end in chunk_info:
+                f1 = int(start * SAMPLE_RATE)
+                f2 = int(end * SAMPLE_RATE)
+                yield {'inputs': audios[uttid][f1:f2]}
+        
+        # 2. decode the chunks of all utterances in full batches
+        utt_segments = {uttid: [] for uttid in wav_paths}
+        
+        # suppress_numerals is applied in transcribe(), do the same around the batched call
+        previous_suppress_tokens = model.options.suppress_tokens
+        if model.suppress_numerals:
+            numeral_symbol_tokens = find_numeral_symbol_tokens(model.tokenizer)
+            model.options = model.options._replace(suppress_tokens=list(set(numeral_symbol_tokens + previous_suppress_tokens)))
+        
+        try:
+            outputs = model(data(chunk_info), batch_size=self.batch_size, num_workers=0)
+            
+            for (uttid, start, end), out in zip(chunk_info, outputs):
+                text = out['text']
+                if isinstance(text, list):
+                    text = text[0]
+                utt_segments[uttid].append({"text": text, "start": start, "end": end})
+        finally:
+            model.options = model.options._replace(suppress_tokens=previous_suppress_tokens)
+        
+        # 3. merge the chunks of each utterance, then align them
+        results = {}
+        align_items = []
+        
+        for uttid, segments in utt_segments.items():
+            if len(segments) == 0:
+                results[uttid] = None
+                continue
+            text = " ".join([seg["text"] for seg in segments])
+            text_norm = re.sub(r'[^\w\s]', '', text)
+            results[uttid] = [text, text_norm]
+            align_items.append([uttid, text_norm, segments[0]["start"], segments[-1]["end"]])
+        
+        if align:
+            word_ctms = self.align_many(align_items, audios)
+        
+        for uttid, text_result in results.items():
+            if text_result is None:
+                continue
+            if not align:
+                results[uttid] = (text_result, [[], []])
+                continue
+            word_ctm = word_ctms[uttid]
+            phone_ctm, _ = self.get_phone_ctm(word_ctm)
+            results[uttid] = (text_result, [word_ctm, phone_ctm])
+        
+        return results
+    
+    def align_many(self, align_items, audios):
+        """
+        whisperx.align for one segment per utterance, with the dictionary/blank lookup done once.
+        align_items: [[uttid, text, start, end], ...]
+        The alignment model is run per utterance (unpadded): zero padding changes the emissions of
+        the group-norm wav2vec2 and the attention_mask models, so the CTMs stay the same as whisperx.align.
+        Returns {uttid: word_ctm}
+        """
+        model_dictionary = self.metadata["dictionary"]
+        model_type = self.metadata["type"]
+        blank_id = 0
+        for char, code in model_dictionary.items():
+            if char == '[pad]' or char == '<pad>':
+                blank_id = code
+        
+        word_ctms = {}
+        
+        for uttid, text, start, end in align_items:
+            waveform = torch.from_numpy(audios[uttid][int(start * SAMPLE_RATE): int(end * SAMPLE_RATE)]).unsqueeze(0)
+            lengths = None
+            # minimum input length of wav2vec2 models (same as whisperx.align)
+            if waveform.shape[-1] < 400:
+                lengths = torch.as_tensor([waveform.shape[-1]]).to(self.device)
+                waveform = torch.nn.functional.pad(waveform, (0, 400 - waveform.shape[-1]))
+            
+            with torch.inference_mode():
+                if model_type == "torchaudio":
+                    emissions, _ = self.model_a(waveform.to(self.device), lengths=lengths)
+                else:
+                    emissions = self.model_a(waveform.to(self.device)).logits
+                emissions = torch.log_softmax(emissions, dim=-1).cpu()
+            
+            word_ctms[uttid] = self.__align_emission(emissions[0], text, start, end, model_dictionary, blank_id)
+        
+        return word_ctms
+    
+    def __align_emission(self, emission, text, start, end, model_dictionary, blank_id):
+        # keep only the characters in the dictionary (same rules as whisperx.align)
+        num_leading = len(text) - len(text.lstrip())
+        num_trailing = len(text) - len(text.rstrip())
+        clean_char, clean_cdx = [], []
+        
+        for cdx, char in enumerate(text):
+            char_ = char.lower().replace(" ", "|")
+            if cdx < num_leading or cdx > len(text) - num_trailing - 1:
+                continue
+            if char_ in model_dictionary.keys():
+                clean_char.append(char_)
+                clean_cdx.append(cdx)
+        
+        if len(clean_char) == 0:
+            return []
+        
+        text_clean = "".join(clean_char)
+        tokens = [model_dictionary[c] for c in text_clean]
+        trellis = get_trellis(emission, tokens, blank_id)
+        path = backtrack(trellis, emission, tokens, blank_id)
+        
+        if path is None:
+            return []
+        
+        char_segments = merge_repeats(path, text_clean)
+        # position of each character in char_segments
+        clean_pos = {cdx: i for i, cdx in enumerate(clean_cdx)}
+        ratio = (end - start) / (trellis.size(0) - 1)
+        
+        # assign the aligned characters to words
+        word_ctm = []
+        word_chars = []
+        char_times = []
+        
+        for cdx, char in enumerate(text):
+            if cdx in clean_pos:
+                char_seg = char_segments[clean_pos[cdx]]
+                char_times.append([char_seg.start * ratio + start, char_seg.end * ratio + start, char_seg.score])
+            if char != " ":
+                word_chars.append(char)
+            
+            if (cdx == len(text) - 1 or text[cdx + 1] == " ") and len(word_chars) > 0:
+                if len(char_times) > 0:
+                    word_start = round(min([t[0] for t in char_times]), 3)
+                    word_end = round(max([t[1] for t in char_times]), 3)
+                    word_score = round(float(np.mean([t[2] for t in char_times])), 3)
+                    # [ word, start, duration, score ]
+                    word_ctm.append(["".join(word_chars), word_start, word_end - word_start, word_score])
+                word_chars = []
+                char_times = []
+        
+        return word_ctm
+    
     
     def get_phone_ctm(self, ctm_info):
         # use g2p model
@@ -190,14 +419,14 @@ class SpeechModel(object):
         num_long_sils = len(long_sil_list)
         num_words = len(ctm_info)
         
-        sil_stats["sil_rate1"] = num_sils / response_duration
+        sil_stats["sil_rate1"] = num_sils / response_duration if response_duration > 0 else 0
         
         if num_words > 0:
             sil_stats["sil_rate2"] = num_sils / num_words
         else:
             sil_stats["sil_rate2"] = 0
         
-        long_sil_stats["long_sil_rate1"] = num_long_sils / response_duration 
+        long_sil_stats["long_sil_rate1"] = num_long_sils / response_duration if response_duration > 0 else 0
         
         if num_words > 0:
             long_sil_stats["long_sil_rate2"] = num_long_sils / num_words
@@ -254,7 +483,7 @@ class SpeechModel(object):
         # word basic_dict
         word_count = sum(list(word_count_dict.values()))
         word_distinct = len(list(word_count_dict.keys()))
-        word_freq = word_count / response_duration
+        word_freq = word_count / response_duration if response_duration > 0 else 0
         
         word_basic_dict = { 
                             "word_count": word_count,
@@ -300,7 +529,7 @@ class SpeechModel(object):
         # strat_time and duration of last phone
         # word in articlulation time
         phone_count = sum(list(phone_count_dict.values()))
-        phone_freq = phone_count / response_duration
+        phone_freq = phone_count / response_duration if response_duration > 0 else 0
         phone_duration_stats = get_stats(phone_duration_list, prefix = "phone_duration_")
         phone_conf_stats = get_stats(phone_conf_list, prefix="phone_conf_")
         vowel_duration_stats = get_stats(vowel_duration_list, prefix = "vowel_duration_")
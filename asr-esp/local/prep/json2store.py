@@ -0,0 +1,24 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "e2e_stt"))
+import argparse
+import json
+from feats_store import all_info_to_table, write_feats_store
+
+# all.json -> all.npz (columnar feature store), for features extracted before the store existed
+parser = argparse.ArgumentParser()
+
+parser.add_argument('--data_dir', type=str, default="data/voice_2022/gigaspeech")
+
+args = parser.parse_args()
+
+data_dir = args.data_dir
+json_fn = os.path.join(data_dir, "all.json")
+
+with open(json_fn, "r") as fn:
+    all_json = json.load(fn)
+
+meta, feat_keys, feats = all_info_to_table(all_json)
+write_feats_store(os.path.join(data_dir, "all.npz"), meta, feat_keys, feats)
+
+print(os.path.join(data_dir, "all.npz"), feats.shape)
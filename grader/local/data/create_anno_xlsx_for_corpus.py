@@ -11,6 +11,9 @@ from  sklearn import preprocessing
 from scipy import stats
 
 import argparse
+import sys
+sys.path.append("./local")
+from feats_loader import read_feats_table
 
 parser = argparse.ArgumentParser()
 
@@ -30,13 +33,18 @@ parser.add_argument("--aspect",
                     default="2",
                     type=str)
 
+# e.g., all.npz (columnar feature store, asr-esp/local/e2e_stt/feats_store.py), default: <model_name>-feats.xlsx
+parser.add_argument("--feats_fn",
+                    default="",
+                    type=str)
+
 args = parser.parse_args()
 
 # data/spoken_test_2022_jan28/grader.spk2p3s2
 model_name = args.model_name
 part = args.part
 label_fn = "grader.spk2p" + part + "s" + args.aspect
-feats_fn = model_name + "-feats.xlsx"
+feats_fn = args.feats_fn if args.feats_fn != "" else model_name + "-feats.xlsx"
 
 data_dir = args.data_dir
 result_root = "../automated-english-transcription-grader/data"
@@ -51,7 +59,7 @@ with open(os.path.join(data_dir, label_fn), "r") as fn:
         spk2label[spk] = float(grade)
 
 # feats
-feats_df = pd.read_excel(os.path.join(data_dir, model_name, feats_fn), dtype=str)
+feats_df = read_feats_table(os.path.join(data_dir, model_name, feats_fn))
 #feat_keys = [fk for fk in list(feats_df.keys())[6:] if "list" not in fk and "voiced_probs" not in fk]
 feats_map = {"stt": "text", "prompt": "prompt"}
 feats_keys = list(feats_map.keys())
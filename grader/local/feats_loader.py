@@ -0,0 +1,117 @@
+import os
+import json
+import importlib.util
+import numpy as np
+import pandas as pd
+
+# feats_store.py is shared with the feature extraction (asr-esp/local/e2e_stt);
+# load only that file instead of putting the whole e2e_stt dir on sys.path
+feats_store_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "asr-esp", "local", "e2e_stt", "feats_store.py")
+feats_store_spec = importlib.util.spec_from_file_location("feats_store", feats_store_path)
+feats_store = importlib.util.module_from_spec(feats_store_spec)
+feats_store_spec.loader.exec_module(feats_store)
+read_feats_table, read_feats_store, read_feats_schema = feats_store.read_feats_table, feats_store.read_feats_store, feats_store.read_feats_schema
+write_feats_store, get_schema_path, meta_keys = feats_store.write_feats_store, feats_store.get_schema_path, feats_store.meta_keys
+
+'''
+Feature matrices for the grader scripts.
+The numeric feature columns are selected once and cast to float32 in one go, the
+speaker grouping is a groupby, and a parsed xlsx is cached as a feature store
+(<feats file>.cache.npz) that is rebuilt when the xlsx is modified.
+'''
+
+def get_feat_keys(columns):
+    # the first 6 columns are metadata (fname, spkID, part, qID, prompt, stt)
+    return np.array([fk for fk in list(columns)[6:] if "list" not in fk and "voiced_probs" not in fk])
+
+
+def load_feats(feats_path):
+    """
+    Returns (meta_df, feat_keys, X), X is a float32 matrix with one row per response.
+    """
+    if feats_path.endswith(".npz"):
+        meta, store_feat_keys, X = read_feats_store(feats_path)
+        feat_keys = get_feat_keys(meta_keys + list(store_feat_keys))
+        X = pd.DataFrame(X, columns=store_feat_keys)[feat_keys].values
+        return pd.DataFrame(meta), feat_keys, X
+
+    # parsed xlsx, valid as long as the xlsx has the same mtime
+    cache_path = feats_path + ".cache.npz"
+    mtime = os.path.getmtime(feats_path)
+
+    if os.path.exists(cache_path) and os.path.exists(get_schema_path(cache_path)):
+        if read_feats_schema(cache_path).get("source_mtime") == mtime:
+            meta, feat_keys, X = read_feats_store(cache_path)
+            return pd.DataFrame(meta), feat_keys, X
+
+    feats_df = read_feats_table(feats_path)
+    feat_keys = get_feat_keys(feats_df.keys())
+    X = feats_df[feat_keys].values.astype(np.float32)
+    meta_df = feats_df[meta_keys].astype(str)
+
+    try:
+        write_feats_store(cache_path, {mk: meta_df[mk].values for mk in meta_keys}, feat_keys, X,
+                          extra_schema={"source": os.path.basename(feats_path), "source_mtime": mtime})
+    except OSError as e:
+        print("[Feats Loader] can not write the cache {}: {}".format(cache_path, e))
+
+    return meta_df, feat_keys, X
+
+
+def load_spk_feats(feats_path, part, agg="mean"):
+    """
+    Speaker-level features of one part.
+    agg: "mean" averages the responses of a speaker, "last" keeps the last one.
+    Returns (feat_keys, DataFrame indexed by spkID)
+    """
+    meta_df, feat_keys, X = load_feats(feats_path)
+    feats_df = pd.DataFrame(X, columns=feat_keys)
+    feats_df.insert(0, "spkID", meta_df["spkID"].values)
+    feats_df = feats_df[meta_df["part"].values == part]
+
+    if agg == "mean":
+        # only part 2 has several responses per speaker
+        assert part == "2" or feats_df["spkID"].is_unique
+        spk_feats_df = feats_df.groupby("spkID", sort=False).mean()
+    else:
+        spk_feats_df = feats_df.drop_duplicates("spkID", keep="last").set_index("spkID")
+
+    return feat_keys, spk_feats_df
+
+
+def load_utt_feats(feats_path, id_key="fname"):
+    """
+    Response-level features indexed by id_key (in teemi, the text_id is stored as fname).
+    Returns (feat_keys, DataFrame), or raises ValueError if the ids are not unique.
+    """
+    meta_df, feat_keys, X = load_feats(feats_path)
+    utt_feats_df = pd.DataFrame(X, columns=feat_keys, index=meta_df[id_key].values)
+
+    if not utt_feats_df.index.is_unique:
+        dup_ids = utt_feats_df.index[utt_feats_df.index.duplicated()].unique().tolist()
+        raise ValueError("The IDs {} shouldn't be duplicated. Remember to recheck the feature file {} .".format(dup_ids[:5], feats_path))
+
+    return feat_keys, utt_feats_df
+
+
+def save_feats_info(model_dir, checkpoint, score_name, feat_keys, select_support=None, num_labels=None):
+    """
+    Feature-key order and selection mask of a checkpoint (<model_dir>/feats_info.json), read by local/score_service.py.
+    num_labels: number of levels, the predictions are clipped to [1, num_labels]
+    """
+    if select_support is None:
+        select_support = np.ones(len(feat_keys), dtype=int)
+
+    feats_info = { "checkpoint": checkpoint,
+                   "score_name": score_name,
+                   "feat_keys": [str(fk) for fk in feat_keys],
+                   "select_support": [int(s) for s in select_support],
+                   "num_labels": num_labels }
+
+    with open(os.path.join(model_dir, "feats_info.json"), "w") as fn:
+        json.dump(feats_info, fn, indent=4)
+
+
+def load_feats_info(model_dir):
+    with open(os.path.join(model_dir, "feats_info.json"), "r") as fn:
+        return json.load(fn)
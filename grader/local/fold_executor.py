@@ -0,0 +1,105 @@
+import io
+import os
+import contextlib
+import numpy as np
+from multiprocessing import get_context, shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+'''
+K-fold training in a process pool (stats_models/*.py --n_jobs).
+X and y are copied once into shared memory and the (forked) workers map them by name,
+so a task only carries the fold indices. The stdout of a fold is buffered in the worker
+and printed in fold order, so the logs read the same as a serial run.
+'''
+
+# the arrays of a worker process
+__worker = {}
+
+
+def add_fold_args(parser):
+    # number of folds trained in parallel (1: serial, -1: one process per fold)
+    parser.add_argument("--n_jobs",
+                        default=1,
+                        type=int)
+    return parser
+
+
+def get_fold_jobs(n_jobs, num_folds):
+    # number of worker processes actually used by run_folds
+    if n_jobs < 0:
+        n_jobs = num_folds
+    return max(1, min(n_jobs, num_folds, os.cpu_count()))
+
+
+def __to_shared(arr):
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+
+def __from_shared(desc):
+    name, shape, dtype = desc
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def __init_worker(fold_fn, X_desc, y_desc, num_threads):
+    X_shm, X = __from_shared(X_desc)
+    y_shm, y = __from_shared(y_desc)
+    # keep the handles, the arrays are views of them
+    __worker.update({"fold_fn": fold_fn, "X": X, "y": y, "shm": [X_shm, y_shm]})
+
+    # the folds share the cores, one BLAS/OpenMP pool per fold would oversubscribe them
+    try:
+        from threadpoolctl import threadpool_limits
+        __worker["threadpool_limits"] = threadpool_limits(limits=num_threads)
+    except ImportError:
+        pass
+
+
+def __run_fold(i, train_index, test_index):
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        result = __worker["fold_fn"](i, __worker["X"], __worker["y"], train_index, test_index)
+    return result, log.getvalue()
+
+
+def run_folds(fold_fn, X, y, folds, n_jobs=1):
+    """
+    fold_fn(i, X, y, train_index, test_index) -> result of the i-th fold (picklable)
+    folds: [(train_index, test_index), ...], e.g., list(kf.split(X))
+    Returns the results in fold order.
+    """
+    n_jobs = get_fold_jobs(n_jobs, len(folds))
+
+    if n_jobs <= 1:
+        return [ fold_fn(i, X, y, train_index, test_index) for i, (train_index, test_index) in enumerate(folds) ]
+
+    X_shm, X_desc = __to_shared(np.asarray(X))
+    y_shm, y_desc = __to_shared(np.asarray(y))
+    num_threads = max(1, os.cpu_count() // n_jobs)
+    results = []
+
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=get_context("fork"),
+                                 initializer=__init_worker, initargs=(fold_fn, X_desc, y_desc, num_threads)) as executor:
+            futures = [ executor.submit(__run_fold, i, train_index, test_index) for i, (train_index, test_index) in enumerate(folds) ]
+            for future in futures:
+                result, log = future.result()
+                print(log, end="")
+                results.append(result)
+    finally:
+        for shm in [X_shm, y_shm]:
+            shm.close()
+            shm.unlink()
+
+    return results
+
+
+def merge_kfold_info(kfold_info, fold_info):
+    # appends the rows of a fold (same layout as kfold_info) in place
+    for f in fold_info:
+        for info in fold_info[f]:
+            kfold_info[f][info] += fold_info[f][info]
+    return kfold_info
@@ -0,0 +1,112 @@
+import os
+import json
+import numpy as np
+from sklearn.model_selection import KFold
+from fold_executor import get_fold_jobs
+
+'''
+Hyperparameter search of the stats_models graders (--search).
+In each outer fold, the candidates are evaluated by successive halving (HalvingRandomSearchCV)
+on the already selected features of the fold, before any resampling (duplicated speakers would
+leak across the inner folds): all candidates start on a small share of the training speakers and
+only the best 1/--search_factor of them go on with more data.
+The candidates are fitted in parallel over the cores left by the fold workers, and the
+chosen configuration is written to <fold dir>/search_config.json.
+'''
+
+# candidate hyperparameters of each grader
+search_spaces = {
+    "lasso": { "alpha": [0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0] },
+    "gbr": { "n_estimators": [100, 200, 400],
+             "max_depth": [2, 3, 4],
+             "min_samples_split": [2, 5, 10],
+             "learning_rate": [0.01, 0.05, 0.1],
+             "subsample": [0.8, 1.0] },
+    "rf": { "n_estimators": [100, 200, 400],
+            "max_depth": [None, 4, 8, 16],
+            "min_samples_leaf": [1, 2, 4],
+            "max_features": ["sqrt", 0.5, None] },
+}
+
+# scoring of the inner folds, rmse of the scores for the regressors and
+# accuracy of the levels for the classifiers (the metric reported by random_forest_classifier.py)
+search_scorings = {
+    "lasso": "neg_root_mean_squared_error",
+    "gbr": "neg_root_mean_squared_error",
+    "rf": "accuracy",
+}
+
+
+def add_search_args(parser):
+    parser.add_argument("--search",
+                        action="store_true")
+
+    # number of candidates sampled from the search space
+    # the cost grows with the candidates (single core, rf: ~40s with 32 candidates vs. ~2s for a fixed run),
+    # --search_jobs spreads them over the cores
+    parser.add_argument("--search_candidates",
+                        default=8,
+                        type=int)
+
+    parser.add_argument("--search_factor",
+                        default=3,
+                        type=int)
+
+    # inner folds of a search (on the training part of an outer fold)
+    parser.add_argument("--search_cv",
+                        default=3,
+                        type=int)
+
+    # 0: the cores left by the fold workers (--n_jobs)
+    parser.add_argument("--search_jobs",
+                        default=0,
+                        type=int)
+    return parser
+
+
+def search_params(model, estimator, X, y, args, num_folds=5, fold_dir=None):
+    """
+    model: key of search_spaces, estimator: an unfitted sklearn estimator
+    Returns the best parameters (to be passed to the estimator class)
+    """
+    from sklearn.experimental import enable_halving_search_cv  # noqa
+    from sklearn.model_selection import HalvingRandomSearchCV
+
+    n_jobs = args.search_jobs
+    if n_jobs <= 0:
+        n_jobs = max(1, os.cpu_count() // get_fold_jobs(args.n_jobs, num_folds))
+
+    # plain KFold, some levels have fewer speakers than inner folds
+    search = HalvingRandomSearchCV(estimator,
+                                   search_spaces[model],
+                                   n_candidates=args.search_candidates,
+                                   factor=args.search_factor,
+                                   cv=KFold(n_splits=args.search_cv, shuffle=True, random_state=66),
+                                   scoring=search_scorings[model],
+                                   random_state=66,
+                                   n_jobs=n_jobs)
+    search.fit(X, y)
+
+    print("=" * 10, "Search", "=" * 10)
+    print(search.best_params_, search_scorings[model], search.best_score_)
+
+    if fold_dir is not None:
+        save_search_config(os.path.join(fold_dir, "search_config.json"), model, search)
+
+    return search.best_params_
+
+
+def save_search_config(config_path, model, search):
+    config = { "model": model,
+               "best_params": search.best_params_,
+               "scoring": search_scorings[model],
+               "best_score": float(search.best_score_),
+               "n_candidates": [int(n) for n in search.n_candidates_],
+               "n_resources": [int(n) for n in search.n_resources_],
+               "search_space": search_spaces[model] }
+
+    if not os.path.exists(os.path.dirname(config_path)):
+        os.makedirs(os.path.dirname(config_path))
+
+    with open(config_path, "w") as fn:
+        json.dump(config, fn, indent=4, default=lambda o: o.item() if isinstance(o, np.generic) else str(o))
@@ -48,3 +48,120 @@ def compute_within_acc(all_score_predictions, all_score_targets, margin):
         score_rmse += 1 / num_classes * _accuracy_within_margin(score_predictions, score_targets, margin)
     
     return score_rmse
+
+
+# Vectorized metrics: the rows of predictions/targets (R, n) are independent prediction vectors,
+# e.g., bootstrap replicates, and every metric is an array of shape (R,).
+metric_names = ['rmse', 'mcrmse', 'pearson', 'within_0.5', 'within_1', 'mcwithin_0.5', 'mcwithin_1']
+
+def _class_means(values, class_index, num_classes):
+    """ Per-row mean of values over each class, (R, C) with nan for the classes absent from a row. """
+    R = values.shape[0]
+    flat_index = (np.arange(R)[:, None] * num_classes + class_index).ravel()
+    sums = np.bincount(flat_index, weights=values.ravel(), minlength=R * num_classes).reshape(R, num_classes)
+    counts = np.bincount(flat_index, minlength=R * num_classes).reshape(R, num_classes)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+def compute_metrics_batch(all_score_predictions, all_score_targets):
+    """ Same metrics as compute_metrics, for (R, n) (or (n,)) predictions and targets at once. """
+    preds = np.atleast_2d(np.asarray(all_score_predictions, dtype=np.float64))
+    targets = np.atleast_2d(np.asarray(all_score_targets, dtype=np.float64))
+    preds, targets = np.broadcast_arrays(preds, targets)
+
+    sq_err = (preds - targets) ** 2
+    abs_err = np.abs(preds - targets)
+    metrics = {}
+    metrics['rmse'] = np.sqrt(sq_err.mean(axis=1))
+
+    pred_c = preds - preds.mean(axis=1, keepdims=True)
+    target_c = targets - targets.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        metrics['pearson'] = (pred_c * target_c).sum(axis=1) / np.sqrt((pred_c ** 2).sum(axis=1) * (target_c ** 2).sum(axis=1))
+
+    metrics['within_0.5'] = (abs_err <= 0.5).mean(axis=1) * 100
+    metrics['within_1'] = (abs_err <= 1).mean(axis=1) * 100
+
+    # class-averaged metrics, over the classes present in each row
+    classes, class_index = np.unique(targets, return_inverse=True)
+    class_index = class_index.reshape(targets.shape)
+    num_classes = len(classes)
+    metrics['mcrmse'] = np.nanmean(np.sqrt(_class_means(sq_err, class_index, num_classes)), axis=1)
+    metrics['mcwithin_0.5'] = np.nanmean(_class_means((abs_err <= 0.5) * 100., class_index, num_classes), axis=1)
+    metrics['mcwithin_1'] = np.nanmean(_class_means((abs_err <= 1) * 100., class_index, num_classes), axis=1)
+
+    return metrics
+
+def _replicate_chunks(n_replicates, n, max_elements=10000000):
+    # keeps the (chunk, n) index matrices at ~max_elements
+    chunk_size = max(1, max_elements // max(n, 1))
+    for start in range(0, n_replicates, chunk_size):
+        yield min(chunk_size, n_replicates - start)
+
+def bootstrap_metrics(all_score_predictions, all_score_targets, n_bootstrap=1000, ci=95, random_state=66):
+    """ Percentile bootstrap CIs of every metric, {metric: {"value", "ci_low", "ci_high"}}. """
+    preds = np.asarray(all_score_predictions, dtype=np.float64)
+    targets = np.asarray(all_score_targets, dtype=np.float64)
+    n = len(targets)
+    rng = np.random.RandomState(random_state)
+
+    point = compute_metrics_batch(preds, targets)
+    replicates = {m: [] for m in metric_names}
+    for chunk in _replicate_chunks(n_bootstrap, n):
+        index = rng.randint(0, n, size=(chunk, n))
+        chunk_metrics = compute_metrics_batch(preds[index], targets[index])
+        for m in metric_names:
+            replicates[m].append(chunk_metrics[m])
+
+    alpha = (100 - ci) / 2
+    results = {}
+    for m in metric_names:
+        values = np.concatenate(replicates[m])
+        results[m] = { "value": float(point[m][0]),
+                       "ci_low": float(np.nanpercentile(values, alpha)),
+                       "ci_high": float(np.nanpercentile(values, 100 - alpha)) }
+    return results
+
+def compare_systems(predictions_a, predictions_b, all_score_targets, n_resamples=1000, ci=95, random_state=66):
+    """
+    Paired comparison of two systems on the same targets, for every metric:
+        diff (a - b), a paired bootstrap CI of the diff, and the p-value of a paired permutation
+        test (the predictions of a and b are swapped per sample).
+    """
+    preds_a = np.asarray(predictions_a, dtype=np.float64)
+    preds_b = np.asarray(predictions_b, dtype=np.float64)
+    targets = np.asarray(all_score_targets, dtype=np.float64)
+    n = len(targets)
+    rng = np.random.RandomState(random_state)
+
+    point_a = compute_metrics_batch(preds_a, targets)
+    point_b = compute_metrics_batch(preds_b, targets)
+    observed = {m: point_a[m][0] - point_b[m][0] for m in metric_names}
+
+    boot_diffs = {m: [] for m in metric_names}
+    perm_diffs = {m: [] for m in metric_names}
+    for chunk in _replicate_chunks(n_resamples, n):
+        index = rng.randint(0, n, size=(chunk, n))
+        boot_a = compute_metrics_batch(preds_a[index], targets[index])
+        boot_b = compute_metrics_batch(preds_b[index], targets[index])
+
+        swap = rng.rand(chunk, n) < 0.5
+        perm_a = compute_metrics_batch(np.where(swap, preds_b, preds_a), targets)
+        perm_b = compute_metrics_batch(np.where(swap, preds_a, preds_b), targets)
+
+        for m in metric_names:
+            boot_diffs[m].append(boot_a[m] - boot_b[m])
+            perm_diffs[m].append(perm_a[m] - perm_b[m])
+
+    alpha = (100 - ci) / 2
+    results = {}
+    for m in metric_names:
+        boot_diff = np.concatenate(boot_diffs[m])
+        perm_diff = np.concatenate(perm_diffs[m])
+        results[m] = { "value_a": float(point_a[m][0]),
+                       "value_b": float(point_b[m][0]),
+                       "diff": float(observed[m]),
+                       "ci_low": float(np.nanpercentile(boot_diff, alpha)),
+                       "ci_high": float(np.nanpercentile(boot_diff, 100 - alpha)),
+                       "p_value": float((1 + np.sum(np.abs(perm_diff) >= np.abs(observed[m]))) / (len(perm_diff) + 1)) }
+    return results
@@ -0,0 +1,72 @@
+import numpy as np
+from sklearn.utils.class_weight import compute_class_weight
+
+'''
+Class rebalancing of the grader training sets.
+The rows of every class are selected by index and gathered with a single fancy-index,
+instead of stacking copies of the arrays class by class.
+'''
+
+
+def add_resample_args(parser):
+    # rows per class after resampling (-1: no resampling)
+    parser.add_argument("--n_resamples",
+                        default="-1",
+                        type=int)
+
+    # class-weighted fit instead of resampling
+    parser.add_argument("--do_sample_weight",
+                        action='store_true')
+    return parser
+
+
+def get_resample_index(y, n_resamples=50, scales=None, resample_scales=None, random_state=66):
+    """
+    Row indices of the balanced set, grouped by class in the order of scales.
+    A class in resample_scales gets n_resamples rows: as many full copies as fit, and the rest
+    sampled without replacement (the same rows as sklearn.utils.resample(..., random_state=66)).
+    The other classes are kept as is, and classes not in scales are dropped.
+    scales/resample_scales: None for all the classes of y
+    """
+    y = np.asarray(y)
+    if scales is None:
+        scales = np.unique(y)
+    if resample_scales is None:
+        resample_scales = scales
+
+    index_list = []
+    for g in scales:
+        g_index = np.flatnonzero(y == g)
+        if len(g_index) == 0: continue
+
+        if g in resample_scales:
+            n_copies = (n_resamples - 1) // len(g_index)
+            n_rest = n_resamples - n_copies * len(g_index)
+            rest_index = np.arange(len(g_index))
+            np.random.RandomState(random_state).shuffle(rest_index)
+            g_index = np.concatenate([np.tile(g_index, n_copies), g_index[rest_index[:n_rest]]])
+
+        index_list.append(g_index)
+
+    return np.concatenate(index_list) if len(index_list) > 0 else np.array([], dtype=int)
+
+
+def do_resample(X, y, n_resamples=50, scales=None, resample_scales=None, random_state=66):
+    index = get_resample_index(y, n_resamples, scales, resample_scales, random_state)
+    X_balanced, y_balanced = X[index], y[index]
+
+    print("Resampling")
+    print("Origin", X.shape, y.shape)
+    print("Balanced", X_balanced.shape, y_balanced.shape)
+
+    return X_balanced, y_balanced
+
+
+def calc_sample_weight(y, weight_type='balanced'):
+    # weight of each row = weight of its class
+    classes, class_index = np.unique(y, return_inverse=True)
+    class_weight = compute_class_weight(class_weight=weight_type, classes=classes, y=y)
+    sample_weight = class_weight[class_index]
+
+    print("sample weight", dict(zip(classes.tolist(), class_weight.tolist())))
+    return sample_weight
@@ -0,0 +1,218 @@
+import os
+import sys
+sys.path.append("./local")
+import json
+import time
+import threading
+import collections
+import numpy as np
+import pandas as pd
+import joblib
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from feats_loader import load_feats, load_feats_info, feats_store
+
+'''
+Scores new responses with the checkpoints of local/stats_models_fd/*.py.
+The checkpoints, their feature-key order and selection mask (checkpoint/feats_info.json) are loaded once.
+Bulk:
+    python local/score_service.py --model_dirs exp-speaking/.../pronunciation/1/checkpoint,... --feats_path data/.../all.json --output_path pred.tsv
+Service (POST /predict, GET /metrics):
+    python local/score_service.py --model_dirs ... --port 8080
+    curl -X POST localhost:8080/predict -d '{"rows": [{"id": "u1", "feats": {"speaking_rate": 2.1, ...}}]}'
+The body can also be a dict in the all.json format ({uttid: {"feats": {...}}, ...}).
+Scores are 1-based (the models are trained on level - 1, see local/data/utils.py), and the
+levels are the scores rounded and clipped to [1, num_labels] of the checkpoint.
+Each checkpoint is reported as {score_name: {"score": ..., "level": ...}}.
+'''
+
+parser = argparse.ArgumentParser()
+
+# comma-separated checkpoint dirs (<exp_dir>/checkpoint)
+parser.add_argument("--model_dirs",
+                    default="exp-speaking/tb1p1/linear_regression/pronunciation/1/checkpoint",
+                    type=str)
+
+# all.json, all.npz or xlsx (bulk mode)
+parser.add_argument("--feats_path",
+                    default="",
+                    type=str)
+
+parser.add_argument("--output_path",
+                    default="",
+                    type=str)
+
+# > 0: run the HTTP service
+parser.add_argument("--port",
+                    default=0,
+                    type=int)
+
+parser.add_argument("--host",
+                    default="127.0.0.1",
+                    type=str)
+
+args = parser.parse_args()
+
+
+class Grader(object):
+    def __init__(self, model_dir):
+        feats_info = load_feats_info(model_dir)
+        self.name = feats_info["score_name"]
+        self.feat_keys = np.array(feats_info["feat_keys"])
+        # columns of the selected features, in the order of the checkpoint
+        self.select_keys = self.feat_keys[np.nonzero(feats_info["select_support"])]
+        self.model = joblib.load(os.path.join(model_dir, feats_info["checkpoint"]))
+        # feats_info.json of older checkpoints has no num_labels (the default of the training scripts)
+        self.num_labels = feats_info.get("num_labels") or 8
+
+    def predict(self, feats_df):
+        missing_keys = [fk for fk in self.select_keys if fk not in feats_df.columns]
+        if len(missing_keys) > 0:
+            raise KeyError("missing features {}".format(missing_keys[:5]))
+
+        X = feats_df[self.select_keys].values.astype(np.float64)
+        # one call for the whole batch
+        scores = self.model.predict(X) + 1
+        levels = np.clip(np.round(scores), 1, self.num_labels).astype(int)
+        return scores, levels
+
+
+graders = [Grader(model_dir) for model_dir in args.model_dirs.split(",")]
+print("loaded", [grader.name for grader in graders])
+
+# the results are keyed by score name
+grader_names = [grader.name for grader in graders]
+if len(set(grader_names)) != len(grader_names):
+    print("One checkpoint per score name, got {}".format(grader_names))
+    exit(1)
+
+
+def score_table(ids, feats_df):
+    """
+    Returns {id: {score_name: {"score": score, "level": level}}}
+    """
+    preds = {grader.name: grader.predict(feats_df) for grader in graders}
+    return { uid: {name: {"score": float(preds[name][0][i]), "level": int(preds[name][1][i])} for name in preds} for i, uid in enumerate(ids) }
+
+
+def read_feats_file(feats_path):
+    if feats_path.endswith(".json"):
+        with open(feats_path, "r") as fn:
+            meta, feat_keys, feats = feats_store.all_info_to_table(json.load(fn))
+        # teemi text ids are the fnames (same as the training scripts)
+        return meta["fname"], pd.DataFrame(feats, columns=feat_keys)
+
+    meta_df, feat_keys, X = load_feats(feats_path)
+    return meta_df["fname"].tolist(), pd.DataFrame(X, columns=feat_keys)
+
+
+def read_feats_request(body):
+    if "rows" in body:
+        rows = body["rows"]
+        return [str(row["id"]) for row in rows], pd.DataFrame([row["feats"] for row in rows])
+
+    # all.json format
+    ids = list(body.keys())
+    return ids, pd.DataFrame([body[uid]["feats"] for uid in ids])
+
+
+class LatencyStats(object):
+    def __init__(self, maxlen=10000):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=maxlen)
+        self.num_requests = 0
+        self.num_rows = 0
+        self.num_errors = 0
+
+    def add(self, latency, num_rows):
+        with self.lock:
+            self.latencies.append(latency)
+            self.num_requests += 1
+            self.num_rows += num_rows
+
+    def add_error(self):
+        with self.lock:
+            self.num_errors += 1
+
+    def report(self):
+        with self.lock:
+            latencies = np.array(self.latencies)
+            info = { "num_requests": self.num_requests,
+                     "num_rows": self.num_rows,
+                     "num_errors": self.num_errors }
+
+        if len(latencies) > 0:
+            info.update({ "latency_mean_ms": float(latencies.mean() * 1000),
+                          "latency_p50_ms": float(np.percentile(latencies, 50) * 1000),
+                          "latency_p95_ms": float(np.percentile(latencies, 95) * 1000),
+                          "latency_max_ms": float(latencies.max() * 1000) })
+        return info
+
+
+latency_stats = LatencyStats()
+
+
+class ScoreHandler(BaseHTTPRequestHandler):
+    def __send_json(self, code, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.__send_json(200, latency_stats.report())
+        else:
+            self.__send_json(404, {"error": "unknown path {}".format(self.path)})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.__send_json(404, {"error": "unknown path {}".format(self.path)})
+            return
+
+        start_time = time.time()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length))
+            ids, feats_df = read_feats_request(body)
+            predictions = score_table(ids, feats_df)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            latency_stats.add_error()
+            self.__send_json(400, {"error": str(e)})
+            return
+
+        latency_stats.add(time.time() - start_time, len(ids))
+        self.__send_json(200, {"predictions": predictions})
+
+    def log_message(self, format, *log_args):
+        # the latencies are in /metrics
+        pass
+
+
+if args.feats_path != "":
+    start_time = time.time()
+    ids, feats_df = read_feats_file(args.feats_path)
+    predictions = score_table(ids, feats_df)
+    proc_time = time.time() - start_time
+
+    names = [grader.name for grader in graders]
+    lines = ["\t".join(["id"] + [name + suffix for name in names for suffix in ["", "_score"]])]
+    lines += ["\t".join([uid] + [str(predictions[uid][name][key]) for name in names for key in ["level", "score"]]) for uid in ids]
+
+    if args.output_path != "":
+        with open(args.output_path, "w") as fn:
+            fn.write("\n".join(lines) + "\n")
+    else:
+        print("\n".join(lines))
+
+    print("scored {} rows in {:.3f}s".format(len(ids), proc_time), file=sys.stderr)
+
+if args.port > 0:
+    server = ThreadingHTTPServer((args.host, args.port), ScoreHandler)
+    print("serving on {}:{}".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,124 @@
+import os
+import hashlib
+import pickle
+import numpy as np
+
+'''
+Fold-level cache of the ExtraTreesClassifier + SelectFromModel feature selection.
+The selection only depends on the features, the labels, the fold and the bins, not on
+the downstream model, so the fitted selector, its support mask and the importances are
+pickled to <feats dir>/selection_cache/<key>.pkl and reused by the other stats_models scripts.
+The key covers the md5 of the feature file and of the label file, the part and the
+aggregation of the speaker features (load_spk_feats), the fold, the bins and the train
+indices/labels of the fold. The aggregated matrix itself is not hashed, so every script that
+loads the same table the same way (e.g., multivar_linear_regression.py and
+multi_model_runner.py: agg="mean" with all_bins) reuses one selection.
+Scripts with another aggregation or other bins select on other inputs and keep their own entries.
+'''
+
+selection_version = 2
+
+
+def add_selection_args(parser):
+    parser.add_argument("--no_selection_cache",
+                        action="store_true")
+
+    # default: <dir of the feature file>/selection_cache
+    parser.add_argument("--selection_cache_dir",
+                        default="",
+                        type=str)
+    return parser
+
+
+def __file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as fn:
+        for chunk in iter(lambda: fn.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def __array_md5(arr):
+    return hashlib.md5(np.ascontiguousarray(arr).tobytes()).hexdigest()
+
+
+def get_selection_cache(feats_path, label_path, cache_dir="", enabled=True, part="", agg=""):
+    """
+    Returns the cache info of a (feature file, label file) pair, None if the cache is disabled.
+    part/agg: arguments of load_spk_feats, the feature matrix is built from them
+    """
+    if not enabled:
+        return None
+
+    if cache_dir == "":
+        cache_dir = os.path.join(os.path.dirname(feats_path), "selection_cache")
+
+    return { "cache_dir": cache_dir,
+             "feats_md5": __file_md5(feats_path),
+             "label_md5": __file_md5(label_path),
+             "feats_spec": "part={},agg={}".format(part, agg) }
+
+
+def get_selection_cache_from_args(args, feats_path, label_path, part="", agg=""):
+    return get_selection_cache(feats_path, label_path, args.selection_cache_dir, not args.no_selection_cache, part, agg)
+
+
+def __fit_selector(X, y_cefr):
+    from sklearn.ensemble import ExtraTreesClassifier
+    from sklearn.feature_selection import SelectFromModel
+    # https://scikit-learn.org/stable/modules/feature_selection.html
+    basic_clf = ExtraTreesClassifier(n_estimators=50, random_state=66)
+    basic_clf = basic_clf.fit(X, y_cefr)
+    importances = basic_clf.feature_importances_
+    std = np.std([tree.feature_importances_ for tree in basic_clf.estimators_], axis=0)
+    selector = SelectFromModel(basic_clf, prefit=True)
+
+    return { "selector": selector,
+             "support": selector.get_support(),
+             "importances": importances,
+             "std": std }
+
+
+def fit_selector(X, y_cefr, selection_cache=None, fold=0, bins=None, train_index=None):
+    """
+    Fits (or loads) the selector of a fold.
+    Returns (selector, importances, std)
+    """
+    if selection_cache is None:
+        selection = __fit_selector(X, y_cefr)
+        return selection["selector"], selection["importances"], selection["std"]
+
+    if train_index is None:
+        train_index = np.arange(len(y_cefr))
+
+    key_info = [ str(selection_version),
+                 selection_cache["feats_md5"],
+                 selection_cache["label_md5"],
+                 selection_cache["feats_spec"],
+                 str(fold),
+                 "none" if bins is None else ",".join([str(b) for b in bins]),
+                 __array_md5(np.asarray(train_index, dtype=np.int64)),
+                 __array_md5(np.asarray(y_cefr, dtype=np.float64)) ]
+    key = hashlib.md5("|".join(key_info).encode("utf-8")).hexdigest()
+    cache_path = os.path.join(selection_cache["cache_dir"], key + ".pkl")
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as fn:
+                selection = pickle.load(fn)
+            print("[Selection Cache] fold {} loaded from {}".format(fold, cache_path))
+            return selection["selector"], selection["importances"], selection["std"]
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+            # e.g., a partial file or an incompatible sklearn version
+            print("[Selection Cache] refit fold {}: {}".format(fold, e))
+
+    selection = __fit_selector(X, y_cefr)
+
+    # several scripts (or folds) may write at the same time
+    os.makedirs(selection_cache["cache_dir"], exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+    with open(tmp_path, "wb") as fn:
+        pickle.dump(selection, fn)
+    os.replace(tmp_path, cache_path)
+
+    return selection["selector"], selection["importances"], selection["std"]
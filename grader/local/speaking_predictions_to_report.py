@@ -3,11 +3,12 @@ import random
 import logging
 import os
 import csv
+import copy
 from tqdm import tqdm
 from collections import defaultdict
 import pandas as pd
 import numpy as np
-from metrics_cpu import compute_metrics
+from metrics_cpu import compute_metrics, bootstrap_metrics, compare_systems
 import matplotlib.pyplot as plt
 
 '''
@@ -53,8 +54,23 @@ parser.add_argument("--question_type",
                     default="tb1p1",
                     type=str)
 
+# bootstrap CIs of the pooled ("All") metrics, 0: off
+parser.add_argument("--n_bootstrap",
+                    default=0,
+                    type=int)
+
+# another system with the same layout (<compare_root>/<score>/<fold>/predictions.txt),
+# compared to result_root with a paired bootstrap and a paired permutation test (--n_bootstrap resamples, needs --n_bootstrap > 0)
+parser.add_argument("--compare_root",
+                    default="",
+                    type=str)
+
 args = parser.parse_args()
 
+if args.compare_root != "" and args.n_bootstrap <= 0:
+    print("--compare_root needs --n_bootstrap > 0 (number of resamples of the comparison)")
+    exit(1)
+
 
 def filled_csv(csv_dict, result_root, score, nf, text_ids):
      
@@ -168,6 +184,13 @@ for nf in n_folds:
             csv_dict[nf][text_id]["pred"] = { s: float(row[columns[s]]) for s in scores }
             
 
+# same annotations for the compared system, its predictions must all come from compare_root
+if args.compare_root != "":
+    cmp_csv_dict = copy.deepcopy(csv_dict)
+    for nf in n_folds:
+        for text_id in cmp_csv_dict[nf]:
+            cmp_csv_dict[nf][text_id]["pred"] = { s: np.nan for s in scores }
+
 # fiiled csv_dict
 total_losses = defaultdict(dict)
 total_df_losses = defaultdict(dict)
@@ -184,8 +207,19 @@ for nf in n_folds:
              
 scores = list(scores_)
 
+cmp_scores = []
+if args.compare_root != "":
+    for score in scores:
+        missing_folds = [nf for nf in n_folds if not filled_csv(cmp_csv_dict, args.compare_root, score, nf, text_ids)]
+        if len(missing_folds) == 0:
+            cmp_scores.append(score)
+        else:
+            print("WARNING: {} is not compared, no predictions.txt in {} for folds {}".format(score, os.path.join(args.compare_root, score), missing_folds))
+
 if merged_speaker:
     csv_dict = do_merge_speaker(csv_dict, number_questions[question_type], scores)
+    if args.compare_root != "":
+        cmp_csv_dict = do_merge_speaker(cmp_csv_dict, number_questions[question_type], cmp_scores)
     kfold_fn = "kfold_detail_spk.xlsx"
 else:
     kfold_fn = "kfold_detail.xlsx"
@@ -265,3 +299,36 @@ for score in scores:
     print(score, ave_losses)
     df_losses = pd.DataFrame.from_dict(df_losses)
     print(df_losses.mean())
+
+if args.n_bootstrap > 0:
+    print()
+    print("SIGNIFICANCE (origin, all folds, {} resamples)".format(args.n_bootstrap))
+
+    for score in scores:
+        all_score_preds = np.array(kfold_info[score]["All"]["pred"])
+        all_score_annos = np.array(kfold_info[score]["All"]["anno"])
+
+        ci_df = pd.DataFrame.from_dict(bootstrap_metrics(all_score_preds, all_score_annos, n_bootstrap=args.n_bootstrap), orient="index")
+        print(score)
+        print(ci_df)
+
+        result_dir = os.path.join(result_root, score)
+        with pd.ExcelWriter(os.path.join(result_dir, "significance.xlsx")) as writer:
+            ci_df.to_excel(writer, sheet_name="bootstrap")
+
+            if score in cmp_scores:
+                cmp_text_ids = []
+                cmp_score_preds = []
+                for nf in n_folds:
+                    _, cmp_preds_dig, _, cmp_preds, _, cmp_ids = evaluation({}, cmp_csv_dict[nf], score, all_bins)
+                    # np.digitize maps nan to the top level, check the raw predictions
+                    assert not np.isnan(cmp_preds).any(), "missing predictions in " + os.path.join(args.compare_root, score, nf)
+                    cmp_text_ids += cmp_ids
+                    cmp_score_preds += cmp_preds_dig.tolist()
+                assert cmp_text_ids == kfold_info[score]["All"]["text_id"]
+
+                # a: result_root, b: compare_root
+                cmp_df = pd.DataFrame.from_dict(compare_systems(all_score_preds, np.array(cmp_score_preds), all_score_annos, n_resamples=args.n_bootstrap), orient="index")
+                print("vs", args.compare_root)
+                print(cmp_df)
+                cmp_df.to_excel(writer, sheet_name="compare")
@@ -13,6 +13,11 @@ import logging
 import matplotlib.pyplot as plt
 
 import argparse
+import sys
+sys.path.append("./local")
+from feats_loader import load_spk_feats
+from fold_executor import add_fold_args, run_folds, merge_kfold_info
+from selection_cache import add_selection_args, get_selection_cache_from_args, fit_selector
 from sklearn import tree
 
 parser = argparse.ArgumentParser()
@@ -37,13 +42,20 @@ parser.add_argument("--exp_dir",
                     default="exp/linear_regression",
                     type=str)
 
+# e.g., all.npz (columnar feature store, asr-esp/local/e2e_stt/feats_store.py), default: <model_name>-feats.xlsx
+parser.add_argument("--feats_fn",
+                    default="",
+                    type=str)
+
+add_fold_args(parser)
+add_selection_args(parser)
 args = parser.parse_args()
 
 # data/spoken_test_2022_jan28/grader.spk2p3s2
 model_name = args.model_name
 part = args.part
 label_fn = "grader.spk2p" + part + "s" + args.aspect
-feats_fn = model_name + "-feats.xlsx"
+feats_fn = args.feats_fn if args.feats_fn != "" else model_name + "-feats.xlsx"
 
 data_dir = args.data_dir
 exp_dir = args.exp_dir
@@ -52,7 +64,6 @@ if not os.path.exists(exp_dir):
     os.path.mkdirs(exp_dir)
 
 spk2label = {}
-spk2feats = {}
 
 def report(y_test, y_pred, spk_list, bins=None, kfold_info=None, fold="Fold1"):
     print("=" * 10, "Raw data", "=" * 10)
@@ -97,19 +108,14 @@ def report(y_test, y_pred, spk_list, bins=None, kfold_info=None, fold="Fold1"):
     
     return acc, macro_avg, weighted_avg, kfold_info
 
-# Feature selection
-def feature_selection(X, y, bins=None):
-    from sklearn.ensemble import ExtraTreesClassifier
-    from sklearn.feature_selection import SelectFromModel
-    # https://scikit-learn.org/stable/modules/feature_selection.html
+# Feature selection (cached per fold, see local/selection_cache.py)
+def feature_selection(X, y, bins=None, fold=0, train_index=None):
     if bins is not None:
         y_cefr = np.digitize(np.array(y), bins)
     else:
         y_cefr = y
     
-    basic_clf = ExtraTreesClassifier(n_estimators=50, random_state=66)
-    basic_clf = basic_clf.fit(X, y_cefr)
-    selector = SelectFromModel(basic_clf, prefit=True)
+    selector, importances, std = fit_selector(X, y_cefr, selection_cache, fold, bins, train_index)
     
     return selector
 
@@ -120,23 +126,13 @@ with open(os.path.join(data_dir, label_fn), "r") as fn:
         spk2label[spk] = float(grade)
 
 # feats
-feats_df = pd.read_excel(os.path.join(data_dir, model_name, feats_fn), dtype=str)
-feat_keys = [fk for fk in list(feats_df.keys())[6:] if "list" not in fk and "voiced_probs" not in fk]
-feat_keys = np.array(feat_keys)
-
-for i, spk in enumerate(feats_df["spkID"]):
-    if feats_df["part"][i] != part: continue
-    
-    feats_vec = [float(feats_df[fk][i]) for fk in feat_keys]
-    spk2feats[spk] = feats_vec
-
+feat_keys, spk_feats_df = load_spk_feats(os.path.join(data_dir, model_name, feats_fn), part, agg="last")
+selection_cache = get_selection_cache_from_args(args, os.path.join(data_dir, model_name, feats_fn), os.path.join(data_dir, label_fn), part, agg="last")
 
 # create example
-X, y, spk_list = [], [], []
-for spk in list(spk2label.keys()):
-    X.append(spk2feats[spk])
-    y.append(spk2label[spk])
-    spk_list.append(spk)
+spk_list = list(spk2label.keys())
+X = spk_feats_df.loc[spk_list].values
+y = [spk2label[spk] for spk in spk_list]
 
 X = np.array(X)
 y = np.array(y)
@@ -157,8 +153,7 @@ report_titles = ["fold", "acc", "macro_precision", "macro_recall", "macro_f1-sco
 report_dict = {rt: [] for rt in report_titles}
 clfs = []
 
-# TRAINING (K-FOLD)
-for i, (train_index, test_index) in enumerate(kf.split(X)):
+def run_fold(i, X, y, train_index, test_index):
     print("Fold", (i+1))
     X_train, X_test = X[train_index], X[test_index]
     y_train, y_test = y[train_index], y[test_index]
@@ -166,7 +161,7 @@ for i, (train_index, test_index) in enumerate(kf.split(X)):
     y_train = np.digitize(np.array(y_train), b1_bins)
     y_test = np.digitize(np.array(y_test), b1_bins)
     
-    selector = feature_selection(X_train, y_train, b1_bins)
+    selector = feature_selection(X_train, y_train, b1_bins, i+1, train_index)
     select_support = selector.get_support() * 1
     select_feat_keys = feat_keys[np.nonzero(select_support)]
     print(select_feat_keys)
@@ -179,10 +174,21 @@ for i, (train_index, test_index) in enumerate(kf.split(X)):
         clf.fit(X_train, y_train.astype('int'))
      
     y_pred = clf.predict(X_test) 
-    fold_acc, macro_avg, weighted_avg, kfold_info = report(y_test, y_pred, spk_list[test_index], b1_bins, kfold_info, "Fold" + str(i+1))
+    fold_info = {"Fold" + str(i+1): {info:[] for info in infos}}
+    fold_acc, macro_avg, weighted_avg, fold_info = report(y_test, y_pred, spk_list[test_index], b1_bins, fold_info, "Fold" + str(i+1))
+    
+    return {"acc": fold_acc, "macro_avg": macro_avg, "weighted_avg": weighted_avg, "kfold_info": fold_info, "clf": clf}
+
+# TRAINING (K-FOLD)
+fold_results = run_folds(run_fold, X, y, list(kf.split(X)), n_jobs=args.n_jobs)
+
+for i, fold_result in enumerate(fold_results):
+    merge_kfold_info(kfold_info, fold_result["kfold_info"])
+    clfs.append(fold_result["clf"])
+    macro_avg, weighted_avg = fold_result["macro_avg"], fold_result["weighted_avg"]
     
     report_dict["fold"].append(i+1)
-    report_dict["acc"].append(fold_acc)
+    report_dict["acc"].append(fold_result["acc"])
     report_dict["macro_precision"].append(macro_avg["precision"])
     report_dict["macro_recall"].append(macro_avg["recall"])
     report_dict["macro_f1-score"].append(macro_avg["f1-score"])
@@ -190,7 +196,7 @@ for i, (train_index, test_index) in enumerate(kf.split(X)):
     report_dict["weighted_recall"].append(weighted_avg["recall"])
     report_dict["weighted_f1-score"].append(weighted_avg["f1-score"])
     
-    acc += fold_acc
+    acc += fold_result["acc"]
     
 acc /= kf.get_n_splits(X)
 print("Accuracy", acc)
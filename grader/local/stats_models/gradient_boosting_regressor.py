@@ -11,6 +11,13 @@ from  sklearn import preprocessing
 from scipy import stats
 
 import argparse
+import sys
+sys.path.append("./local")
+from feats_loader import load_spk_feats
+from fold_executor import add_fold_args, run_folds, merge_kfold_info
+from selection_cache import add_selection_args, get_selection_cache_from_args, fit_selector
+from hparam_search import add_search_args, search_params
+from resample_utils import add_resample_args, do_resample, calc_sample_weight
 
 parser = argparse.ArgumentParser()
 
@@ -30,18 +37,32 @@ parser.add_argument("--aspect",
                     default="2",
                     type=str)
 
+# e.g., all.npz (columnar feature store, asr-esp/local/e2e_stt/feats_store.py), default: <model_name>-feats.xlsx
+parser.add_argument("--feats_fn",
+                    default="",
+                    type=str)
+
+# --search writes <exp_root>/p<part>s<aspect>/<fold>/search_config.json
+parser.add_argument("--exp_root",
+                    default="exp/gradient_boosting_regressor",
+                    type=str)
+
+add_fold_args(parser)
+add_selection_args(parser)
+add_search_args(parser)
+add_resample_args(parser)
 args = parser.parse_args()
 
 # data/spoken_test_2022_jan28/grader.spk2p3s2
 model_name = args.model_name
 part = args.part
 label_fn = "grader.spk2p" + part + "s" + args.aspect
-feats_fn = model_name + "-feats.xlsx"
+feats_fn = args.feats_fn if args.feats_fn != "" else model_name + "-feats.xlsx"
 
 data_dir = args.data_dir
+exp_dir = os.path.join(args.exp_root, "p" + part + "s" + args.aspect)
 
 spk2label = {}
-spk2feats = {}
 
 
 # label
@@ -51,22 +72,13 @@ with open(os.path.join(data_dir, label_fn), "r") as fn:
         spk2label[spk] = float(grade)
 
 # feats
-feats_df = pd.read_excel(os.path.join(data_dir, model_name, feats_fn), dtype=str)
-feat_keys = [fk for fk in list(feats_df.keys())[6:] if "list" not in fk and "voiced_probs" not in fk]
-feat_keys = np.array(feat_keys)
-
-for i, spk in enumerate(feats_df["spkID"]):
-    if feats_df["part"][i] != part: continue
-    
-    feats_vec = [float(feats_df[fk][i]) for fk in feat_keys]
-    spk2feats[spk] = feats_vec
+feat_keys, spk_feats_df = load_spk_feats(os.path.join(data_dir, model_name, feats_fn), part, agg="last")
+selection_cache = get_selection_cache_from_args(args, os.path.join(data_dir, model_name, feats_fn), os.path.join(data_dir, label_fn), part, agg="last")
 
 # create example
-X, y, spk_list = [], [], []
-for spk in list(spk2label.keys()):
-    X.append(spk2feats[spk])
-    y.append(spk2label[spk])
-    spk_list.append(spk)
+spk_list = list(spk2label.keys())
+X = spk_feats_df.loc[spk_list].values
+y = [spk2label[spk] for spk in spk_list]
 
 def report(y_test, y_pred, spk_list, bins, kfold_info, fold="Fold1"):
     print("=" * 10, "Raw data", "=" * 10)
@@ -122,25 +134,20 @@ params = {
     "loss": "squared_error",
 }
 
-# Feature selection
-def feature_selection(X, y, bins):
-    from sklearn.ensemble import ExtraTreesClassifier
-    from sklearn.feature_selection import SelectFromModel
-    # https://scikit-learn.org/stable/modules/feature_selection.html
+# Feature selection (cached per fold, see local/selection_cache.py)
+def feature_selection(X, y, bins, fold=0, train_index=None):
     y_cefr = np.digitize(np.array(y), bins)
-    basic_clf = ExtraTreesClassifier(n_estimators=50, random_state=66)
-    basic_clf = basic_clf.fit(X, y_cefr)
-    selector = SelectFromModel(basic_clf, prefit=True)
+    selector, importances, std = fit_selector(X, y_cefr, selection_cache, fold, bins, train_index)
     
     return selector
 
 
-for i, (train_index, test_index) in enumerate(kf.split(X)):
+def run_fold(i, X, y, train_index, test_index):
     print("Fold", (i+1))
     X_train, X_test = X[train_index], X[test_index]
     y_train, y_test = y[train_index], y[test_index]
     
-    selector = feature_selection(X_train, y_train, b1_bins)
+    selector = feature_selection(X_train, y_train, b1_bins, i+1, train_index)
     select_support = selector.get_support() * 1
     select_feat_keys = feat_keys[np.nonzero(select_support)]
     print(select_feat_keys)
@@ -150,15 +157,32 @@ for i, (train_index, test_index) in enumerate(kf.split(X)):
     X_test = selector.transform(X_test)
     print(X_train.shape, X_test.shape)
     
-    clf = GradientBoostingRegressor(random_state=66)
-    clf.fit(X_train, y_train)
+    # search before resampling, copies of a speaker must not be in both parts of an inner fold
+    params = {}
+    if args.search:
+        params = search_params("gbr", GradientBoostingRegressor(random_state=66), X_train, y_train, args, kf.get_n_splits(), os.path.join(exp_dir, str(i+1)))
+    
+    if args.n_resamples != -1:
+        X_train, y_train = do_resample(X_train, y_train, n_resamples=args.n_resamples)
+    
+    clf = GradientBoostingRegressor(random_state=66, **params)
+    sample_weight = calc_sample_weight(y_train) if args.do_sample_weight else None
+    clf.fit(X_train, y_train, sample_weight=sample_weight)
      
     print("=" * 10, "Feature Importance", "=" * 10)
     print(clf.feature_importances_)
      
     y_pred = clf.predict(X_test) 
-    fold_acc, kfold_info = report(y_test, y_pred, spk_list[test_index], b1_bins, kfold_info, "Fold" + str(i+1))
-    acc += fold_acc
+    fold_info = {"Fold" + str(i+1): {info:[] for info in infos}}
+    fold_acc, fold_info = report(y_test, y_pred, spk_list[test_index], b1_bins, fold_info, "Fold" + str(i+1))
+    
+    return {"acc": fold_acc, "kfold_info": fold_info}
+
+fold_results = run_folds(run_fold, X, y, list(kf.split(X)), n_jobs=args.n_jobs)
+
+for fold_result in fold_results:
+    merge_kfold_info(kfold_info, fold_result["kfold_info"])
+    acc += fold_result["acc"]
     
 acc /= kf.get_n_splits(X)
 print("Accuracy", acc)
@@ -0,0 +1,220 @@
+import io
+import os
+import inspect
+import sys
+sys.path.append("./local")
+sys.path.append("./local/stats_models_fd")
+import numpy as np
+import pandas as pd
+
+from sklearn import linear_model
+from sklearn import svm
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestClassifier
+from sklearn.neural_network import MLPRegressor
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.model_selection import KFold
+
+import argparse
+from metrics_cpu import compute_metrics
+from feats_loader import load_spk_feats
+from fold_executor import add_fold_args, run_folds
+from selection_cache import add_selection_args, get_selection_cache_from_args, fit_selector
+from resample_utils import add_resample_args, do_resample, calc_sample_weight
+from models import OrdClass
+
+'''
+Trains several graders over the same folds, e.g.,
+    python local/stats_models/multi_model_runner.py --data_dir data/gept_b1 --exp_root exp/gept-p2 --models lasso,gbr,rf,svr
+The features are loaded once, the KFold split and the feature selection of a fold are shared
+by all the models. The selections are fitted first (one job per fold), then every (fold, model)
+pair is a job of its own, so --n_jobs runs the models of a fold in parallel as well.
+Outputs:
+    <exp_root>/<model>/<score_name>/<fold>/predictions.txt (same layout as multivar_linear_regression.py)
+    <exp_root>/leaderboard-<score_name>.xlsx (mean of the fold metrics of metrics_cpu.compute_metrics)
+'''
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("--data_dir",
+                    default="data/gept_b1",
+                    type=str)
+
+parser.add_argument("--model_name",
+                    default="multi_en_mct_cnn_tdnnf_tgt3meg-dl",
+                    type=str)
+
+parser.add_argument("--part",
+                    default="3",
+                    type=str)
+
+parser.add_argument("--score_name",
+                    default="pronunciation",
+                    type=str)
+
+parser.add_argument("--exp_root",
+                    default="exp/gept-p2",
+                    type=str)
+
+parser.add_argument("--models",
+                    default="lasso,gbr,rf,svr,mlp,logistic,ordinal",
+                    type=str)
+
+# e.g., all.npz (columnar feature store, asr-esp/local/e2e_stt/feats_store.py), default: <model_name>-feats.xlsx
+parser.add_argument("--feats_fn",
+                    default="",
+                    type=str)
+
+add_fold_args(parser)
+add_selection_args(parser)
+add_resample_args(parser)
+args = parser.parse_args()
+
+aspect_map = {
+                "content": "1",
+                "pronunciation": "2",
+                "vocabulary": "3"
+              }
+
+model_name = args.model_name
+part = args.part
+score_name = args.score_name
+label_fn = "grader.spk2p" + part + "s" + aspect_map[score_name]
+feats_fn = args.feats_fn if args.feats_fn != "" else model_name + "-feats.xlsx"
+data_dir = args.data_dir
+exp_root = args.exp_root
+
+n_folds = "1 2 3 4 5".split()
+all_bins = np.array([1.5, 2.5, 3.5, 4.5, 5.5, 6.5, 7.5])
+
+# name: (task, estimator factory)
+# "reg" models fit the scores, "clf" models fit the levels (np.digitize(y, all_bins) + 1)
+model_zoo = {
+    "lasso": ("reg", lambda: linear_model.Lasso(alpha=0.1)),
+    "gbr": ("reg", lambda: GradientBoostingRegressor(random_state=66)),
+    "rf": ("clf", lambda: RandomForestClassifier(random_state=66)),
+    "svr": ("reg", lambda: make_pipeline(StandardScaler(), svm.SVR())),
+    "mlp": ("reg", lambda: make_pipeline(StandardScaler(), MLPRegressor(hidden_layer_sizes=(64,), max_iter=1000, random_state=66))),
+    "logistic": ("clf", lambda: make_pipeline(StandardScaler(), linear_model.LogisticRegression(max_iter=1000))),
+    "ordinal": ("ord", lambda: OrdClass(classifier=linear_model.LogisticRegression, clf_args={"max_iter": 1000})),
+}
+
+model_list = args.models.split(",")
+for m in model_list:
+    if m not in model_zoo:
+        print("Unknown model {}, choose from {}".format(m, ",".join(model_zoo.keys())))
+        exit(1)
+
+spk2label = {}
+
+# label
+with open(os.path.join(data_dir, label_fn), "r") as fn:
+    for line in fn.readlines():
+        spk, grade = line.split()
+        spk2label[spk] = float(grade)
+
+# feats (loaded once for all the models)
+feat_keys, spk_feats_df = load_spk_feats(os.path.join(data_dir, model_name, feats_fn), part, agg="mean")
+selection_cache = get_selection_cache_from_args(args, os.path.join(data_dir, model_name, feats_fn), os.path.join(data_dir, label_fn), part, agg="mean")
+
+# create example
+spk_list = list(spk2label.keys())
+X = spk_feats_df.loc[spk_list].values
+y = np.array([spk2label[spk] for spk in spk_list])
+spk_list = np.array(spk_list)
+
+kf = KFold(n_splits=len(n_folds), random_state=66, shuffle=True)
+folds = list(kf.split(X))
+
+
+def fit_predict(model, X_train, y_train, X_test, sample_weight=None):
+    task, factory = model_zoo[model]
+    clf = factory()
+
+    # --do_sample_weight: only for the estimators that take it (not the pipelines/OrdClass)
+    fit_args = {}
+    if sample_weight is not None and "sample_weight" in inspect.signature(clf.fit).parameters:
+        fit_args["sample_weight"] = sample_weight
+
+    if task == "reg":
+        clf.fit(X_train, y_train, **fit_args)
+        return clf.predict(X_test)
+
+    y_train_level = np.digitize(y_train, all_bins) + 1
+    if task == "clf":
+        clf.fit(X_train, y_train_level, **fit_args)
+        return clf.predict(X_test).astype(float)
+
+    # OrdClass expects the classes to start from 0
+    clf.fit(X_train, y_train_level - 1)
+    return clf.predict(X_test).astype(float) + 1
+
+
+def select_fold(i, X, y, train_index, test_index):
+    # one selection per fold, shared by all the models
+    print("Fold", (i+1), "selection")
+    y_train_cefr = np.digitize(np.array(y[train_index]), all_bins)
+    selector, importances, std = fit_selector(X[train_index], y_train_cefr, selection_cache, i+1, all_bins, train_index)
+    print(feat_keys[np.nonzero(selector.get_support())])
+    return selector
+
+
+# (fold, model) jobs
+jobs = [(f, model) for f in range(len(folds)) for model in model_list]
+
+
+def run_job(j, X, y, train_index, test_index):
+    f, model = jobs[j]
+    print("Fold", (f+1), model)
+    X_train, X_test = X[train_index], X[test_index]
+    y_train, y_test = y[train_index], y[test_index]
+
+    X_train = selectors[f].transform(X_train)
+    X_test = selectors[f].transform(X_test)
+
+    if args.n_resamples != -1:
+        X_train, y_train = do_resample(X_train, y_train, n_resamples=args.n_resamples)
+
+    sample_weight = calc_sample_weight(y_train) if args.do_sample_weight else None
+
+    y_pred = fit_predict(model, X_train, y_train, X_test, sample_weight)
+    losses = {}
+    compute_metrics(losses, np.array(y_pred), np.array(y_test))
+    print(model, losses)
+
+    return {"y_pred": y_pred, "losses": losses}
+
+
+# TRAINING (K-FOLD)
+selectors = run_folds(select_fold, X, y, folds, n_jobs=args.n_jobs)
+# the workers of this pool are forked after the selections are fitted
+job_results = run_folds(run_job, X, y, [folds[f] for f, model in jobs], n_jobs=args.n_jobs)
+
+fold_results = [{"y_test": y[test_index], "spk_id": spk_list[test_index], "y_pred": {}, "losses": {}} for train_index, test_index in folds]
+for (f, model), job_result in zip(jobs, job_results):
+    fold_results[f]["y_pred"][model] = job_result["y_pred"]
+    fold_results[f]["losses"][model] = job_result["losses"]
+
+leaderboard = {}
+for model in model_list:
+    for i, fold_result in enumerate(fold_results):
+        kfold_dir = os.path.join(exp_root, model, score_name, str(i+1))
+
+        if not os.path.exists(kfold_dir):
+            os.makedirs(kfold_dir)
+
+        predictions_file = os.path.join(kfold_dir, "predictions.txt")
+
+        with io.open(predictions_file, 'w') as file:
+            predictions = '\n'.join(['{} | {}'.format(str(pred), str(target)) for pred, target in zip(fold_result["y_pred"][model], fold_result["y_test"])])
+            file.write(predictions)
+
+    df_losses = pd.DataFrame([fold_result["losses"][model] for fold_result in fold_results])
+    leaderboard[model] = df_losses.mean()
+
+leaderboard_df = pd.DataFrame.from_dict(leaderboard, orient="index")
+leaderboard_df.index.name = "model"
+leaderboard_df = leaderboard_df.sort_values("rmse")
+print(leaderboard_df[["rmse", "mcrmse", "pearson", "within_0.5", "within_1"]])
+
+leaderboard_df.to_excel(os.path.join(exp_root, "leaderboard-" + score_name + ".xlsx"))
@@ -11,6 +11,10 @@ from  sklearn import preprocessing
 from scipy import stats
 
 import argparse
+import sys
+sys.path.append("./local")
+from feats_loader import load_spk_feats
+from fold_executor import add_fold_args, run_folds, merge_kfold_info
 
 parser = argparse.ArgumentParser()
 
@@ -30,18 +34,23 @@ parser.add_argument("--aspect",
                     default="2",
                     type=str)
 
+# e.g., all.npz (columnar feature store, asr-esp/local/e2e_stt/feats_store.py), default: <model_name>-feats.xlsx
+parser.add_argument("--feats_fn",
+                    default="",
+                    type=str)
+
+add_fold_args(parser)
 args = parser.parse_args()
 
 # data/spoken_test_2022_jan28/grader.spk2p3s2
 model_name = args.model_name
 part = args.part
 label_fn = "grader.spk2p" + part + "s" + args.aspect
-feats_fn = model_name + "-feats.xlsx"
+feats_fn = args.feats_fn if args.feats_fn != "" else model_name + "-feats.xlsx"
 
 data_dir = args.data_dir
 
 spk2label = {}
-spk2feats = {}
 
 
 # label
@@ -51,22 +60,12 @@ with open(os.path.join(data_dir, label_fn), "r") as fn:
         spk2label[spk] = float(grade)
 
 # feats
-feats_df = pd.read_excel(os.path.join(data_dir, model_name, feats_fn), dtype=str)
-feat_keys = [fk for fk in list(feats_df.keys())[6:] if "list" not in fk and "voiced_probs" not in fk]
-feat_keys = np.array(feat_keys)
-
-for i, spk in enumerate(feats_df["spkID"]):
-    if feats_df["part"][i] != part: continue
-    
-    feats_vec = [float(feats_df[fk][i]) for fk in feat_keys]
-    spk2feats[spk] = feats_vec
+feat_keys, spk_feats_df = load_spk_feats(os.path.join(data_dir, model_name, feats_fn), part, agg="last")
 
 # create example
-X, y, spk_list = [], [], []
-for spk in list(spk2label.keys()):
-    X.append(spk2feats[spk])
-    y.append(spk2label[spk])
-    spk_list.append(spk)
+spk_list = list(spk2label.keys())
+X = spk_feats_df.loc[spk_list].values
+y = [spk2label[spk] for spk in spk_list]
 
 min_max_scaler = preprocessing.MinMaxScaler()
 
@@ -117,7 +116,7 @@ acc = 0
 infos = ["spk_id", "anno", "anno(cefr)", "pred", "pred(cefr)", "results"]
 kfold_info = {"Fold" + str(1+i):{info:[] for info in infos} for i in range(5)}
 
-for i, (train_index, test_index) in enumerate(kf.split(X)):
+def run_fold(i, X, y, train_index, test_index):
     print("Fold", (i+1))
     X_train, X_test = X[train_index], X[test_index]
     y_train, y_test = y[train_index], y[test_index]
@@ -135,8 +134,16 @@ for i, (train_index, test_index) in enumerate(kf.split(X)):
     #print(coef_[np.argsort(-1 * coef_)])
     
     y_pred = clf.predict(X_test)
-    fold_acc, kfold_info = report(y_test, y_pred, spk_list[test_index], b1_bins, kfold_info, "Fold" + str(i+1))
-    acc += fold_acc
+    fold_info = {"Fold" + str(i+1): {info:[] for info in infos}}
+    fold_acc, fold_info = report(y_test, y_pred, spk_list[test_index], b1_bins, fold_info, "Fold" + str(i+1))
+    
+    return {"acc": fold_acc, "kfold_info": fold_info}
+
+fold_results = run_folds(run_fold, X, y, list(kf.split(X)), n_jobs=args.n_jobs)
+
+for fold_result in fold_results:
+    merge_kfold_info(kfold_info, fold_result["kfold_info"])
+    acc += fold_result["acc"]
     
 acc /= kf.get_n_splits(X)
 print("Accuracy", acc)
@@ -7,12 +7,10 @@ import numpy as np
 
 from sklearn import linear_model
 from  sklearn import preprocessing
-from sklearn.utils import resample
 from sklearn.model_selection import KFold
 from sklearn.metrics import confusion_matrix
 from sklearn.metrics import classification_report
 from sklearn.metrics import mean_squared_error
-from sklearn.utils.class_weight import compute_class_weight
 
 import pandas as pd
 import logging
@@ -21,6 +19,11 @@ from tqdm import tqdm
 from metrics_cpu import compute_metrics
 
 import argparse
+from feats_loader import load_spk_feats
+from fold_executor import add_fold_args, run_folds, merge_kfold_info
+from selection_cache import add_selection_args, get_selection_cache_from_args, fit_selector
+from hparam_search import add_search_args, search_params
+from resample_utils import do_resample, calc_sample_weight
 
 parser = argparse.ArgumentParser()
 
@@ -57,8 +60,30 @@ parser.add_argument("--merge_below_b1",
 parser.add_argument("--do_sample_weight",
                     action='store_true')
 
+# e.g., all.npz (columnar feature store, asr-esp/local/e2e_stt/feats_store.py), default: <model_name>-feats.xlsx
+parser.add_argument("--feats_fn",
+                    default="",
+                    type=str)
+
+# pick alpha on the Lasso path of --search_cv inner folds of each training split (LassoCV, before resampling),
+# the outer folds are only used for reporting (inner CV curves and sparsity: <exp_dir>/lasso_path.xlsx)
+parser.add_argument("--lasso_path",
+                    action="store_true")
+
+# comma-separated alphas of the path, default: 30 alphas from 1 to 1e-3
+parser.add_argument("--path_alphas",
+                    default="",
+                    type=str)
+
+add_fold_args(parser)
+add_selection_args(parser)
+add_search_args(parser)
 args = parser.parse_args()
 
+if args.lasso_path and args.search:
+    print("--lasso_path and --search both choose alpha, use one of them")
+    exit(1)
+
 aspect_map = {  
                 "content": "1", 
                 "pronunciation": "2", 
@@ -71,13 +96,18 @@ part = args.part
 n_resamples = args.n_resamples
 score_name = args.score_name
 label_fn = "grader.spk2p" + part + "s" + aspect_map[score_name]
-feats_fn = model_name + "-feats.xlsx"
+feats_fn = args.feats_fn if args.feats_fn != "" else model_name + "-feats.xlsx"
 
 data_dir = args.data_dir
 
 spk2label = {}
-spk2feats = {}
 n_folds = "1 2 3 4 5".split()
+lasso_alpha = 0.1
+
+if args.path_alphas != "":
+    path_alphas = np.array(sorted([float(a) for a in args.path_alphas.split(",")], reverse=True))
+else:
+    path_alphas = np.logspace(0, -3, 30)
 
 exp_dir = os.path.join(args.exp_root, score_name)
 
@@ -85,74 +115,6 @@ if not os.path.exists(exp_dir):
     print(exp_dir)
     os.makedirs(exp_dir)
 
-def do_resample(X, y, n_resamples=50, scales=[1,2,3,4,5,6,7,8], resample_scales=[1,2,4,6]):
-    X_balanced = None
-    y_balanced = None    
-
-    print("Resampling")
-    for g in scales:
-        n_rs = n_resamples
-        X_sub = np.copy(X[y==g])
-        y_sub = np.copy(y[y==g])
-        if len(X_sub) == 0: continue
-        
-        if g in resample_scales:
-            X_copied = None
-            while n_rs - len(X_sub) > 0:
-                if X_copied is None:
-                    X_copied = np.copy(X_sub)
-                    y_copied = np.copy(y_sub)
-                else:
-                    X_copied = np.vstack([X_copied, X_sub])
-                    y_copied = np.hstack([y_copied, y_sub])
-                n_rs -= len(X_sub)
-            
-            replace=True
-            
-            if len(X_sub) >= n_rs:
-                replace=False
-            
-            X_resampled, y_resampled = resample(X_sub,
-                                                y_sub,
-                                                replace=replace,
-                                                n_samples=n_rs,
-                                                random_state=66)
-            if X_copied is not None:
-                X_resampled = np.vstack((X_copied, X_resampled))
-                y_resampled = np.hstack((y_copied, y_resampled))
-        else:
-            X_resampled = X_sub
-            y_resampled = y_sub
-            
-        
-        if X_balanced is None or y_balanced is None:
-            X_balanced = X_resampled
-            y_balanced = y_resampled
-        else:
-            X_balanced = np.vstack((X_balanced, X_resampled))
-            y_balanced = np.hstack((y_balanced, y_resampled))
-        print(g, X_sub.shape, y_sub.shape, X_balanced.shape, y_balanced.shape)
-    
-    print("Origin", X.shape, y.shape)
-    print("Balanced", X_balanced.shape, y_balanced.shape)
-    
-    return X_balanced, y_balanced
-
-def calc_sample_weight(train_y, weight_type='balanced'):
-    classes = np.unique(train_y)
-    cw_np = compute_class_weight(class_weight=weight_type, classes=classes, y=train_y)
-    cw_tbl = {c: w for c, w in zip(classes, cw_np)}
-    
-    sample_weight = np.copy(train_y)
-    
-    for i, y in enumerate(train_y):
-        sample_weight[i] = cw_tbl[y]
-   
-    print("sample", y)
-    print("sample weight", sample_weight) 
-    return sample_weight
-    
-    
 def report(y_test, y_pred, spk_list, all_bins, cefr_bins, kfold_info, fold="Fold1"):
     print("=" * 10, "Raw data", "=" * 10)
     y_test = np.digitize(np.array(y_test), all_bins) + 1
@@ -201,19 +163,10 @@ def report(y_test, y_pred, spk_list, all_bins, cefr_bins, kfold_info, fold="Fold
     
     return acc, macro_avg, weighted_avg, kfold_info
 
-# Feature selection
-def feature_selection(X, y, bins):
-    from sklearn.ensemble import ExtraTreesClassifier
-    from sklearn.feature_selection import SelectFromModel
-    # https://scikit-learn.org/stable/modules/feature_selection.html
+# Feature selection (cached per fold, see local/selection_cache.py)
+def feature_selection(X, y, bins, fold=0, train_index=None):
     y_cefr = np.digitize(np.array(y), bins)
-    basic_clf = ExtraTreesClassifier(n_estimators=50, random_state=66)
-    basic_clf = basic_clf.fit(X, y_cefr)
-    importances = basic_clf.feature_importances_
-    std = np.std([tree.feature_importances_ for tree in basic_clf.estimators_], axis=0)
-    selector = SelectFromModel(basic_clf, prefit=True)
-    
-    return selector, importances, std
+    return fit_selector(X, y_cefr, selection_cache, fold, bins, train_index)
 
 
 #if __name__ == "__main__":
@@ -224,28 +177,14 @@ with open(os.path.join(data_dir, label_fn), "r") as fn:
         spk2label[spk] = float(grade)
 
 # feats
-feats_df = pd.read_excel(os.path.join(data_dir, model_name, feats_fn), dtype=str)
-feat_keys = [fk for fk in list(feats_df.keys())[6:] if "list" not in fk and "voiced_probs" not in fk]
-feat_keys = np.array(feat_keys)
-
-for i, spk in enumerate(feats_df["spkID"]):
-    if feats_df["part"][i] != part: continue
-    
-    feats_vec = [float(feats_df[fk][i]) for fk in feat_keys]
-    
-    if spk not in spk2feats:
-        spk2feats[spk] = [feats_vec]
-    else:
-        assert part == "2"
-        spk2feats[spk].append(feats_vec)
+# responses of the same speaker are averaged
+feat_keys, spk_feats_df = load_spk_feats(os.path.join(data_dir, model_name, feats_fn), part, agg="mean")
+selection_cache = get_selection_cache_from_args(args, os.path.join(data_dir, model_name, feats_fn), os.path.join(data_dir, label_fn), part, agg="mean")
 
 # create example
-X, y, spk_list = [], [], []
-for spk in list(spk2label.keys()):
-    feats = np.mean(np.array(spk2feats[spk]), axis=0)
-    X.append(feats)
-    y.append(spk2label[spk])
-    spk_list.append(spk)
+spk_list = list(spk2label.keys())
+X = spk_feats_df.loc[spk_list].values
+y = [spk2label[spk] for spk in spk_list]
 
 X = np.array(X)
 y = np.array(y)
@@ -268,7 +207,6 @@ infos = ["spk_id", "anno", "anno(cefr)", "pred", "pred(cefr)", "results"]
 kfold_info = {"Fold" + str(1+i):{info:[] for info in infos} for i in range(len(n_folds))}
 kfold_info["All"] = {info:[] for info in infos}
 report_titles = ["fold", "acc", "macro_precision", "macro_recall", "macro_f1-score", "weighted_precision", "weighted_recall", "weighted_f1-score"]
-report_feats = {"importances":[], "std":[], "feat_keys":[]}
 report_dict = {rt: [] for rt in report_titles}
 total_losses = {"origin":{}, "cefr":{}}
 all_predictions = None
@@ -276,9 +214,7 @@ all_annotations = None
 all_predictions_cefr = None
 all_annotations_cefr = None
 
-# TRAINING (K-FOLD)
-for i, (train_index, test_index) in enumerate(kf.split(X)):
-    
+def run_fold(i, X, y, train_index, test_index):
     kfold_dir = os.path.join(exp_dir, str(i+1))
     
     if not os.path.exists(kfold_dir):
@@ -289,28 +225,44 @@ for i, (train_index, test_index) in enumerate(kf.split(X)):
     y_train, y_test = y[train_index], y[test_index]
     
     
-    selector, importances, std = feature_selection(X_train, y_train, all_bins)
+    selector, importances, std = feature_selection(X_train, y_train, all_bins, i+1, train_index)
     select_support = selector.get_support() * 1
     select_feat_keys = feat_keys[np.nonzero(select_support)]
     print(select_feat_keys)
     
     plt_importances, plt_std, plt_feat_keys = importances[np.nonzero(select_support)], std[np.nonzero(select_support)], feat_keys[np.nonzero(select_support)]
-    report_feats["importances"].append(plt_importances)
-    report_feats["std"].append(plt_std)
-    report_feats["feat_keys"].append(plt_feat_keys)
     
     X_train = selector.transform(X_train)
     X_test = selector.transform(X_test)
     
-    if n_resamples != -1:
-        X_train, y_train = do_resample(X_train, y_train, n_resamples=n_resamples, resample_scales=[1,2,4,6,8])
+    params = {"alpha": lasso_alpha}
+    path_losses = None
+    if args.lasso_path:
+        # one warm-started path per inner fold, on the training split before resampling
+        # (copies of a speaker must not be in both parts of an inner fold)
+        path_cv = linear_model.LassoCV(alphas=path_alphas, cv=KFold(n_splits=args.search_cv, shuffle=True, random_state=66))
+        path_cv.fit(X_train, y_train)
+        params = {"alpha": path_cv.alpha_}
+        print("best alpha", path_cv.alpha_)
+        
+        # sparsity of each alpha on the whole training split (centred, as LassoCV fits the intercept)
+        _, coefs, _ = linear_model.lasso_path(X_train - X_train.mean(axis=0), y_train - y_train.mean(), alphas=path_cv.alphas_)
+        path_losses = pd.DataFrame({"alpha": path_cv.alphas_,
+                                    "rmse": np.sqrt(path_cv.mse_path_.mean(axis=1)),
+                                    "nonzero": np.count_nonzero(coefs, axis=0)})
+    
+    # search before resampling, copies of a speaker must not be in both parts of an inner fold
+    if args.search:
+        params = search_params("lasso", linear_model.Lasso(), X_train, y_train, args, len(n_folds), kfold_dir)
     
+    if n_resamples != -1:
+        X_train, y_train = do_resample(X_train, y_train, n_resamples=n_resamples, scales=[1,2,3,4,5,6,7,8], resample_scales=[1,2,4,6,8])
     
-    clf = linear_model.Lasso(alpha=0.1)
+    clf = linear_model.Lasso(**params)
     
     if args.do_sample_weight:
         sample_weight = calc_sample_weight(y_train)
-        clf.fit(X_train, y_train, sample_weight)
+        clf.fit(X_train, y_train, sample_weight=sample_weight)
     else:
        clf.fit(X_train, y_train)
     
@@ -322,40 +274,78 @@ for i, (train_index, test_index) in enumerate(kf.split(X)):
     print(coef_[np.argsort(-1 * coef_)])
     
     y_pred = clf.predict(X_test) 
-    fold_acc, macro_avg, weighted_avg, kfold_info = report(y_test, y_pred, spk_list[test_index], all_bins, cefr_bins, kfold_info, "Fold" + str(i+1))
-    total_losses["origin"][str(i+1)] = {}
-    compute_metrics(total_losses["origin"][str(i+1)], np.array(y_pred), np.array(y_test))
+    fold_info = {f: {info:[] for info in infos} for f in ["Fold" + str(i+1), "All"]}
+    fold_acc, macro_avg, weighted_avg, fold_info = report(y_test, y_pred, spk_list[test_index], all_bins, cefr_bins, fold_info, "Fold" + str(i+1))
+    fold_losses = {"origin": {}, "cefr": {}}
+    compute_metrics(fold_losses["origin"], np.array(y_pred), np.array(y_test))
     y_test_cefr = np.digitize(np.array(y_test), cefr_bins)
     y_pred_cefr = np.digitize(np.array(np.round_(y_pred * 2) / 2), cefr_bins)
-    total_losses["cefr"][str(i+1)] = {}
-    compute_metrics(total_losses["cefr"][str(i+1)], np.array(y_pred_cefr), np.array(y_test_cefr))
+    compute_metrics(fold_losses["cefr"], np.array(y_pred_cefr), np.array(y_test_cefr))
+    
+    predictions_file = os.path.join(kfold_dir, "predictions.txt")
+    
+    with io.open(predictions_file, 'w') as file:
+        predictions = '\n'.join(['{} | {}'.format(str(pred), str(target)) for pred, target in zip(y_pred, y_test)])
+        file.write(predictions)
+    
+    # visualization
+    forest_importances = pd.Series(plt_importances, index=plt_feat_keys).sort_values(ascending=False)
+    fig, ax = plt.subplots()
+    #forest_importances.plot.bar(yerr=plt_std, ax=ax)
+    forest_importances.plot.bar(ax=ax)
+    ax.set_title("Feature importances using MDI")
+    ax.set_ylabel("Mean decrease in impurity (MDI)")
+    fig.tight_layout()
+    fig.savefig(os.path.join(kfold_dir, "feats-importances_" + str(i+1)+"-fold.png"), dpi=600)
+    plt.close(fig)
+    
+    return {"acc": fold_acc, "macro_avg": macro_avg, "weighted_avg": weighted_avg, "kfold_info": fold_info, "losses": fold_losses,
+            "y_pred": y_pred, "y_test": y_test, "y_pred_cefr": y_pred_cefr, "y_test_cefr": y_test_cefr,
+            "path_losses": path_losses, "alpha": params["alpha"]}
+
+# TRAINING (K-FOLD)
+fold_results = run_folds(run_fold, X, y, list(kf.split(X)), n_jobs=args.n_jobs)
+
+if args.lasso_path:
+    # inner-CV rmse of each alpha (training splits only) and the alpha chosen in each outer fold
+    with pd.ExcelWriter(os.path.join(exp_dir, "lasso_path.xlsx")) as writer:
+        path_df = pd.concat([fold_result["path_losses"] for fold_result in fold_results]).groupby("alpha", sort=False).mean()
+        path_df.to_excel(writer, sheet_name="mean")
+        best_df = pd.DataFrame({"fold": [i+1 for i in range(len(fold_results))], "alpha": [fold_result["alpha"] for fold_result in fold_results]})
+        best_df.to_excel(writer, sheet_name="best", index=False)
+        for i, fold_result in enumerate(fold_results):
+            fold_result["path_losses"].to_excel(writer, sheet_name="Fold" + str(i+1), index=False)
+    
+    print("=" * 10, "Lasso path", "=" * 10)
+    print(path_df)
+    print(best_df)
+
+for i, fold_result in enumerate(fold_results):
+    merge_kfold_info(kfold_info, fold_result["kfold_info"])
+    total_losses["origin"][str(i+1)] = fold_result["losses"]["origin"]
+    total_losses["cefr"][str(i+1)] = fold_result["losses"]["cefr"]
+    macro_avg, weighted_avg = fold_result["macro_avg"], fold_result["weighted_avg"]
     
     report_dict["fold"].append(i+1)
-    report_dict["acc"].append(fold_acc)
+    report_dict["acc"].append(fold_result["acc"])
     report_dict["macro_precision"].append(macro_avg["precision"])
     report_dict["macro_recall"].append(macro_avg["recall"])
     report_dict["macro_f1-score"].append(macro_avg["f1-score"])
     report_dict["weighted_precision"].append(weighted_avg["precision"])
     report_dict["weighted_recall"].append(weighted_avg["recall"])
     report_dict["weighted_f1-score"].append(weighted_avg["f1-score"])
-    acc += fold_acc
-    
-    predictions_file = os.path.join(kfold_dir, "predictions.txt")
-    
-    with io.open(predictions_file, 'w') as file:
-        predictions = '\n'.join(['{} | {}'.format(str(pred), str(target)) for pred, target in zip(y_pred, y_test)])
-        file.write(predictions)
+    acc += fold_result["acc"]
     
     if all_predictions is None:
-        all_predictions = np.array(y_pred)
-        all_annotations = np.array(y_test)
-        all_predictions_cefr = y_pred_cefr
-        all_annotations_cefr = y_test_cefr
+        all_predictions = np.array(fold_result["y_pred"])
+        all_annotations = np.array(fold_result["y_test"])
+        all_predictions_cefr = fold_result["y_pred_cefr"]
+        all_annotations_cefr = fold_result["y_test_cefr"]
     else:
-        all_predictions = np.hstack((all_predictions, np.array(y_pred)))
-        all_annotations = np.hstack((all_annotations, np.array(y_test)))
-        all_predictions_cefr = np.hstack((all_predictions_cefr, y_pred_cefr))
-        all_annotations_cefr = np.hstack((all_annotations_cefr, y_test_cefr))
+        all_predictions = np.hstack((all_predictions, np.array(fold_result["y_pred"])))
+        all_annotations = np.hstack((all_annotations, np.array(fold_result["y_test"])))
+        all_predictions_cefr = np.hstack((all_predictions_cefr, fold_result["y_pred_cefr"]))
+        all_annotations_cefr = np.hstack((all_annotations_cefr, fold_result["y_test_cefr"]))
 
     
 acc /= kf.get_n_splits(X)
@@ -369,19 +359,6 @@ with pd.ExcelWriter(os.path.join(exp_dir, "kfold_detail.xlsx")) as writer:
 report_df = pd.DataFrame.from_dict(report_dict)
 report_df.to_excel(os.path.join(exp_dir, "metric_report.xlsx"), columns=report_titles, index=False)
 
-# visualization
-for i in range(len(report_feats["importances"])):
-    plt_importances, plt_std, plt_feat_keys = report_feats["importances"][i], report_feats["std"][i], report_feats["feat_keys"][i]
-    forest_importances = pd.Series(plt_importances, index=plt_feat_keys).sort_values(ascending=False)
-    fig, ax = plt.subplots()
-    #forest_importances.plot.bar(yerr=plt_std, ax=ax)
-    forest_importances.plot.bar(ax=ax)
-    ax.set_title("Feature importances using MDI")
-    ax.set_ylabel("Mean decrease in impurity (MDI)")
-    fig.tight_layout()
-    kfold_dir = os.path.join(exp_dir, str(i+1))
-    fig.savefig(os.path.join(kfold_dir, "feats-importances_" + str(i+1)+"-fold.png"), dpi=600)
-
 
 def report_losses(total_losses):
     metrics = list(total_losses[n_folds[0]].keys())
@@ -11,6 +11,9 @@ from  sklearn import preprocessing
 from scipy import stats
 
 import argparse
+import sys
+sys.path.append("./local")
+from feats_loader import load_spk_feats
 
 parser = argparse.ArgumentParser()
 
@@ -30,18 +33,22 @@ parser.add_argument("--aspect",
                     default="2",
                     type=str)
 
+# e.g., all.npz (columnar feature store, asr-esp/local/e2e_stt/feats_store.py), default: <model_name>-feats.xlsx
+parser.add_argument("--feats_fn",
+                    default="",
+                    type=str)
+
 args = parser.parse_args()
 
 # data/spoken_test_2022_jan28/grader.spk2p3s2
 model_name = args.model_name
 part = args.part
 label_fn = "grader.spk2p" + part + "s" + args.aspect
-feats_fn = model_name + "-feats.xlsx"
+feats_fn = args.feats_fn if args.feats_fn != "" else model_name + "-feats.xlsx"
 
 data_dir = args.data_dir
 
 spk2label = {}
-spk2feats = {}
 
 phd1_label = {}
 phd2_label = {}
@@ -65,22 +72,12 @@ with open(os.path.join(data_dir, label_fn), "r") as fn:
         spk2label[spk] = float(grade)
 
 # feats
-feats_df = pd.read_excel(os.path.join(data_dir, model_name, feats_fn), dtype=str)
-feat_keys = [fk for fk in list(feats_df.keys())[6:] if "list" not in fk and "voiced_probs" not in fk]
-feat_keys = np.array(feat_keys)
-
-for i, spk in enumerate(feats_df["spkID"]):
-    if feats_df["part"][i] != part: continue
-    
-    feats_vec = [float(feats_df[fk][i]) for fk in feat_keys]
-    spk2feats[spk] = feats_vec
+feat_keys, spk_feats_df = load_spk_feats(os.path.join(data_dir, model_name, feats_fn), part, agg="last")
 
 # create example
-X, y, spk_list = [], [], []
-for spk in list(spk2label.keys()):
-    X.append(spk2feats[spk])
-    y.append(spk2label[spk])
-    spk_list.append(spk)
+spk_list = list(spk2label.keys())
+X = spk_feats_df.loc[spk_list].values
+y = [spk2label[spk] for spk in spk_list]
 
 min_max_scaler = preprocessing.MinMaxScaler()
 
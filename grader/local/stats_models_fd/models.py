@@ -1,63 +1,62 @@
 from sklearn.base import BaseEstimator
+from joblib import Parallel, delayed
 import numpy as np
+import copy
+
+def _fit_binary(c, X, y, i, fit):
+    # binary subproblem "y > i"
+    classifier = copy.deepcopy(c)
+    classifier.fit(X, (y > i).astype(int), **fit)
+    return classifier
+
+def _positive_proba(clf, X):
+    # P(y > i), a subproblem may only have seen one class
+    classes = list(clf.classes_)
+    if 1 not in classes:
+        return np.zeros(len(X))
+    return clf.predict_proba(X)[:, classes.index(1)]
 
 class OrdClass(BaseEstimator):
     """
     Helper class that solves ordinal classification (classes that have an order to them eg cold,warm,hot)
     """
-    def __init__(self,classifier=None,clf_args=None):
+    def __init__(self,classifier=None,clf_args=None,n_jobs=None):
         """
         y needs to be a number that start from 0 and increments by 1
         classifier object needs to be able to return a probability
+        n_jobs: the K-1 binary classifiers are fitted in parallel (joblib)
         """
         self.classifier = classifier
         self.clfs = []
         self.clf_args = clf_args
-        self.final_prob = None
+        self.n_jobs = n_jobs
     
     def fit(self,X,y,**fit):
-        self.X = X
-        self.y = y
-        import copy
-        no_of_classifiers = np.max(self.y) #since y starts from 0
+        # X/y are not kept, they would end up in the pickled checkpoint
+        y = np.asarray(y).astype(int)
+        no_of_classifiers = int(np.max(y)) #since y starts from 0
         self.classes_ = list(range(no_of_classifiers+1))
         if isinstance(self.clf_args,list):
             #for pipelines
             c = self.classifier(self.clf_args)
         elif isinstance(self.clf_args,dict):
             #for normal estimators
-             c = self.classifier(**self.clf_args)
-        for i in range(no_of_classifiers):
-            # make a copy of y because we want to change the values of y
-            copy_y = np.copy(self.y)
-            # make a binary classification here
-            copy_y[copy_y<=i] = 0
-            copy_y[copy_y>i] = 1
-            classifier = copy.deepcopy(c)
-            classifier.fit(self.X,copy_y,**fit)
-            self.clfs.append(classifier)
+            c = self.classifier(**self.clf_args)
+        else:
+            c = self.classifier()
+        self.clfs = Parallel(n_jobs=self.n_jobs)(delayed(_fit_binary)(c, X, y, i, fit) for i in range(no_of_classifiers))
         return self
     
     def predict_proba(self,test):
-        prob_list = []
-        final_prob = []
-        length = len(self.clfs)
-        for clf in self.clfs:
-            prob_list.append(clf.predict_proba(test)[:,1])
-        for i in range(length+1):
-            if i == 0:
-                final_prob.append(1-prob_list[i])
-            elif i == length:
-                final_prob.append(prob_list[i-1])
-            else:
-                final_prob.append(prob_list[i-1]-prob_list[i])
-        answer = np.array(final_prob).transpose()
-        self.final_prob= answer
-        return answer
+        # P(y > i) of each binary classifier, (n, K-1)
+        n = len(test)
+        greater_prob = np.column_stack([_positive_proba(clf, test) for clf in self.clfs]) if len(self.clfs) > 0 else np.zeros((n, 0))
+        # P(y > -1) = 1, P(y > K-1) = 0, P(y = i) = P(y > i-1) - P(y > i)
+        cum_prob = np.hstack([np.ones((n, 1)), greater_prob, np.zeros((n, 1))])
+        return cum_prob[:, :-1] - cum_prob[:, 1:]
     
     def predict(self,test):
-        self.predict_proba(test)
-        return np.argmax(self.final_prob,axis=1)
+        return np.argmax(self.predict_proba(test),axis=1)
     
     def score(self,X,y,sample_weight=None):
         from sklearn.metrics import accuracy_score
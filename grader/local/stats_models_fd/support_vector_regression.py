@@ -18,6 +18,7 @@ import matplotlib.pyplot as plt
 
 from tqdm import tqdm
 import argparse
+from feats_loader import load_utt_feats, save_feats_info
 
 from utils import read_corpus
 from metrics_cpu import compute_metrics
@@ -82,22 +83,16 @@ valid_levels, valid_info = read_corpus(data_dir + '/valid.tsv', num_labels, scor
 test_levels, test_info = read_corpus(data_dir + '/test.tsv', num_labels, score_name, corpus)
 
 # prepare feature matrix from feats_path
-feats_df = pd.read_excel(feats_path, dtype=str)
-feat_keys = [fk for fk in list(feats_df.keys())[6:] if "list" not in fk and "voiced_probs" not in fk]
-feat_keys = np.array(feat_keys)
-feats_mat_dict = {}
-
 # 在teemi中，text_id在前處理時(抽特徵)會被處理成fname。
-for i, text_id in enumerate(feats_df["fname"]):
-    if text_id in feats_mat_dict:
-        print("[Prepare Feats] The ID {} shouldn't be unique. Remember to recheck the feature file {} .".format(text_id, feats_path))
-        exit(0)
-    feats_vec = [float(feats_df[fk][i]) for fk in feat_keys]
-    feats_mat_dict[text_id]  = feats_vec
+try:
+    feat_keys, utt_feats_df = load_utt_feats(feats_path, id_key="fname")
+except ValueError as e:
+    print("[Prepare Feats] {}".format(e))
+    exit(0)
 
-train_feats = [ feats_mat_dict[text_id] for text_id in train_info["ids"]]
-valid_feats = [ feats_mat_dict[text_id] for text_id in valid_info["ids"]]
-test_feats = [ feats_mat_dict[text_id] for text_id in test_info["ids"]]
+train_feats = utt_feats_df.loc[train_info["ids"]].values
+valid_feats = utt_feats_df.loc[valid_info["ids"]].values
+test_feats = utt_feats_df.loc[test_info["ids"]].values
 
 # NOTE: valid == test
 X_train, X_test = train_feats, valid_feats
@@ -141,6 +136,7 @@ compute_metrics(total_losses, y_test, y_pred)
 
 model_name = "MLR-mcrmse={}.ckpt".format(float(total_losses["mcrmse"]))
 joblib.dump(model, os.path.join(model_dir, model_name))
+save_feats_info(model_dir, model_name, score_name, feat_keys, num_labels=num_labels)
 model = joblib.load(os.path.join(model_dir, model_name))
 
 log_dir = exp_dir